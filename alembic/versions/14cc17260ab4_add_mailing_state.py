@@ -0,0 +1,70 @@
+"""add mailing state
+
+Revision ID: 14cc17260ab4
+Revises: c6b62e2ac22a
+Create Date: 2026-10-18 19:02:44.731905
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '14cc17260ab4'
+down_revision = 'c6b62e2ac22a'
+branch_labels = None
+depends_on = None
+
+
+mailing_state = postgresql.ENUM('scheduled', 'running', 'finished', 'cancelled', name='mailingstate')
+
+
+def rebuild_mailing_stats() -> None:
+    op.execute("DELETE FROM mailing_stats")
+    op.execute(
+        "INSERT INTO mailing_stats (mailing_id, status, count) "
+        "SELECT mailing_id, status, count(*) FROM messages GROUP BY mailing_id, status"
+    )
+
+
+def upgrade() -> None:
+    mailing_state.create(op.get_bind())
+    op.add_column('mailings', sa.Column('state', mailing_state, server_default='scheduled', nullable=False))
+    op.execute("UPDATE mailings SET state = 'finished' WHERE end_time <= now()")
+    op.create_index('ix_mailings_state_start_time', 'mailings', ['state', 'start_time'], unique=False)
+
+    # Restarted sendings used to create messages for the same clients again.
+    # Duplicates are moved to side table, so downgrade can return them
+    op.execute(
+        "CREATE TABLE messages_duplicates AS "
+        "SELECT id, created_at, status::text AS status, mailing_id, client_id FROM messages WHERE id IN ("
+        "SELECT id FROM (SELECT id, row_number() OVER ("
+        "PARTITION BY mailing_id, client_id ORDER BY status = 'delivered' DESC, id"
+        ") AS row_number FROM messages) AS numbered_messages WHERE row_number > 1)"
+    )
+    op.execute("DELETE FROM messages WHERE id IN (SELECT id FROM messages_duplicates)")
+    rebuild_mailing_stats()
+
+    # Unique index is built without locking writes of messages, then it becomes constraint
+    with op.get_context().autocommit_block():
+        op.create_index('uq_messages_mailing_id_client_id', 'messages', ['mailing_id', 'client_id'],
+                        unique=True, postgresql_concurrently=True)
+    op.execute(
+        "ALTER TABLE messages ADD CONSTRAINT uq_messages_mailing_id_client_id "
+        "UNIQUE USING INDEX uq_messages_mailing_id_client_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_messages_mailing_id_client_id', 'messages', type_='unique')
+    op.execute(
+        "INSERT INTO messages (id, created_at, status, mailing_id, client_id) "
+        "SELECT id, created_at, status::messagestatus, mailing_id, client_id FROM messages_duplicates"
+    )
+    op.drop_table('messages_duplicates')
+    rebuild_mailing_stats()
+    op.drop_index('ix_mailings_state_start_time', table_name='mailings')
+    op.drop_column('mailings', 'state')
+    mailing_state.drop(op.get_bind())
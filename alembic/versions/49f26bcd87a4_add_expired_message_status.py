@@ -0,0 +1,37 @@
+"""add expired message status
+
+Revision ID: 49f26bcd87a4
+Revises: fb3a25c91e4a
+Create Date: 2026-10-18 21:26:50.917344
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+
+# revision identifiers, used by Alembic.
+revision = '49f26bcd87a4'
+down_revision = 'fb3a25c91e4a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE messagestatus ADD VALUE IF NOT EXISTS 'expired'")
+
+
+def downgrade() -> None:
+    op.execute("UPDATE messages SET status = 'not_delivered' WHERE status = 'expired'")
+    op.execute(
+        "INSERT INTO mailing_stats (mailing_id, status, count) "
+        "SELECT mailing_id, 'not_delivered', count FROM mailing_stats WHERE status = 'expired' "
+        "ON CONFLICT (mailing_id, status) DO UPDATE SET count = mailing_stats.count + excluded.count"
+    )
+    op.execute("DELETE FROM mailing_stats WHERE status = 'expired'")
+    op.execute("ALTER TYPE messagestatus RENAME TO messagestatus_old")
+    op.execute("CREATE TYPE messagestatus AS ENUM ('delivered', 'not_delivered', 'failed')")
+    op.execute("ALTER TABLE messages ALTER COLUMN status TYPE messagestatus USING status::text::messagestatus")
+    op.execute("ALTER TABLE mailing_stats ALTER COLUMN status TYPE messagestatus USING status::text::messagestatus")
+    op.execute("DROP TYPE messagestatus_old")
@@ -0,0 +1,35 @@
+"""add mailing stats
+
+Revision ID: 976c74a1b405
+Revises: b2271ceb0e62
+Create Date: 2026-10-18 15:32:08.164318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '976c74a1b405'
+down_revision = 'b2271ceb0e62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('mailing_stats',
+    sa.Column('mailing_id', sa.Integer(), nullable=False),
+    sa.Column('status', postgresql.ENUM(name='messagestatus', create_type=False), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('mailing_id', 'status')
+    )
+    op.execute(
+        "INSERT INTO mailing_stats (mailing_id, status, count) "
+        "SELECT mailing_id, status, count(*) FROM messages GROUP BY mailing_id, status"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('mailing_stats')
@@ -0,0 +1,30 @@
+"""add failed message status
+
+Revision ID: b2271ceb0e62
+Revises: e2df64452297
+Create Date: 2026-10-18 12:04:31.512270
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2271ceb0e62'
+down_revision = 'e2df64452297'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("ALTER TYPE messagestatus ADD VALUE IF NOT EXISTS 'failed'")
+
+
+def downgrade() -> None:
+    op.execute("UPDATE messages SET status = 'not_delivered' WHERE status = 'failed'")
+    op.execute("ALTER TYPE messagestatus RENAME TO messagestatus_old")
+    op.execute("CREATE TYPE messagestatus AS ENUM ('delivered', 'not_delivered')")
+    op.execute("ALTER TABLE messages ALTER COLUMN status TYPE messagestatus USING status::text::messagestatus")
+    op.execute("DROP TYPE messagestatus_old")
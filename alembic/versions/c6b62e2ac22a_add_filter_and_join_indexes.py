@@ -0,0 +1,46 @@
+"""add filter and join indexes
+
+Revision ID: c6b62e2ac22a
+Revises: 976c74a1b405
+Create Date: 2026-10-18 15:58:41.730215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6b62e2ac22a'
+down_revision = '976c74a1b405'
+branch_labels = None
+depends_on = None
+
+
+indexes = [
+    ('ix_messages_mailing_id_status', 'messages', ['mailing_id', 'status']),
+    ('ix_clients_phone_number', 'clients', ['phone_number']),
+    ('ix_clients_phone_operator_code', 'clients', ['phone_operator_code']),
+    ('ix_clients_tag_id', 'clients', ['tag_id']),
+    ('ix_mailings_and_mailing_tags_table_mailing_id', 'mailings_and_mailing_tags_table', ['mailing_id']),
+    ('ix_mailings_and_mailing_tags_table_mailing_tag_id', 'mailings_and_mailing_tags_table', ['mailing_tag_id']),
+    ('ix_mailings_and_operator_codes_table_mailing_id', 'mailings_and_operator_codes_table', ['mailing_id']),
+    (
+        'ix_mailings_and_operator_codes_table_operator_code_id',
+        'mailings_and_operator_codes_table',
+        ['mailing_mobile_operator_codes_id'],
+    ),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY doesn't lock writes of big tables, but can't run inside transaction
+    with op.get_context().autocommit_block():
+        for index_name, table_name, columns in indexes:
+            op.create_index(index_name, table_name, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for index_name, table_name, _ in reversed(indexes):
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
@@ -0,0 +1,29 @@
+"""add leases
+
+Revision ID: fb3a25c91e4a
+Revises: 14cc17260ab4
+Create Date: 2026-10-18 20:11:37.408256
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+
+# revision identifiers, used by Alembic.
+revision = 'fb3a25c91e4a'
+down_revision = '14cc17260ab4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('mailings', sa.Column('leased_by', sa.String(), nullable=True))
+    op.add_column('mailings', sa.Column('lease_expires_at', sa.TIMESTAMP(timezone=True), nullable=True))
+    op.add_column('messages', sa.Column('lease_expires_at', sa.TIMESTAMP(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('messages', 'lease_expires_at')
+    op.drop_column('mailings', 'lease_expires_at')
+    op.drop_column('mailings', 'leased_by')
@@ -0,0 +1,41 @@
+"""add mailing delivery window
+
+Revision ID: fba0ec032fb1
+Revises: 49f26bcd87a4
+Create Date: 2026-10-18 22:03:15.482617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlalchemy_utils
+
+
+# revision identifiers, used by Alembic.
+revision = 'fba0ec032fb1'
+down_revision = '49f26bcd87a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('mailings', sa.Column('delivery_window_start', sa.Time(), nullable=True))
+    op.add_column('mailings', sa.Column('delivery_window_end', sa.Time(), nullable=True))
+    op.add_column('messages', sa.Column('utc_offset', sa.Integer(), server_default='0', nullable=False))
+
+    # Index of messages is replaced without locking writes, new one is built before old one is dropped
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_mailing_id_status_utc_offset', 'messages', ['mailing_id', 'status', 'utc_offset'],
+                        unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_messages_mailing_id_status', table_name='messages', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index('ix_messages_mailing_id_status', 'messages', ['mailing_id', 'status'],
+                        unique=False, postgresql_concurrently=True)
+        op.drop_index('ix_messages_mailing_id_status_utc_offset', table_name='messages',
+                      postgresql_concurrently=True)
+
+    op.drop_column('messages', 'utc_offset')
+    op.drop_column('mailings', 'delivery_window_end')
+    op.drop_column('mailings', 'delivery_window_start')
@@ -0,0 +1,116 @@
+"""
+Compares latency of GET /client/{id} behind three BaseHTTPMiddleware layers and behind RequestLoggingMiddleware.
+Client is returned by stubbed service, so only request handling is measured, log records aren't written:
+
+    python -m benchmarks.middleware
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import Any, Awaitable, Callable
+from uuid import uuid4
+
+from fastapi import FastAPI, Request, Response
+from httpx import AsyncClient
+from loguru import logger
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from src import context
+from src.clients import service as clients_service
+from src.clients.router import router as clients_router
+from src.clients.schema import Client
+from src.dependencies import get_db_stub
+from src.mailings.schema import MailingTag
+from src.middleware import RequestLoggingMiddleware
+
+
+CallNext = Callable[[Request], Awaitable[Response]]
+
+CLIENT = Client(
+    id=1,
+    phone_number="+79009999999",
+    phone_operator_code=900,
+    timezone="Europe/Amsterdam",
+    tag=MailingTag(id=1, text="benchmark tag"),
+)
+
+
+async def add_request_uuid(request: Request, call_next: CallNext) -> Response:
+    context.request_uuid.set(uuid4())
+    return await call_next(request)
+
+
+async def log_raw_request(request: Request, call_next: CallNext) -> Response:
+    request_uuid = context.request_uuid.get()
+    logger.bind(
+        api_received_request=True,
+        request_uuid=request_uuid.hex if request_uuid else None,
+        request_method=request.method,
+        request_method_version=request["http_version"],
+        request_type=request["type"].upper(),
+        client_host=request.client.host if request.client else None,
+        client_port=request.client.port if request.client else None,
+    ).info("API Request received")
+    return await call_next(request)
+
+
+async def log_response(request: Request, call_next: CallNext) -> Response:
+    response = await call_next(request)
+    request_uuid = context.request_uuid.get()
+    logger.bind(
+        api_sent_response=True,
+        request_uuid=request_uuid.hex if request_uuid else None,
+        status_code=response.status_code,
+        content_type=response.headers.get("content-type"),
+    ).info("API Response sent")
+    return response
+
+
+def create_app(middleware: str) -> FastAPI:
+    app = FastAPI()
+    app.include_router(clients_router)
+    if middleware == "BaseHTTPMiddleware":
+        app.add_middleware(BaseHTTPMiddleware, dispatch=log_response)
+        app.add_middleware(BaseHTTPMiddleware, dispatch=log_raw_request)
+        app.add_middleware(BaseHTTPMiddleware, dispatch=add_request_uuid)
+    else:
+        app.add_middleware(RequestLoggingMiddleware)
+    app.dependency_overrides[get_db_stub] = lambda: None
+    return app
+
+
+async def get_client_by_id(*args: Any) -> Client:
+    return CLIENT
+
+
+async def measure(middleware: str, requests: int) -> list[float]:
+    latencies = []
+    async with AsyncClient(app=create_app(middleware), base_url="http://localhost:8000") as client:
+        for _ in range(requests // 10):
+            await client.get(f"client/{CLIENT.id}")
+
+        for _ in range(requests):
+            started_at = time.perf_counter()
+            response = await client.get(f"client/{CLIENT.id}")
+            latencies.append(time.perf_counter() - started_at)
+            assert response.status_code == 200
+    return latencies
+
+
+async def run(requests: int) -> None:
+    logger.remove()
+    clients_service.get_client_by_id = get_client_by_id  # type: ignore[assignment]
+
+    print(f"{'middleware':<26}{'p50, us':>10}{'p99, us':>10}")
+    for middleware in ("BaseHTTPMiddleware", "RequestLoggingMiddleware"):
+        percentiles = statistics.quantiles(await measure(middleware, requests), n=100)
+        print(f"{middleware:<26}{percentiles[49] * 1_000_000:>10.0f}{percentiles[98] * 1_000_000:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare latency of request logging middlewares")
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.requests))
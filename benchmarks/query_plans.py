@@ -0,0 +1,78 @@
+"""
+Prints plans of hot queries. Compare output before and after indexes migration:
+
+    alembic downgrade 976c74a1b405 && python -m benchmarks.query_plans --seed
+    alembic upgrade head && python -m benchmarks.query_plans
+"""
+import argparse
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from src.database import get_async_engine
+
+
+SEED_QUERIES = [
+    "INSERT INTO mailing_tags (text) SELECT 'benchmark tag ' || i FROM generate_series(1, 100) i "
+    "ON CONFLICT DO NOTHING",
+
+    "WITH tags AS (SELECT array_agg(id) AS ids FROM mailing_tags) "
+    "INSERT INTO clients (phone_number, phone_operator_code, tag_id, timezone) "
+    "SELECT '+7' || (9000000000 + i), 900 + i % 100, tags.ids[1 + i % array_length(tags.ids, 1)], 'Europe/Amsterdam' "
+    "FROM generate_series(1, :clients) i, tags",
+
+    "INSERT INTO messages (created_at, status, mailing_id, client_id) "
+    "SELECT now(), (ARRAY['delivered', 'not_delivered', 'failed']::messagestatus[])[1 + i % 3], 1 + i % 100, i "
+    "FROM generate_series(1, :messages) i",
+
+    "INSERT INTO mailings_and_mailing_tags_table (mailing_id, mailing_tag_id) "
+    "SELECT 1 + i % 100, id FROM mailing_tags, generate_series(1, 100) i",
+]
+
+QUERIES = {
+    "Messages of mailing with status":
+        "SELECT * FROM messages WHERE mailing_id = 1 AND status = 'delivered' ORDER BY id LIMIT 1000",
+    "Clients by operator codes":
+        "SELECT * FROM clients WHERE phone_operator_code IN (900, 910)",
+    "Clients by tag":
+        "SELECT * FROM clients WHERE tag_id = (SELECT min(id) FROM mailing_tags)",
+    "Client by phone number":
+        "SELECT * FROM clients WHERE phone_number = '+79000000001'",
+    "Tags of mailing":
+        "SELECT mailing_tags.* FROM mailing_tags JOIN mailings_and_mailing_tags_table "
+        "ON mailing_tags.id = mailings_and_mailing_tags_table.mailing_tag_id "
+        "WHERE mailings_and_mailing_tags_table.mailing_id = 1",
+    "Mailings of tag":
+        "SELECT mailing_id FROM mailings_and_mailing_tags_table "
+        "WHERE mailing_tag_id = (SELECT min(id) FROM mailing_tags)",
+    "Operator codes of mailing":
+        "SELECT mailing_mobile_operator_codes_id FROM mailings_and_operator_codes_table WHERE mailing_id = 1",
+}
+
+
+async def seed(conn: AsyncConnection, clients: int, messages: int) -> None:
+    for query in SEED_QUERIES:
+        await conn.execute(text(query), {"clients": clients, "messages": messages})
+    await conn.execute(text("ANALYZE"))
+
+
+async def print_query_plans(seed_database: bool, clients: int, messages: int) -> None:
+    async with get_async_engine().begin() as conn:
+        if seed_database:
+            await seed(conn, clients, messages)
+
+        for name, query in QUERIES.items():
+            plan = (await conn.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {query}"))).scalars().all()
+            print(f"{name}:\n{query}")
+            print("\n".join(plan), end="\n\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Print plans of hot queries")
+    parser.add_argument("--seed", action="store_true", help="fill database with generated rows before")
+    parser.add_argument("--clients", type=int, default=1_000_000)
+    parser.add_argument("--messages", type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    asyncio.run(print_query_plans(args.seed, args.clients, args.messages))
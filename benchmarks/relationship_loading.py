@@ -0,0 +1,90 @@
+"""
+Compares loading strategies of Client.tag on audience resolution query:
+
+    python -m benchmarks.relationship_loading --seed
+"""
+import argparse
+import asyncio
+import time
+from typing import Any
+
+from sqlalchemy import event, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload, subqueryload
+
+from src.clients import models as clients_models
+from src.database import get_async_engine
+
+
+STRATEGIES = {
+    "subqueryload": subqueryload,
+    "selectinload": selectinload,
+    "joinedload": joinedload,
+}
+
+SEED_QUERIES = [
+    "INSERT INTO mailing_tags (text) SELECT 'benchmark tag ' || i FROM generate_series(1, 100) i "
+    "ON CONFLICT DO NOTHING",
+
+    "WITH tags AS (SELECT array_agg(id) AS ids FROM mailing_tags) "
+    "INSERT INTO clients (phone_number, phone_operator_code, tag_id, timezone) "
+    "SELECT '+7' || (9000000000 + i), 900 + i % 100, tags.ids[1 + i % array_length(tags.ids, 1)], 'Europe/Amsterdam' "
+    "FROM generate_series(1, :clients) i, tags",
+]
+
+
+async def seed(clients: int) -> None:
+    async with get_async_engine().begin() as conn:
+        for query in SEED_QUERIES:
+            await conn.execute(text(query), {"clients": clients})
+        await conn.execute(text("ANALYZE"))
+
+
+async def measure(strategy: str, phone_codes: list[int], repeats: int) -> tuple[float, int, int]:
+    engine = get_async_engine()
+    statements_count = 0
+
+    def count_statement(*args: Any) -> None:
+        nonlocal statements_count
+        statements_count += 1
+
+    event.listen(engine.sync_engine, "before_cursor_execute", count_statement)
+    stmt = select(clients_models.Client) \
+        .where(clients_models.Client.phone_operator_code.in_(phone_codes)) \
+        .options(STRATEGIES[strategy](clients_models.Client.tag))
+
+    elapsed_time = 0.0
+    clients_count = 0
+    try:
+        for _ in range(repeats):
+            async with AsyncSession(engine) as db:
+                started_at = time.perf_counter()
+                clients = (await db.execute(stmt)).scalars().all()
+                tags_texts = [client.tag.text for client in clients]
+                elapsed_time += time.perf_counter() - started_at
+                clients_count = len(tags_texts)
+    finally:
+        event.remove(engine.sync_engine, "before_cursor_execute", count_statement)
+
+    return elapsed_time / repeats, statements_count // repeats, clients_count
+
+
+async def run(seed_database: bool, clients: int, repeats: int) -> None:
+    if seed_database:
+        await seed(clients)
+
+    phone_codes = list(range(900, 1000))
+    print(f"{'strategy':<15}{'clients':>10}{'queries':>10}{'seconds':>10}")
+    for strategy in STRATEGIES:
+        seconds, queries, clients_count = await measure(strategy, phone_codes, repeats)
+        print(f"{strategy:<15}{clients_count:>10}{queries:>10}{seconds:>10.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare loading strategies of Client.tag")
+    parser.add_argument("--seed", action="store_true", help="fill database with generated clients before")
+    parser.add_argument("--clients", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.seed, args.clients, args.repeats))
@@ -0,0 +1,150 @@
+import codecs
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Callable
+
+from . import schema as clients_schema
+
+
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+CSV_CONTENT_TYPE = "text/csv"
+
+CSV_COLUMNS = ["id", "phone_number", "phone_operator_code", "timezone", "tag"]
+
+ClientsRows = AsyncIterator[tuple[int, dict[str, Any]] | clients_schema.ClientImportError]
+
+
+def create_row_error(row_number: int, message: str) -> clients_schema.ClientImportError:
+    return clients_schema.ClientImportError(row=row_number, detail=[{"loc": [], "msg": message, "type": "value_error"}])
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def parse_ndjson(lines: AsyncIterator[str]) -> ClientsRows:
+    row_number = 0
+    async for line in lines:
+        row_number += 1
+        if not line.strip():
+            continue
+
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield create_row_error(row_number, f"Invalid JSON: {e}")
+            continue
+
+        if not isinstance(row, dict):
+            yield create_row_error(row_number, "Row must be JSON object")
+            continue
+
+        yield row_number, row
+
+
+# Like csv, quote opens value only at its start, stray quotes inside unquoted values are kept as is
+def is_quoted_value_open(line: str, in_quotes: bool) -> bool:
+    field_start = not in_quotes
+    quote_closed = False
+    for char in line:
+        if in_quotes:
+            if char == '"':
+                in_quotes = False
+                quote_closed = True
+            continue
+
+        # Quote right after closing one is escaped quote inside value
+        if char == '"' and (field_start or quote_closed):
+            in_quotes = True
+        field_start = char == ","
+        quote_closed = False
+    return in_quotes
+
+
+async def parse_csv(lines: AsyncIterator[str]) -> ClientsRows:
+    header = None
+    row_number = 0
+    record_lines: list[str] = []
+    in_quotes = False
+    async for line in lines:
+        row_number += 1
+        if not record_lines and not line.strip():
+            continue
+
+        # Quoted field can contain newlines, record lasts until its quotes are closed
+        record_lines.append(line)
+        in_quotes = is_quoted_value_open(line, in_quotes)
+        if in_quotes:
+            continue
+        record = "\n".join(record_lines)
+        record_row_number = row_number - len(record_lines) + 1
+        record_lines = []
+
+        values = next(csv.reader([record]))
+        if not header:
+            header = values
+            continue
+
+        if len(values) != len(header):
+            yield create_row_error(record_row_number, f"Row must contain {len(header)} values")
+            continue
+
+        row: dict[str, Any] = dict(zip(header, values))
+        if "tag" in row:
+            row["tag"] = {"text": row["tag"]}
+        yield record_row_number, row
+
+    if record_lines:
+        yield create_row_error(row_number - len(record_lines) + 1, "Quoted value isn't closed")
+
+
+PARSERS: dict[str, Callable[[AsyncIterator[str]], ClientsRows]] = {
+    NDJSON_CONTENT_TYPE: parse_ndjson,
+    CSV_CONTENT_TYPE: parse_csv,
+}
+
+
+def parse_clients(chunks: AsyncIterator[bytes], content_type: str) -> ClientsRows:
+    return PARSERS[content_type](iter_lines(chunks))
+
+
+CONTENT_TYPES = {
+    clients_schema.ClientsFormat.ndjson: NDJSON_CONTENT_TYPE,
+    clients_schema.ClientsFormat.csv: CSV_CONTENT_TYPE,
+}
+
+
+def format_ndjson(clients: list[clients_schema.Client]) -> str:
+    return "".join(f"{client.json(exclude={'tag': {'id'}})}\n" for client in clients)
+
+
+def format_csv(clients: list[clients_schema.Client]) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\n")
+    writer.writerows(
+        (client.id, client.phone_number, client.phone_operator_code, client.timezone, client.tag.text)
+        for client in clients
+    )
+    return output.getvalue()
+
+
+async def format_clients(clients_chunks: AsyncIterator[list[clients_schema.Client]],
+                         clients_format: clients_schema.ClientsFormat) -> AsyncIterator[str]:
+
+    if clients_format == clients_schema.ClientsFormat.csv:
+        yield f"{','.join(CSV_COLUMNS)}\n"
+
+    formatter = format_csv if clients_format == clients_schema.ClientsFormat.csv else format_ndjson
+    async for clients in clients_chunks:
+        yield formatter(clients)
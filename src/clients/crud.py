@@ -1,9 +1,10 @@
-from typing import Iterable
+from typing import AsyncIterator, Iterable, Sequence
 
-from sqlalchemy_utils import PhoneNumber
+from sqlalchemy_utils import PhoneNumber, PhoneNumberType
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.orm import selectinload
+from sqlalchemy import select, or_
+from sqlalchemy.orm import contains_eager, joinedload
+from sqlalchemy.sql import Select
 
 from src.mailings import crud as mailings_crud
 from src.mailings import schema as mailings_schema
@@ -27,7 +28,7 @@ async def create_client(db: AsyncSession, client: clients_schema.ClientIn) -> mo
 
     db.add(db_client)
     await db.commit()
-    await db.refresh(db_client)
+    await get_client_by_id(db, db_client.id)
     return db_client
 
 
@@ -49,28 +50,99 @@ async def create_clients(db: AsyncSession, clients: Iterable[clients_schema.Clie
     db.add_all(db_clients)
     await db.commit()
 
-    for db_client in db_clients:
-        await db.refresh(db_client)
+    await db.execute(
+        select(models.Client)
+        .where(models.Client.id.in_([db_client.id for db_client in db_clients]))
+        .options(joinedload(models.Client.tag))
+        .execution_options(populate_existing=True)
+    )
 
     return db_clients
 
 
+async def copy_clients(db: AsyncSession, clients: Sequence[clients_schema.ClientIn]) -> int:
+    tags = await mailings_crud.get_or_create_mailing_tags(db, (client.tag.text for client in clients))
+    tags_ids = {tag.text: tag.id for tag in tags}
+    phone_number_type = PhoneNumberType()
+
+    records = [
+        (
+            phone_number_type.process_bind_param(client.phone_number, None),
+            client.phone_operator_code,
+            tags_ids[client.tag.text],
+            client.timezone,
+        ) for client in clients
+    ]
+
+    asyncpg_connection = (await (await db.connection()).get_raw_connection()).driver_connection
+    assert asyncpg_connection is not None
+    await asyncpg_connection.copy_records_to_table(
+        models.Client.__tablename__,
+        records=records,
+        columns=["phone_number", "phone_operator_code", "tag_id", "timezone"],
+    )
+    await db.commit()
+    return len(records)
+
+
 async def get_client_by_id(db: AsyncSession, client_id: int) -> models.Client | None:
-    return await db.get(models.Client, client_id)
+    return await db.get(models.Client, client_id, options=[joinedload(models.Client.tag)], populate_existing=True)
+
+
+async def get_clients_by_ids(db: AsyncSession, clients_ids: Iterable[int]) -> list[models.Client]:
+    return list((await db.execute(select(models.Client).where(
+        models.Client.id.in_(set(clients_ids))
+    ).options(joinedload(models.Client.tag)))).scalars().all())
 
 
 async def get_client_by_phone_number(db: AsyncSession, phone_number: int) -> models.Client | None:
     return (await db.execute(select(models.Client).filter(
         models.Client.phone_number == phone_number
-    ))).scalars().first()
+    ).options(joinedload(models.Client.tag)))).scalars().first()
+
+
+def _select_clients(tag: str | None = None,
+                    phone_operator_code: int | None = None,
+                    after_id: int | None = None,
+                    timezone: str | None = None) -> Select[tuple[models.Client]]:
+
+    stmt = select(models.Client).join(models.Client.tag).options(contains_eager(models.Client.tag))
+    if tag is not None:
+        stmt = stmt.where(MailingTag.text == tag)
+    if phone_operator_code is not None:
+        stmt = stmt.where(models.Client.phone_operator_code == phone_operator_code)
+    if timezone is not None:
+        stmt = stmt.where(models.Client.timezone == timezone)
+    if after_id is not None:
+        stmt = stmt.where(models.Client.id > after_id)
+    return stmt.order_by(models.Client.id)
+
+
+async def get_clients(db: AsyncSession,
+                      skip: int = 0,
+                      limit: int = 100,
+                      after_id: int | None = None,
+                      tag: str | None = None,
+                      phone_operator_code: int | None = None,
+                      timezone: str | None = None) -> list[models.Client]:
+
+    stmt = _select_clients(tag, phone_operator_code, after_id, timezone).offset(skip).limit(limit)
+    return list((await db.execute(stmt)).scalars().all())
+
 
+async def stream_clients(db: AsyncSession,
+                         tag: str | None,
+                         phone_operator_code: int | None,
+                         chunk_size: int) -> AsyncIterator[list[models.Client]]:
 
-async def get_clients(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[models.Client]:
-    return list((await db.execute(select(models.Client).offset(skip).limit(limit))).scalars().all())
+    stmt = _select_clients(tag, phone_operator_code).execution_options(yield_per=chunk_size)
+
+    async for clients_chunk in (await db.stream_scalars(stmt)).partitions():
+        yield list(clients_chunk)
 
 
 async def update_client(db: AsyncSession, client: clients_schema.ClientInWithID) -> models.Client | None:
-    db_client = await db.get(models.Client, client.id)
+    db_client = await get_client_by_id(db, client.id)
     if not db_client:
         return None
     new_tag = await mailings_crud.get_mailing_tag(db, client.tag.text) or \
@@ -83,7 +155,7 @@ async def update_client(db: AsyncSession, client: clients_schema.ClientInWithID)
     db_client.timezone = client.timezone
 
     await db.commit()
-    await db.refresh(db_client)
+    await get_client_by_id(db, db_client.id)
 
     return db_client
 
@@ -98,23 +170,39 @@ async def delete_client(db: AsyncSession, client_id: int) -> models.Client | Non
 
 
 async def get_clients_by_tag(db: AsyncSession, tag: mailings_schema.MailingTag) -> list[models.Client]:
-    stmt = select(models.Client).join(MailingTag).filter(MailingTag.id == tag.id)
+    stmt = select(models.Client).join(models.Client.tag).filter(MailingTag.id == tag.id) \
+        .options(contains_eager(models.Client.tag))
     return list((await db.execute(stmt)).scalars().all())
 
 
 async def get_clients_by_tags(db: AsyncSession, tags: list[mailings_schema.MailingTag]) -> list[models.Client]:
     tags_ids = map(lambda x: x.id, tags)
-    stmt = select(models.Client).join(MailingTag).where(MailingTag.id.in_(tags_ids))
+    stmt = select(models.Client).join(models.Client.tag).where(MailingTag.id.in_(tags_ids)) \
+        .options(contains_eager(models.Client.tag))
     return list((await db.scalars(stmt)).all())
 
 
 async def get_clients_by_phone_code(db: AsyncSession, phone_code: int) -> list[models.Client]:
     return list((await db.execute(select(models.Client).where(
         models.Client.phone_operator_code == phone_code
-    ))).scalars().all())
+    ).options(joinedload(models.Client.tag)))).scalars().all())
 
 
 async def get_clients_by_phone_codes(db: AsyncSession, phone_codes: Iterable[int]) -> list[models.Client]:
     return list((await db.execute(select(models.Client).where(
         models.Client.phone_operator_code.in_(set(phone_codes))
-    ))).scalars().all())
+    ).options(joinedload(models.Client.tag)))).scalars().all())
+
+
+async def stream_clients_by_tags_or_phone_codes(db: AsyncSession,
+                                                tags: Iterable[mailings_schema.MailingTag],
+                                                phone_codes: Iterable[int],
+                                                chunk_size: int) -> AsyncIterator[list[models.Client]]:
+
+    stmt = select(models.Client).where(or_(
+        models.Client.tag_id.in_([tag.id for tag in tags]),
+        models.Client.phone_operator_code.in_(set(phone_codes)),
+    )).options(joinedload(models.Client.tag)).order_by(models.Client.id).execution_options(yield_per=chunk_size)
+
+    async for clients_chunk in (await db.stream_scalars(stmt)).partitions():
+        yield list(clients_chunk)
@@ -12,8 +12,8 @@ class Client(Base):
     __tablename__ = "clients"
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
-    phone_number: Mapped[PhoneNumber] = mapped_column(type_=PhoneNumberType())
-    phone_operator_code: Mapped[int]
-    tag_id: Mapped[int] = mapped_column(ForeignKey("mailing_tags.id"))
-    tag: Mapped[MailingTag] = relationship(lazy="subquery")
+    phone_number: Mapped[PhoneNumber] = mapped_column(type_=PhoneNumberType(), index=True)
+    phone_operator_code: Mapped[int] = mapped_column(index=True)
+    tag_id: Mapped[int] = mapped_column(ForeignKey("mailing_tags.id"), index=True)
+    tag: Mapped[MailingTag] = relationship(lazy="raise")
     timezone: Mapped[str] = mapped_column(default="Europe/Amsterdam")
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, status, HTTPException, Path, Depends
+from fastapi import APIRouter, status, HTTPException, Path, Query, Depends, Request, Response
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.clients import service
-from .schema import ClientOut, ClientIn, Client, ClientInWithID
+from src.config import get_settings
+from .bulk import PARSERS, CONTENT_TYPES, parse_clients, format_clients
+from .schema import ClientOut, ClientIn, Client, ClientInWithID, ClientsImportResult, ClientsFormat
 from src.exceptions import ValidationErrorSchema
 from src.dependencies import get_db_stub, log_parsed_request
 
@@ -21,6 +24,21 @@ async def create_client(client_in: ClientIn, db: AsyncSession = Depends(get_db_s
     return client
 
 
+@router.post(
+    "/clients/bulk",
+    response_model=ClientsImportResult,
+    tags=["client"],
+    responses={415: {}},
+    openapi_extra={"requestBody": {"content": {content_type: {} for content_type in PARSERS}}},
+)
+async def import_clients(request: Request, db: AsyncSession = Depends(get_db_stub)) -> ClientsImportResult:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in PARSERS:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+    rows = parse_clients(request.stream(), content_type)
+    return await service.import_clients(db, rows, get_settings().import_batch_size)
+
+
 @router.put(
     "/client/",
     response_model=ClientOut | None,
@@ -64,8 +82,46 @@ async def delete_client(client_id: int = Path(), db: AsyncSession = Depends(get_
     "/clients/",
     response_model=list[ClientOut],
     tags=["client"],
-    responses={422: {"model": ValidationErrorSchema}}
+    responses={
+        200: {"headers": {"X-Next-Cursor": {"description": "Cursor of next page, if it exists",
+                                            "schema": {"type": "string"}}}},
+        422: {"model": ValidationErrorSchema},
+    }
 )
-async def get_clients(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db_stub)) -> list[Client]:
-    clients_list = await service.get_clients(db, skip, limit)
+async def get_clients(response: Response,
+                      skip: int = 0,
+                      limit: int = Query(default=100, ge=1),
+                      after_id: int | None = None,
+                      cursor: str | None = None,
+                      tag: str | None = None,
+                      phone_operator_code: int | None = None,
+                      timezone: str | None = None,
+                      db: AsyncSession = Depends(get_db_stub)) -> list[Client]:
+    if cursor:
+        try:
+            after_id = service.decode_clients_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Invalid cursor")
+
+    clients_list = await service.get_clients(db, skip, limit + 1, after_id, tag, phone_operator_code, timezone)
+    if len(clients_list) > limit:
+        clients_list = clients_list[:limit]
+        response.headers["X-Next-Cursor"] = service.encode_clients_cursor(clients_list[-1].id)
     return clients_list
+
+
+@router.get(
+    "/clients/export",
+    response_class=StreamingResponse,
+    tags=["client"],
+    responses={
+        200: {"content": {content_type: {} for content_type in CONTENT_TYPES.values()}},
+        422: {"model": ValidationErrorSchema},
+    }
+)
+async def export_clients(clients_format: ClientsFormat = Query(default=ClientsFormat.ndjson, alias="format"),
+                         tag: str | None = None,
+                         phone_operator_code: int | None = None,
+                         db: AsyncSession = Depends(get_db_stub)) -> StreamingResponse:
+    clients_chunks = service.stream_clients(db, tag, phone_operator_code, get_settings().stream_chunk_size)
+    return StreamingResponse(format_clients(clients_chunks, clients_format), media_type=CONTENT_TYPES[clients_format])
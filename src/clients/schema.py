@@ -1,11 +1,13 @@
 from __future__ import annotations
+from enum import Enum
+from typing import Any
 
 from pytz import all_timezones_set
 from pydantic import validator, Field
 from sqlalchemy_utils import PhoneNumber
 
 from src.mailings.schema import MailingTag, MailingTagIn, MailingTagOut
-from src.schema import HashableBase
+from src.schema import HashableBase, Base
 
 
 class ClientBase(HashableBase):
@@ -47,3 +49,26 @@ class ClientInWithID(ClientIn):
 class ClientOut(ClientBase):
     id: int = Field(example=0)
     tag: MailingTagOut
+
+
+class ClientImportError(Base):
+    row: int = Field(example=2)
+    detail: list[dict[str, Any]] = Field(example=[
+        {
+            "loc": [
+                "phone_number"
+            ],
+            "msg": "field required",
+            "type": "value_error.missing",
+        }
+    ])
+
+
+class ClientsImportResult(Base):
+    created: int = Field(example=1000)
+    errors: list[ClientImportError] = []
+
+
+class ClientsFormat(Enum):
+    ndjson = "ndjson"
+    csv = "csv"
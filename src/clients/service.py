@@ -1,17 +1,47 @@
-from typing import Sequence
+import base64
+import json
+from typing import AsyncIterator, Iterable, Sequence
 
+from pydantic import ValidationError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.mailings import schema as mailings_schema
 
 from . import schema as clients_schema
 from . import crud
+from .bulk import ClientsRows
 
 
 async def create_client(db: AsyncSession, client: clients_schema.ClientIn) -> clients_schema.Client:
     return clients_schema.Client.from_orm(await crud.create_client(db, client))
 
 
+async def import_clients(db: AsyncSession, rows: ClientsRows, batch_size: int) -> clients_schema.ClientsImportResult:
+    result = clients_schema.ClientsImportResult(created=0)
+    batch: list[clients_schema.ClientIn] = []
+    async for row in rows:
+        if isinstance(row, clients_schema.ClientImportError):
+            result.errors.append(row)
+            continue
+
+        row_number, row_data = row
+        try:
+            batch.append(clients_schema.ClientIn.parse_obj(row_data))
+        except ValidationError as e:
+            result.errors.append(clients_schema.ClientImportError(
+                row=row_number,
+                detail=[dict(error) for error in e.errors()],
+            ))
+
+        if len(batch) >= batch_size:
+            result.created += await crud.copy_clients(db, batch)
+            batch = []
+
+    if batch:
+        result.created += await crud.copy_clients(db, batch)
+    return result
+
+
 async def get_client_by_id(db: AsyncSession, client_id: int) -> clients_schema.Client | None:
     db_client = await crud.get_client_by_id(db, client_id)
     if not db_client:
@@ -19,6 +49,10 @@ async def get_client_by_id(db: AsyncSession, client_id: int) -> clients_schema.C
     return clients_schema.Client.from_orm(db_client)
 
 
+async def get_clients_by_ids(db: AsyncSession, clients_ids: Iterable[int]) -> list[clients_schema.Client]:
+    return list(map(clients_schema.Client.from_orm, await crud.get_clients_by_ids(db, clients_ids)))
+
+
 async def get_client_by_phone_number(db: AsyncSession, phone_number: int) -> clients_schema.Client | None:
     db_client = await crud.get_client_by_phone_number(db, phone_number)
     if not db_client:
@@ -26,8 +60,37 @@ async def get_client_by_phone_number(db: AsyncSession, phone_number: int) -> cli
     return clients_schema.Client.from_orm(db_client)
 
 
-async def get_clients(db: AsyncSession, skip: int = 0, limit: int = 100) -> list[clients_schema.Client]:
-    return list(map(clients_schema.Client.from_orm, await crud.get_clients(db, skip, limit)))
+async def get_clients(db: AsyncSession,
+                      skip: int = 0,
+                      limit: int = 100,
+                      after_id: int | None = None,
+                      tag: str | None = None,
+                      phone_operator_code: int | None = None,
+                      timezone: str | None = None) -> list[clients_schema.Client]:
+
+    db_clients = await crud.get_clients(db, skip, limit, after_id, tag, phone_operator_code, timezone)
+    return list(map(clients_schema.Client.from_orm, db_clients))
+
+
+def encode_clients_cursor(client_id: int) -> str:
+    return base64.urlsafe_b64encode(json.dumps({"id": client_id}).encode()).decode().rstrip("=")
+
+
+def decode_clients_cursor(cursor: str) -> int:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return int(data["id"])
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+async def stream_clients(db: AsyncSession,
+                         tag: str | None,
+                         phone_operator_code: int | None,
+                         chunk_size: int) -> AsyncIterator[list[clients_schema.Client]]:
+
+    async for db_clients in crud.stream_clients(db, tag, phone_operator_code, chunk_size):
+        yield list(map(clients_schema.Client.from_orm, db_clients))
 
 
 async def update_client(db: AsyncSession, client: clients_schema.ClientInWithID) -> clients_schema.Client | None:
@@ -58,3 +121,12 @@ async def get_clients_by_phone_code(db: AsyncSession, phone_code: int) -> list[c
 
 async def get_clients_by_phone_codes(db: AsyncSession, phone_codes: Sequence[int]) -> list[clients_schema.Client]:
     return list(map(clients_schema.Client.from_orm, await crud.get_clients_by_phone_codes(db, phone_codes)))
+
+
+async def stream_clients_by_tags_or_phone_codes(db: AsyncSession,
+                                                tags: Iterable[mailings_schema.MailingTag],
+                                                phone_codes: Iterable[int],
+                                                chunk_size: int) -> AsyncIterator[list[clients_schema.Client]]:
+
+    async for db_clients in crud.stream_clients_by_tags_or_phone_codes(db, tags, phone_codes, chunk_size):
+        yield list(map(clients_schema.Client.from_orm, db_clients))
@@ -1,6 +1,6 @@
 from functools import lru_cache
 
-from pydantic import BaseSettings, PostgresDsn, AnyHttpUrl
+from pydantic import BaseSettings, PostgresDsn, AnyHttpUrl, Field
 from fastapi import status
 
 
@@ -8,12 +8,73 @@ class LoggingSettings(BaseSettings):
     format: str = "<green>{time:YYYY-MM-DDTHH:mm:ss.SSSZ!UTC}</green> | <level>{level:<8}</level>"
 
 
+class EndpointSettings(BaseSettings):
+    connections_limit: int = 100
+    connections_limit_per_host: int = 20
+    keepalive_timeout: float = 30
+    dns_cache_ttl: int = 300
+    total_timeout: float | None = 30
+    connect_timeout: float | None = 5
+    read_timeout: float | None = 10
+
+
+class SendingSettings(BaseSettings):
+    messages_chunk_size: int = 1000
+    queue_size: int = 1000
+    batch_size: int = 1
+    batch_linger: float = 0.05
+    statuses_buffer_size: int = 500
+    statuses_flush_interval: float = 1
+
+
+class RetrySettings(BaseSettings):
+    base_delay: float = 1
+    max_delay: float = 300
+    max_attempts: int | None = 10
+    max_elapsed_time: float | None = 3600
+
+
+class GatewaySettings(BaseSettings):
+    min_concurrency: int = 1
+    max_concurrency: int = 100
+    latency_threshold: float = 2
+    backoff_ratio: float = 0.75
+    failure_threshold: int = 20
+    recovery_time: float = 30
+    half_open_requests: int = 1
+
+
+class RateLimitSettings(BaseSettings):
+    messages_per_second: float | None = None
+    operator_code_messages_per_second: float | None = None
+    operator_codes_messages_per_second: dict[int, float] = {}
+    burst_time: float = 1
+
+
+class SchedulerSettings(BaseSettings):
+    poll_interval: float = 5
+    claim_limit: int = 10
+    lease_time: float = 30
+    heartbeat_interval: float = 10
+    load_horizon: float = 3600
+
+
 class Settings(BaseSettings):
     postgresql_url: PostgresDsn
     endpoint_url: AnyHttpUrl | None = None
+    endpoint_batch_url: AnyHttpUrl | None = None
     successful_status_codes: set[int] = {status.HTTP_200_OK}
     max_requests_at_time: int = 20
+    stream_chunk_size: int = 1000
+    import_batch_size: int = 1000
+    workers: int = Field(default=1, env="WORKERS")
     logging: LoggingSettings = LoggingSettings()
+    endpoint: EndpointSettings = EndpointSettings()
+    sending: SendingSettings = SendingSettings()
+    retry: RetrySettings = RetrySettings()
+    gateway: GatewaySettings = GatewaySettings()
+    rate_limit: RateLimitSettings = RateLimitSettings()
+    scheduler: SchedulerSettings = SchedulerSettings()
 
     class Config:
         env_prefix = "BackendTask1_"
@@ -42,12 +42,23 @@ def add_api_response_log_handling() -> None:
         level="INFO",
         format=get_settings().logging.format +
         " | API sent response | {extra[request_uuid]} | {extra[status_code]}"
-        " | Content-type: {extra[content_type]} | <level>{message}</level>",
+        " | {extra[duration_us]:>9} us | Content-type: {extra[content_type]} | <level>{message}</level>",
         enqueue=True,
         filter=lambda record: "api_sent_response" in record["extra"]
     )
 
 
+def add_startup_log_handling() -> None:
+    logger.add(
+        sys.stdout,
+        level="INFO",
+        format=get_settings().logging.format +
+        " | Startup | {extra[startup_phase]:<16} | {extra[duration_ms]:>9.3f} ms | <level>{message}</level>",
+        enqueue=True,
+        filter=lambda record: "startup_phase" in record["extra"]
+    )
+
+
 # def add_message_sending_log_handling() -> None:
 #     logger.add(
 #         sys.stdout,
@@ -75,4 +86,5 @@ def configure_logging() -> None:
     add_api_received_request_log_handling()
     add_api_parsed_request_log_handling()
     add_api_response_log_handling()
+    add_startup_log_handling()
     # add_message_sending_log_handling()
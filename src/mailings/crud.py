@@ -1,18 +1,24 @@
 import datetime
-from typing import Iterable
+from typing import Any, Iterable, AsyncIterator, Mapping, TypeVar
 
+from sqlalchemy import insert, update, delete, text, any_, literal, func, exists, or_, and_, Integer, Table
+from sqlalchemy.dialects.postgresql import ARRAY, insert as postgresql_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from sqlalchemy.sql import Select
+from sqlalchemy.orm import selectinload
 
 from src.clients import schema as clients_schema
 from . import schema
 from . import models
 
 
-async def get_tags_by_texts(db: AsyncSession, tags: Iterable[str]) -> list[models.MailingTag]:
-    stmt = select(models.MailingTag).where(models.MailingTag.text.in_(tags))
-    db_tags = await db.execute(stmt)
-    return list(db_tags.scalars().all())
+MAILING_RELATIONSHIPS_LOADING = [
+    selectinload(models.Mailing.clients_tags),
+    selectinload(models.Mailing._clients_mobile_operator_codes),
+]
+
+UniqueValueModel = TypeVar("UniqueValueModel", models.MailingTag, models.MailingMobileOperatorCode)
 
 
 async def create_mailing_tag(db: AsyncSession, tag: schema.MailingTagIn) -> models.MailingTag:
@@ -23,47 +29,54 @@ async def create_mailing_tag(db: AsyncSession, tag: schema.MailingTagIn) -> mode
     return db_mailing_tag
 
 
-async def create_mailing_tags(db: AsyncSession, tags: Iterable[schema.MailingTagIn]) -> list[models.MailingTag]:
-    db_tags = []
-    for tag_schema in tags:
-        db_tags.append(models.MailingTag(**tag_schema.dict()))
+async def get_mailing_tag(db: AsyncSession, tag_text: str) -> models.MailingTag | None:
+    stmt = select(models.MailingTag).filter(models.MailingTag.text == tag_text)
+    return (await db.execute(stmt)).scalar()
 
-    db.add_all(db_tags)
-    await db.commit()
 
-    for db_tab in db_tags:
-        await db.refresh(db_tab)
+async def _get_or_create(db: AsyncSession,
+                         model: type[UniqueValueModel],
+                         column_name: str,
+                         values: Iterable[Any]) -> list[UniqueValueModel]:
 
-    return db_tags
+    unique_values = list(dict.fromkeys(values))
+    if not unique_values:
+        return []
 
+    column = getattr(model, column_name)
+    db_objects = list((await db.execute(select(model).where(column.in_(unique_values)))).scalars().all())
+    existed_values = {getattr(db_object, column_name) for db_object in db_objects}
+    not_existed_values = [value for value in unique_values if value not in existed_values]
 
-async def get_mailing_tag(db: AsyncSession, tag_text: str) -> models.MailingTag | None:
-    stmt = select(models.MailingTag).filter(models.MailingTag.text == tag_text)
-    db_mailing_tag1 = await db.execute(stmt)
-    db_mailing_tag = (await db.execute(stmt)).scalar()
-    return db_mailing_tag
+    if not_existed_values:
+        stmt = postgresql_insert(model).values(  # type: ignore[no-untyped-call]
+            [{column_name: value} for value in not_existed_values]
+        ).on_conflict_do_nothing(index_elements=[column]).returning(model)
+        created_objects = list((await db.execute(stmt)).scalars().all())
+        db_objects += created_objects
 
+        if len(created_objects) < len(not_existed_values):  # Created by concurrent transaction
+            created_values = {getattr(db_object, column_name) for db_object in created_objects}
+            concurrently_created_values = [value for value in not_existed_values if value not in created_values]
+            db_objects += (await db.execute(select(model).where(column.in_(concurrently_created_values)))).scalars()
 
-async def get_operator_code(db: AsyncSession, code: int) -> models.MailingMobileOperatorCode | None:
-    return (await db.execute(select(models.MailingMobileOperatorCode).filter(
-        models.MailingMobileOperatorCode.code == code))).scalar()
+    objects_by_values = {getattr(db_object, column_name): db_object for db_object in db_objects}
+    return [objects_by_values[value] for value in unique_values]
 
 
-async def get_operator_codes(db: AsyncSession, codes: Iterable[int]) -> list[models.MailingMobileOperatorCode]:
-    return list((await db.execute(select(models.MailingMobileOperatorCode).filter(
-        models.MailingMobileOperatorCode.code.in_(codes)))).scalars())
+async def get_or_create_mailing_tags(db: AsyncSession, tags_texts: Iterable[str]) -> list[models.MailingTag]:
+    return await _get_or_create(db, models.MailingTag, "text", tags_texts)
 
 
-async def create_mailing(db: AsyncSession, mailing: schema.MailingIn) -> models.Mailing:
-    existed_tags = await get_tags_by_texts(db, map(lambda x: x.text, mailing.clients_tags))
-    existed_tags_texts = map(lambda x: x.text, existed_tags)
-    not_existed_tags = filter(lambda x: x.text not in existed_tags_texts, mailing.clients_tags)
-    clients_tags = existed_tags + await create_mailing_tags(db, not_existed_tags)
+async def get_or_create_operator_codes(db: AsyncSession,
+                                       codes: Iterable[int]) -> list[models.MailingMobileOperatorCode]:
+
+    return await _get_or_create(db, models.MailingMobileOperatorCode, "code", codes)
 
-    existed_operator_codes = await get_operator_codes(db, mailing.clients_mobile_operator_codes)
-    existed_codes_numbers = map(lambda x: x.code, existed_operator_codes)
-    not_existed_codes = filter(lambda x: x not in existed_codes_numbers, mailing.clients_mobile_operator_codes)
-    operator_codes = existed_operator_codes + [models.MailingMobileOperatorCode(code=i) for i in not_existed_codes]
+
+async def create_mailing(db: AsyncSession, mailing: schema.MailingIn) -> models.Mailing:
+    clients_tags = await get_or_create_mailing_tags(db, (tag.text for tag in mailing.clients_tags))
+    operator_codes = await get_or_create_operator_codes(db, mailing.clients_mobile_operator_codes)
 
     db_mailing = models.Mailing(
         text=mailing.text,
@@ -71,16 +84,18 @@ async def create_mailing(db: AsyncSession, mailing: schema.MailingIn) -> models.
         clients_mobile_operator_codes=operator_codes,
         start_time=mailing.start_time,
         end_time=mailing.end_time,
+        delivery_window_start=mailing.delivery_window_start,
+        delivery_window_end=mailing.delivery_window_end,
     )
 
     db.add(db_mailing)
     await db.commit()
-    await db.refresh(db_mailing)
+    await get_mailing_by_id(db, db_mailing.id)
     return db_mailing
 
 
 async def get_mailing_by_id(db: AsyncSession, mailing_id: int) -> models.Mailing | None:
-    return await db.get(models.Mailing, mailing_id)
+    return await db.get(models.Mailing, mailing_id, options=MAILING_RELATIONSHIPS_LOADING, populate_existing=True)
 
 
 async def delete_mailing(db: AsyncSession, mailing_id: int) -> models.Mailing | None:
@@ -97,40 +112,200 @@ async def update_mailing(db: AsyncSession, mailing: schema.MailingInWithID) -> m
     if not db_mailing:
         return None
 
-    clients_tags = []
-    for tag in mailing.clients_tags:
-        db_tag = await get_mailing_tag(db, tag.text)
-        if not db_tag:
-            db_tag = models.MailingTag(text=tag.text)
-        clients_tags.append(db_tag)
-
-    clients_operator_codes: list[models.MailingMobileOperatorCode] = []
-    for code in mailing.clients_mobile_operator_codes:
-        db_code = await get_operator_code(db, code)
-        if not db_code:
-            db_code = models.MailingMobileOperatorCode(code=code)
-        clients_operator_codes.append(db_code)
+    clients_tags = await get_or_create_mailing_tags(db, (tag.text for tag in mailing.clients_tags))
+    clients_operator_codes = await get_or_create_operator_codes(db, mailing.clients_mobile_operator_codes)
 
     db_mailing.text = mailing.text
     db_mailing.start_time = mailing.start_time
     db_mailing.end_time = mailing.end_time
+    db_mailing.delivery_window_start = mailing.delivery_window_start
+    db_mailing.delivery_window_end = mailing.delivery_window_end
     db_mailing.clients_tags = clients_tags
     db_mailing.clients_mobile_operator_codes = clients_operator_codes  # type: ignore
     # Mypy doesn't handle type that setter expects, only that getter returns
+    db_mailing.state = schema.MailingState.scheduled
+    db_mailing.leased_by = None
+    db_mailing.lease_expires_at = None
 
     await db.commit()
-    await db.refresh(db_mailing)
+    await get_mailing_by_id(db, db_mailing.id)
 
     return db_mailing
 
 
 async def get_all_mailings(db: AsyncSession) -> list[models.Mailing]:
-    return list((await db.execute(select(models.Mailing))).scalars().all())
+    return list((await db.execute(select(models.Mailing).options(*MAILING_RELATIONSHIPS_LOADING))).scalars().all())
+
+
+async def claim_due_mailings(db: AsyncSession, worker_id: str, limit: int, lease_time: float) -> list[models.Mailing]:
+    stmt = select(models.Mailing).where(
+        or_(
+            models.Mailing.state == schema.MailingState.scheduled,
+            and_(models.Mailing.state == schema.MailingState.running, models.Mailing.lease_expires_at < func.now()),
+        ),
+        models.Mailing.start_time <= func.now(),
+        models.Mailing.end_time > func.now(),
+    ).order_by(models.Mailing.start_time).limit(limit).with_for_update(skip_locked=True) \
+        .options(*MAILING_RELATIONSHIPS_LOADING)
+
+    mailings = list((await db.execute(stmt)).scalars().all())
+    if mailings:
+        await db.execute(update(models.Mailing).where(
+            models.Mailing.id == any_(literal([mailing.id for mailing in mailings], ARRAY(Integer))),
+        ).values(
+            state=schema.MailingState.running,
+            leased_by=worker_id,
+            lease_expires_at=func.now() + datetime.timedelta(seconds=lease_time),
+        ).execution_options(synchronize_session="fetch"))
+    await db.commit()
+    return mailings
+
+
+async def get_next_mailings_starts(db: AsyncSession,
+                                   limit: int,
+                                   after: tuple[datetime.datetime, int] | None = None,
+                                   until: datetime.datetime | None = None) -> list[tuple[int, datetime.datetime]]:
+
+    stmt = select(models.Mailing.id, models.Mailing.start_time).where(
+        models.Mailing.state == schema.MailingState.scheduled,
+        models.Mailing.start_time > func.now(),
+        models.Mailing.end_time > func.now(),
+    )
+    if after:
+        after_start_time, after_id = after
+        stmt = stmt.where(or_(
+            models.Mailing.start_time > after_start_time,
+            and_(models.Mailing.start_time == after_start_time, models.Mailing.id > after_id),
+        ))
+    if until:
+        stmt = stmt.where(models.Mailing.start_time < until)
+    stmt = stmt.order_by(models.Mailing.start_time, models.Mailing.id).limit(limit)
+    return [(mailing_id, start_time) for mailing_id, start_time in (await db.execute(stmt)).all()]
+
+
+async def get_running_mailings(db: AsyncSession) -> list[models.Mailing]:
+    stmt = select(models.Mailing).where(
+        models.Mailing.state == schema.MailingState.running,
+        models.Mailing.end_time > func.now(),
+    ).options(*MAILING_RELATIONSHIPS_LOADING)
+    return list((await db.execute(stmt)).scalars().all())
+
+
+async def extend_mailings_lease(db: AsyncSession,
+                                worker_id: str,
+                                mailings_ids: Iterable[int],
+                                lease_time: float) -> list[int]:
+
+    extended_mailings_ids = (await db.execute(update(models.Mailing).where(
+        models.Mailing.id == any_(literal(list(mailings_ids), ARRAY(Integer))),
+        models.Mailing.state == schema.MailingState.running,
+        models.Mailing.leased_by == worker_id,
+    ).values(
+        lease_expires_at=func.now() + datetime.timedelta(seconds=lease_time),
+    ).returning(models.Mailing.id).execution_options(synchronize_session=False))).scalars().all()
+    await db.commit()
+    return list(extended_mailings_ids)
+
+
+async def cancel_expired_mailings(db: AsyncSession) -> None:
+    # Running mailing with expired lease was left by stopped worker, so nobody expires its messages
+    cancelled_mailings_ids = (await db.execute(update(models.Mailing).where(
+        or_(
+            models.Mailing.state == schema.MailingState.scheduled,
+            and_(models.Mailing.state == schema.MailingState.running, models.Mailing.lease_expires_at < func.now()),
+        ),
+        models.Mailing.end_time <= func.now(),
+    ).values(
+        state=schema.MailingState.cancelled,
+        leased_by=None,
+        lease_expires_at=None,
+    ).returning(models.Mailing.id).execution_options(synchronize_session=False))).scalars().all()
+
+    if cancelled_mailings_ids:
+        await expire_messages(db, cancelled_mailings_ids)
+    await db.commit()
+
+
+async def release_mailing(db: AsyncSession, worker_id: str, mailing_id: int, state: schema.MailingState) -> None:
+    await db.execute(update(models.Mailing).where(
+        models.Mailing.id == mailing_id,
+        models.Mailing.state == schema.MailingState.running,
+        models.Mailing.leased_by == worker_id,
+    ).values(state=state, leased_by=None, lease_expires_at=None))
+    await db.commit()
+
+
+async def get_mailings_messages_count(
+        db: AsyncSession
+) -> list[tuple[models.Mailing, schema.MessageStatus | None, int]]:
+
+    stmt = select(models.Mailing, models.MailingStatusCounter.status, models.MailingStatusCounter.count) \
+        .outerjoin(models.MailingStatusCounter, models.MailingStatusCounter.mailing_id == models.Mailing.id) \
+        .options(*MAILING_RELATIONSHIPS_LOADING) \
+        .order_by(models.Mailing.id)
+
+    return [(mailing, status, count or 0) for mailing, status, count in (await db.execute(stmt)).all()]
+
+
+async def add_to_mailings_stats(db: AsyncSession, counts: dict[tuple[int, schema.MessageStatus], int]) -> None:
+    values = [
+        {"mailing_id": mailing_id, "status": status, "count": count}
+        for (mailing_id, status), count in sorted(counts.items(), key=lambda item: (item[0][0], item[0][1].name))
+        if count
+    ]
+    if not values:
+        return
+
+    stmt = postgresql_insert(models.MailingStatusCounter)  # type: ignore[no-untyped-call]
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.MailingStatusCounter.mailing_id, models.MailingStatusCounter.status],
+        set_={"count": models.MailingStatusCounter.count + stmt.excluded.count},
+    )
+    await db.execute(stmt, values)
+
+
+async def rebuild_mailings_stats(db: AsyncSession) -> None:
+    await db.execute(text(f"LOCK TABLE {models.MailingStatusCounter.__tablename__} IN EXCLUSIVE MODE"))
+    await db.execute(delete(models.MailingStatusCounter))
+    messages_count = select(models.Message.mailing_id, models.Message.status, func.count()) \
+        .group_by(models.Message.mailing_id, models.Message.status)
+    await db.execute(insert(models.MailingStatusCounter).from_select(["mailing_id", "status", "count"], messages_count))
+    await db.commit()
+
+
+def _select_mailing_messages(mailing_id: int,
+                             status: schema.MessageStatus | None = None,
+                             after_id: int | None = None) -> Select[tuple[models.Message]]:
 
+    stmt = select(models.Message).filter(models.Message.mailing_id == mailing_id)
+    if status:
+        stmt = stmt.filter(models.Message.status == status)
+    if after_id is not None:
+        stmt = stmt.filter(models.Message.id > after_id)
+    return stmt.order_by(models.Message.id)
 
-async def get_mailing_messages(db: AsyncSession, mailing_id: int) -> list[models.Message]:
-    return list((await db.execute(select(models.Message).filter(
-        models.Message.mailing_id == mailing_id))).scalars().all())
+
+async def get_mailing_messages(db: AsyncSession,
+                               mailing_id: int,
+                               status: schema.MessageStatus | None = None,
+                               after_id: int | None = None,
+                               limit: int | None = None) -> list[models.Message]:
+
+    stmt = _select_mailing_messages(mailing_id, status, after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return list((await db.execute(stmt)).scalars().all())
+
+
+async def stream_mailing_messages(db: AsyncSession,
+                                  mailing_id: int,
+                                  status: schema.MessageStatus | None,
+                                  after_id: int | None,
+                                  chunk_size: int) -> AsyncIterator[list[models.Message]]:
+
+    stmt = _select_mailing_messages(mailing_id, status, after_id).execution_options(yield_per=chunk_size)
+    async for messages_chunk in (await db.stream_scalars(stmt)).partitions():
+        yield list(messages_chunk)
 
 
 async def create_message(db: AsyncSession, mailing: schema.Mailing, client: clients_schema.Client) -> models.Message:
@@ -142,11 +317,116 @@ async def create_message(db: AsyncSession, mailing: schema.Mailing, client: clie
     )
 
     db.add(message)
+    await add_to_mailings_stats(db, {(mailing.id, message.status): 1})
     await db.commit()
     await db.refresh(message)
     return message
 
 
+async def create_messages(db: AsyncSession,
+                          mailing: schema.Mailing,
+                          clients: Iterable[clients_schema.Client],
+                          utc_offsets: Mapping[str, int] | None = None) -> list[models.Message]:
+
+    created_at = datetime.datetime.now()
+    utc_offsets = utc_offsets or {}
+    messages_values = [
+        {
+            "mailing_id": mailing.id,
+            "client_id": client.id,
+            "created_at": created_at,
+            "status": schema.MessageStatus.not_delivered,
+            "utc_offset": utc_offsets.get(client.timezone, 0),
+        } for client in clients
+    ]
+    if not messages_values:
+        return []
+
+    # Messages of a resumed mailing already exist, they are claimed with the new ones by sending
+    stmt = postgresql_insert(models.Message).on_conflict_do_nothing(  # type: ignore[no-untyped-call]
+        index_elements=[models.Message.mailing_id, models.Message.client_id],
+    ).returning(models.Message)
+    messages = list((await db.execute(stmt, messages_values)).scalars().all())
+    await add_to_mailings_stats(db, {(mailing.id, schema.MessageStatus.not_delivered): len(messages)})
+    await db.commit()
+    return messages
+
+
+async def claim_pending_messages(db: AsyncSession,
+                                 mailing_id: int,
+                                 limit: int,
+                                 lease_time: float,
+                                 utc_offsets: Iterable[int] | None = None) -> list[models.Message]:
+
+    # Messages of rescheduled or deleted mailing aren't claimed
+    mailing_is_running = exists().where(
+        models.Mailing.id == mailing_id,
+        models.Mailing.state == schema.MailingState.running,
+    )
+    stmt = select(models.Message).where(
+        models.Message.mailing_id == mailing_id,
+        models.Message.status == schema.MessageStatus.not_delivered,
+        or_(models.Message.lease_expires_at.is_(None), models.Message.lease_expires_at < func.now()),
+        mailing_is_running,
+    )
+    if utc_offsets is not None:
+        stmt = stmt.where(models.Message.utc_offset == any_(literal(list(utc_offsets), ARRAY(Integer))))
+    stmt = stmt.order_by(models.Message.id).limit(limit).with_for_update(skip_locked=True)
+
+    messages = list((await db.execute(stmt)).scalars().all())
+    if messages:
+        await db.execute(update(models.Message).where(
+            models.Message.id == any_(literal([message.id for message in messages], ARRAY(Integer))),
+        ).values(
+            lease_expires_at=func.now() + datetime.timedelta(seconds=lease_time),
+        ).execution_options(synchronize_session=False))
+    await db.commit()
+    return messages
+
+
+async def extend_messages_lease(db: AsyncSession, messages_ids: Iterable[int], lease_time: float) -> None:
+    await db.execute(update(models.Message).where(
+        models.Message.id == any_(literal(list(messages_ids), ARRAY(Integer))),
+        models.Message.status == schema.MessageStatus.not_delivered,
+    ).values(
+        lease_expires_at=func.now() + datetime.timedelta(seconds=lease_time),
+    ).execution_options(synchronize_session=False))
+    await db.commit()
+
+
+async def get_pending_messages_utc_offsets(db: AsyncSession, mailing_id: int) -> list[int]:
+    return list((await db.execute(select(models.Message.utc_offset).where(
+        models.Message.mailing_id == mailing_id,
+        models.Message.status == schema.MessageStatus.not_delivered,
+    ).distinct())).scalars().all())
+
+
+async def has_pending_messages(db: AsyncSession, mailing_id: int) -> bool:
+    return bool(await db.scalar(select(exists().where(
+        models.Message.mailing_id == mailing_id,
+        models.Message.status == schema.MessageStatus.not_delivered,
+    ))))
+
+
+async def expire_messages(db: AsyncSession, mailings_ids: Iterable[int]) -> None:
+    # ORM update can't be used inside CTE, so Core table is updated
+    messages_table: Table = models.Message.__table__  # type: ignore[assignment]
+    expired_messages = update(messages_table).where(
+        messages_table.c.mailing_id == any_(literal(list(mailings_ids), ARRAY(Integer))),
+        messages_table.c.status == schema.MessageStatus.not_delivered,
+    ).values(status=schema.MessageStatus.expired).returning(messages_table.c.mailing_id).cte("expired_messages")
+
+    stmt = select(expired_messages.c.mailing_id, func.count()).group_by(expired_messages.c.mailing_id)
+
+    counts: dict[tuple[int, schema.MessageStatus], int] = {}
+    for mailing_id, count in (await db.execute(stmt)).all():
+        counts[mailing_id, schema.MessageStatus.not_delivered] = -count
+        counts[mailing_id, schema.MessageStatus.expired] = count
+
+    await add_to_mailings_stats(db, counts)
+    await db.commit()
+
+
 async def get_message_by_id(db: AsyncSession, message_id: int) -> models.Message | None:
     return await db.get(models.Message, message_id)
 
@@ -159,7 +439,41 @@ async def change_message_status(db: AsyncSession,
     if not db_message:
         return None
 
+    old_status = db_message.status
     db_message.status = status
+    await db.flush()
+    if old_status != status:
+        await add_to_mailings_stats(db, {
+            (db_message.mailing_id, old_status): -1,
+            (db_message.mailing_id, status): 1,
+        })
     await db.commit()
     await db.refresh(db_message)
     return db_message
+
+
+async def change_messages_status(db: AsyncSession, messages_ids: Iterable[int], status: schema.MessageStatus) -> None:
+    changed_messages = select(models.Message.id, models.Message.mailing_id, models.Message.status).where(
+        models.Message.id == any_(literal(list(messages_ids), ARRAY(Integer))),
+        models.Message.status != status,
+    ).with_for_update().cte("changed_messages")
+
+    # ORM update can't be used inside CTE, so Core table is updated
+    messages_table: Table = models.Message.__table__  # type: ignore[assignment]
+    updated_messages = update(messages_table).where(
+        messages_table.c.id == changed_messages.c.id
+    ).values(status=status).returning(
+        changed_messages.c.mailing_id,
+        changed_messages.c.status,
+    ).cte("updated_messages")
+
+    stmt = select(updated_messages.c.mailing_id, updated_messages.c.status, func.count()) \
+        .group_by(updated_messages.c.mailing_id, updated_messages.c.status)
+
+    counts: dict[tuple[int, schema.MessageStatus], int] = {}
+    for mailing_id, old_status, count in (await db.execute(stmt)).all():
+        counts[mailing_id, old_status] = counts.get((mailing_id, old_status), 0) - count
+        counts[mailing_id, status] = counts.get((mailing_id, status), 0) + count
+
+    await add_to_mailings_stats(db, counts)
+    await db.commit()
@@ -1,11 +1,20 @@
+from functools import lru_cache
+
 from src.config import get_settings
 from src.mailings.endpoints import Endpoint, APIEndpoint, TestEndpoint
+from src.mailings.limiting import guard_endpoint, rate_limit_endpoint
+
+
+@lru_cache(maxsize=1)
+def get_shared_endpoint() -> Endpoint:
+    settings = get_settings()
+    endpoint_url = settings.endpoint_url
+    endpoint = APIEndpoint(endpoint_url, settings.endpoint_batch_url) if endpoint_url else TestEndpoint()
+    return rate_limit_endpoint(guard_endpoint(endpoint))
 
 
 async def get_endpoint() -> Endpoint:
-    endpoint_url = get_settings().endpoint_url
-    endpoint = APIEndpoint(endpoint_url) if endpoint_url else TestEndpoint()
-    return endpoint
+    return get_shared_endpoint()
 
 
 async def get_endpoint_stub() -> None:
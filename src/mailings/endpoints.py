@@ -1,12 +1,49 @@
+import asyncio
 from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from http import HTTPStatus
+from typing import Sequence
 
 import aiohttp
 
+from src.config import get_settings
 from src.mailings import schema as mailings_schema
 from src.clients import schema as clients_schema
 
 
+class RetryAfter(Exception):
+    def __init__(self, status: HTTPStatus, delay: float):
+        super().__init__(status, delay)
+        self.status = status
+        self.delay = delay
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if not retry_time.tzinfo:
+        retry_time = retry_time.replace(tzinfo=timezone.utc)
+    return max((retry_time - datetime.now(timezone.utc)).total_seconds(), 0)
+
+
+def raise_for_retry_after(response: aiohttp.ClientResponse) -> None:
+    status = HTTPStatus(response.status)
+    if status not in (HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.SERVICE_UNAVAILABLE):
+        return
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    if retry_after is not None:
+        raise RetryAfter(status, retry_after)
+
+
 class Endpoint(ABC):
     @abstractmethod
     async def send(self, message: mailings_schema.Message,
@@ -14,22 +51,90 @@ class Endpoint(ABC):
                    mailing: mailings_schema.Mailing) -> HTTPStatus:
         raise NotImplementedError
 
+    async def send_many(self, messages: Sequence[tuple[mailings_schema.Message, clients_schema.Client]],
+                        mailing: mailings_schema.Mailing) -> list[HTTPStatus]:
+
+        # Every message gets own status, so delivered messages of batch aren't sent again with failed ones
+        async def send(message: mailings_schema.Message, client: clients_schema.Client) -> HTTPStatus:
+            try:
+                return await self.send(message, client, mailing)
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                return HTTPStatus.REQUEST_TIMEOUT
+            except RetryAfter as e:
+                return e.status
+
+        return list(await asyncio.gather(*(send(message, client) for message, client in messages)))
+
+    async def close(self) -> None:
+        pass
+
+
+def create_client_session() -> aiohttp.ClientSession:
+    settings = get_settings().endpoint
+    connector = aiohttp.TCPConnector(
+        limit=settings.connections_limit,
+        limit_per_host=settings.connections_limit_per_host,
+        keepalive_timeout=settings.keepalive_timeout,
+        ttl_dns_cache=settings.dns_cache_ttl,
+    )
+    timeout = aiohttp.ClientTimeout(
+        total=settings.total_timeout,
+        connect=settings.connect_timeout,
+        sock_read=settings.read_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
 
 class APIEndpoint(Endpoint):
-    def __init__(self, endpoint_url: str):
+    def __init__(self, endpoint_url: str, batch_url: str | None = None):
         self.url = endpoint_url if endpoint_url[-1] != '/' else endpoint_url[:-1]
         self.url = endpoint_url
+        self.batch_url = batch_url
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if not self._session or self._session.closed:
+            self._session = create_client_session()
+        return self._session
 
     async def send(self, message: mailings_schema.Message,
                    client: clients_schema.Client,
                    mailing: mailings_schema.Mailing) -> HTTPStatus:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(f"{self.url}/{message.id}", json={
+        async with self.session.post(f"{self.url}/{message.id}", json={
+            "id": message.id,
+            "phone": int(client.phone_number),
+            "text": mailing.text,
+        }) as response:
+            raise_for_retry_after(response)
+            return HTTPStatus(response.status)
+
+    async def send_many(self, messages: Sequence[tuple[mailings_schema.Message, clients_schema.Client]],
+                        mailing: mailings_schema.Mailing) -> list[HTTPStatus]:
+
+        if not self.batch_url:
+            return await super().send_many(messages, mailing)
+
+        async with self.session.post(self.batch_url, json=[
+            {
                 "id": message.id,
                 "phone": int(client.phone_number),
                 "text": mailing.text,
-            }) as response:
-                return HTTPStatus(response.status)
+            } for message, client in messages
+        ]) as response:
+            raise_for_retry_after(response)
+            status = HTTPStatus(response.status)
+            try:
+                items_statuses = {item["id"]: HTTPStatus(item["status"]) for item in await response.json()}
+            except (aiohttp.ContentTypeError, TypeError, KeyError, ValueError):
+                items_statuses = {}
+
+        return [items_statuses.get(message.id, status) for message, _ in messages]
+
+    async def close(self) -> None:
+        if self._session:
+            await self._session.close()
+            self._session = None
 
 
 class TestEndpoint(Endpoint):
@@ -40,3 +145,9 @@ class TestEndpoint(Endpoint):
         print(f'Client id: {client.id}')
         print(f'Mailing id: {mailing.id}')
         return HTTPStatus(200)
+
+    async def send_many(self, messages: Sequence[tuple[mailings_schema.Message, clients_schema.Client]],
+                        mailing: mailings_schema.Mailing) -> list[HTTPStatus]:
+        print(f'Mailing id: {mailing.id}')
+        print(f'Messages ids: {[message.id for message, _ in messages]}')
+        return [HTTPStatus(200)] * len(messages)
@@ -1,11 +1,42 @@
-from src.dependencies import get_db
-from src.mailings.dependencies import get_endpoint
+import time
+
+from loguru import logger
+
+from src.database import get_async_engine
+from src.mailings.dependencies import get_endpoint, get_shared_endpoint
 from src.mailings.schedule import Schedule
-from src.mailings.service import get_all_mailings
+from src.mailings.sending import Sending
+
+
+def log_startup_phase(phase: str, started_at: float, message: str = "Finished") -> None:
+    duration_ms = (time.perf_counter() - started_at) * 1000
+    logger.bind(startup_phase=phase, duration_ms=duration_ms).info(message)
+
+
+async def start_schedule() -> None:
+    startup_started_at = started_at = time.perf_counter()
+    endpoint = await get_endpoint()
+    log_startup_phase("endpoint", started_at)
+
+    started_at = time.perf_counter()
+    engine = get_async_engine()
+    loaded_count = await Schedule.load_starts(engine)
+    log_startup_phase("mailings starts", started_at, f"{loaded_count} upcoming mailings starts loaded")
+
+    started_at = time.perf_counter()
+    await Schedule.start(engine, endpoint)
+    log_startup_phase("scheduler", started_at)
+    log_startup_phase("total", startup_started_at)
+
+
+async def stop_schedule() -> None:
+    await Schedule.stop()
+
+
+async def close_endpoint() -> None:
+    await get_shared_endpoint().close()
 
 
-async def mailings_in_db_to_schedule() -> None:
-    db = await get_db()
-    all_mailings = await get_all_mailings(db)
-    for mailing in all_mailings:
-        await Schedule.add_mailing_to_schedule(db, mailing, await get_endpoint())
+async def stop_sendings() -> None:
+    for sending in tuple(Sending.sendings.values()):
+        await sending.stop()
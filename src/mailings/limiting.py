@@ -0,0 +1,325 @@
+from __future__ import annotations
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from http import HTTPStatus
+from typing import AsyncIterator, Sequence
+
+from src.config import get_settings
+from src.mailings import schema as mailings_schema
+from src.mailings.schema import CircuitState
+from src.clients import schema as clients_schema
+
+from .endpoints import Endpoint, RetryAfter
+
+
+class AdaptiveLimiter:
+    """Concurrency limit with additive increase on fast successful requests and multiplicative decrease
+    on failed or slow ones"""
+
+    def __init__(self,
+                 initial_limit: int,
+                 min_limit: int,
+                 max_limit: int,
+                 latency_threshold: float,
+                 backoff_ratio: float):
+
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_threshold = latency_threshold
+        self.backoff_ratio = backoff_ratio
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    @property
+    def current_limit(self) -> int:
+        return int(self.limit)
+
+    async def acquire(self) -> None:
+        while self.in_flight >= self.current_limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                # Slot given to cancelled waiter is passed to the next one
+                if waiter.done() and not waiter.cancelled():
+                    self._wake_up_next()
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+        self.in_flight += 1
+
+    def _wake_up_next(self) -> bool:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return True
+        return False
+
+    def release(self, latency: float, success: bool | None) -> None:
+        if success is None:
+            pass
+        elif success and latency <= self.latency_threshold:
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        else:
+            self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+
+        self.in_flight -= 1
+        free_slots = self.current_limit - self.in_flight
+        while free_slots > 0 and self._wake_up_next():
+            free_slots -= 1
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, recovery_time: float, half_open_requests: int):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.half_open_requests = half_open_requests
+        self._state = CircuitState.closed
+        self.failures = 0
+        self.opened_at = 0.0
+        self.half_open_in_flight = 0
+
+    @property
+    def state(self) -> CircuitState:
+        if self._state == CircuitState.open and self.retry_after <= 0:
+            self._state = CircuitState.half_open
+            self.half_open_in_flight = 0
+        return self._state
+
+    @property
+    def retry_after(self) -> float:
+        return self.opened_at + self.recovery_time - time.monotonic()
+
+    @property
+    def rejects_requests(self) -> bool:
+        match self.state:
+            case CircuitState.open:
+                return True
+            case CircuitState.half_open:
+                return self.half_open_in_flight >= self.half_open_requests
+        return False
+
+    def allow_request(self) -> bool:
+        match self.state:
+            case CircuitState.closed:
+                return True
+            case CircuitState.half_open if self.half_open_in_flight < self.half_open_requests:
+                self.half_open_in_flight += 1
+                return True
+        return False
+
+    def record_success(self) -> None:
+        self._state = CircuitState.closed
+        self.failures = 0
+
+    def record_cancel(self) -> None:
+        if self._state == CircuitState.half_open and self.half_open_in_flight:
+            self.half_open_in_flight -= 1
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._state == CircuitState.half_open or self.failures >= self.failure_threshold:
+            self._state = CircuitState.open
+            self.opened_at = time.monotonic()
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, tokens: int = 1) -> None:
+        async with self._lock:
+            self._refill()
+            required_tokens = min(tokens, self.capacity)
+            while self.tokens < required_tokens:
+                await asyncio.sleep((required_tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+
+def is_failure_status(status: HTTPStatus) -> bool:
+    return status >= HTTPStatus.INTERNAL_SERVER_ERROR or status == HTTPStatus.TOO_MANY_REQUESTS
+
+
+class GuardedEndpoint(Endpoint):
+    def __init__(self, endpoint: Endpoint, limiter: AdaptiveLimiter, breaker: CircuitBreaker):
+        self.endpoint = endpoint
+        self.limiter = limiter
+        self.breaker = breaker
+
+    @asynccontextmanager
+    async def _guard(self) -> AsyncIterator[list[HTTPStatus]]:
+        if not self.breaker.allow_request():
+            raise RetryAfter(HTTPStatus.SERVICE_UNAVAILABLE, max(self.breaker.retry_after, 0))
+
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            # Half-open probe isn't sent, so its slot is given back
+            self.breaker.record_cancel()
+            raise
+        started_at = time.monotonic()
+        statuses: list[HTTPStatus] = []
+        success: bool | None = False
+        try:
+            yield statuses
+            success = not any(map(is_failure_status, statuses))
+        except asyncio.CancelledError:
+            success = None
+            raise
+        finally:
+            if success:
+                self.breaker.record_success()
+            elif success is None:
+                self.breaker.record_cancel()
+            else:
+                self.breaker.record_failure()
+            self.limiter.release(time.monotonic() - started_at, success)
+
+    async def send(self, message: mailings_schema.Message,
+                   client: clients_schema.Client,
+                   mailing: mailings_schema.Mailing) -> HTTPStatus:
+
+        async with self._guard() as statuses:
+            status = await self.endpoint.send(message, client, mailing)
+            statuses.append(status)
+        return status
+
+    async def send_many(self, messages: Sequence[tuple[mailings_schema.Message, clients_schema.Client]],
+                        mailing: mailings_schema.Mailing) -> list[HTTPStatus]:
+
+        async with self._guard() as statuses:
+            statuses.extend(await self.endpoint.send_many(messages, mailing))
+        return statuses
+
+    async def close(self) -> None:
+        await self.endpoint.close()
+
+    def get_stats(self) -> mailings_schema.GatewayStats:
+        return mailings_schema.GatewayStats(
+            concurrency_limit=self.limiter.current_limit,
+            requests_in_flight=self.limiter.in_flight,
+            circuit_state=self.breaker.state,
+        )
+
+
+class RateLimitedEndpoint(Endpoint):
+    def __init__(self,
+                 endpoint: Endpoint,
+                 bucket: TokenBucket | None,
+                 operator_code_rate: float | None,
+                 operator_codes_rates: dict[int, float],
+                 burst_time: float):
+
+        self.endpoint = endpoint
+        self.bucket = bucket
+        self.operator_code_rate = operator_code_rate
+        self.operator_codes_rates = operator_codes_rates
+        self.burst_time = burst_time
+        self.operator_codes_buckets: dict[int, TokenBucket | None] = {}
+
+    def get_operator_code_bucket(self, code: int) -> TokenBucket | None:
+        if code not in self.operator_codes_buckets:
+            rate = self.operator_codes_rates.get(code, self.operator_code_rate)
+            self.operator_codes_buckets[code] = create_token_bucket(rate, self.burst_time) if rate else None
+        return self.operator_codes_buckets[code]
+
+    async def _acquire(self, clients: Sequence[clients_schema.Client]) -> None:
+        # Tokens aren't spent on messages which breaker would reject anyway
+        guarded_endpoint = get_guarded_endpoint(self.endpoint)
+        if guarded_endpoint and guarded_endpoint.breaker.rejects_requests:
+            raise RetryAfter(HTTPStatus.SERVICE_UNAVAILABLE, max(guarded_endpoint.breaker.retry_after, 0))
+
+        for client in clients:
+            operator_code_bucket = self.get_operator_code_bucket(client.phone_operator_code)
+            if operator_code_bucket:
+                await operator_code_bucket.acquire()
+        if self.bucket:
+            await self.bucket.acquire(len(clients))
+
+    async def send(self, message: mailings_schema.Message,
+                   client: clients_schema.Client,
+                   mailing: mailings_schema.Mailing) -> HTTPStatus:
+
+        await self._acquire([client])
+        return await self.endpoint.send(message, client, mailing)
+
+    async def send_many(self, messages: Sequence[tuple[mailings_schema.Message, clients_schema.Client]],
+                        mailing: mailings_schema.Mailing) -> list[HTTPStatus]:
+
+        await self._acquire([client for _, client in messages])
+        return await self.endpoint.send_many(messages, mailing)
+
+    async def close(self) -> None:
+        await self.endpoint.close()
+
+
+def create_token_bucket(rate: float, burst_time: float) -> TokenBucket:
+    return TokenBucket(rate, max(rate * burst_time, 1))
+
+
+def get_guarded_endpoint(endpoint: Endpoint) -> GuardedEndpoint | None:
+    while not isinstance(endpoint, GuardedEndpoint):
+        if not isinstance(endpoint, RateLimitedEndpoint):
+            return None
+        endpoint = endpoint.endpoint
+    return endpoint
+
+
+def rate_limit_endpoint(endpoint: Endpoint) -> Endpoint:
+    settings = get_settings().rate_limit
+    if not settings.messages_per_second \
+            and not settings.operator_code_messages_per_second \
+            and not settings.operator_codes_messages_per_second:
+        return endpoint
+
+    # Limits are for the whole service, every process gets its share of them
+    workers = max(get_settings().workers, 1)
+
+    bucket = None
+    if settings.messages_per_second:
+        bucket = create_token_bucket(settings.messages_per_second / workers, settings.burst_time)
+
+    operator_code_rate = None
+    if settings.operator_code_messages_per_second:
+        operator_code_rate = settings.operator_code_messages_per_second / workers
+
+    return RateLimitedEndpoint(
+        endpoint,
+        bucket,
+        operator_code_rate,
+        {code: rate / workers for code, rate in settings.operator_codes_messages_per_second.items()},
+        settings.burst_time,
+    )
+
+
+def guard_endpoint(endpoint: Endpoint) -> GuardedEndpoint:
+    settings = get_settings()
+    limiter = AdaptiveLimiter(
+        initial_limit=settings.max_requests_at_time,
+        min_limit=settings.gateway.min_concurrency,
+        max_limit=settings.gateway.max_concurrency,
+        latency_threshold=settings.gateway.latency_threshold,
+        backoff_ratio=settings.gateway.backoff_ratio,
+    )
+    breaker = CircuitBreaker(
+        failure_threshold=settings.gateway.failure_threshold,
+        recovery_time=settings.gateway.recovery_time,
+        half_open_requests=settings.gateway.half_open_requests,
+    )
+    return GuardedEndpoint(endpoint, limiter, breaker)
@@ -1,39 +1,50 @@
 from __future__ import annotations
-from datetime import datetime
+from datetime import datetime, time
 
-from sqlalchemy import Column, ForeignKey, Table, TIMESTAMP
+from sqlalchemy import Column, ForeignKey, Index, Table, TIMESTAMP, UniqueConstraint
 from sqlalchemy.orm import relationship, Mapped, mapped_column
 
-from .schema import MessageStatus
+from .schema import MailingState, MessageStatus
 from src.database import Base
 
 
 mailings_and_mailing_tags_association = Table(
     "mailings_and_mailing_tags_table",
     Base.metadata,
-    Column("mailing_id", ForeignKey("mailings.id")),
-    Column("mailing_tag_id", ForeignKey("mailing_tags.id")),
+    Column("mailing_id", ForeignKey("mailings.id"), index=True),
+    Column("mailing_tag_id", ForeignKey("mailing_tags.id"), index=True),
 )
 
 mailings_and_operator_codes_association = Table(
     "mailings_and_operator_codes_table",
     Base.metadata,
-    Column("mailing_id", ForeignKey("mailings.id")),
+    Column("mailing_id", ForeignKey("mailings.id"), index=True),
     Column("mailing_mobile_operator_codes_id", ForeignKey("mailing_mobile_operator_codes.id")),
+    Index("ix_mailings_and_operator_codes_table_operator_code_id", "mailing_mobile_operator_codes_id"),
 )
 
 
 class Mailing(Base):
     __tablename__ = "mailings"
+    __table_args__ = (
+        Index("ix_mailings_state_start_time", "state", "start_time"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     text: Mapped[str]
     clients_tags: Mapped[list[MailingTag]] = relationship(secondary=mailings_and_mailing_tags_association,
-                                                          lazy="subquery")
+                                                          lazy="raise")
     _clients_mobile_operator_codes: Mapped[list[MailingMobileOperatorCode]] = \
-        relationship(secondary=mailings_and_operator_codes_association, lazy="subquery")
+        relationship(secondary=mailings_and_operator_codes_association, lazy="raise")
     start_time: Mapped[datetime] = Column(type_=TIMESTAMP(timezone=True), nullable=False)  # type: ignore[assignment]
     end_time: Mapped[datetime] = Column(type_=TIMESTAMP(timezone=True), nullable=False)  # type: ignore[assignment]
+    delivery_window_start: Mapped[time | None]
+    delivery_window_end: Mapped[time | None]
+    state: Mapped[MailingState] = mapped_column(default=MailingState.scheduled,
+                                                server_default=MailingState.scheduled.name)
+    leased_by: Mapped[str | None]
+    lease_expires_at: Mapped[datetime | None] = \
+        Column(type_=TIMESTAMP(timezone=True), nullable=True)  # type: ignore[assignment]
 
     @property
     def clients_mobile_operator_codes(self) -> list[int]:
@@ -60,6 +71,10 @@ class MailingMobileOperatorCode(Base):
 
 class Message(Base):
     __tablename__ = "messages"
+    __table_args__ = (
+        Index("ix_messages_mailing_id_status_utc_offset", "mailing_id", "status", "utc_offset"),
+        UniqueConstraint("mailing_id", "client_id", name="uq_messages_mailing_id_client_id"),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, index=True)
     created_at: datetime = Column(type_=TIMESTAMP(timezone=True),
@@ -67,3 +82,14 @@ class Message(Base):
     status: Mapped[MessageStatus] = mapped_column(default=MessageStatus.not_delivered)
     mailing_id: Mapped[int]
     client_id: Mapped[int]
+    utc_offset: Mapped[int] = mapped_column(default=0, server_default="0")
+    lease_expires_at: Mapped[datetime | None] = \
+        Column(type_=TIMESTAMP(timezone=True), nullable=True)  # type: ignore[assignment]
+
+
+class MailingStatusCounter(Base):
+    __tablename__ = "mailing_stats"
+
+    mailing_id: Mapped[int] = mapped_column(primary_key=True)
+    status: Mapped[MessageStatus] = mapped_column(primary_key=True)
+    count: Mapped[int] = mapped_column(default=0)
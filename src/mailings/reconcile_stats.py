@@ -0,0 +1,17 @@
+import asyncio
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database import get_async_engine
+from src.mailings import service
+
+
+async def reconcile_mailings_stats() -> None:
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as db:
+        await service.rebuild_mailings_stats(db)
+    logger.info("Mailings stats rebuilt from messages")
+
+
+if __name__ == "__main__":
+    asyncio.run(reconcile_mailings_stats())
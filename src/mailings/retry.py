@@ -0,0 +1,52 @@
+import math
+import random
+from abc import ABC, abstractmethod
+
+from src.config import get_settings
+
+
+class RetryPolicy(ABC):
+    @abstractmethod
+    def get_delay(self, attempt: int, elapsed_time: float, retry_after: float | None = None) -> float | None:
+        """Returns seconds to wait before next attempt or None if sending should be stopped"""
+        raise NotImplementedError
+
+
+class ExponentialBackoff(RetryPolicy):
+    def __init__(self,
+                 base_delay: float,
+                 max_delay: float,
+                 max_attempts: int | None = None,
+                 max_elapsed_time: float | None = None):
+
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.max_elapsed_time = max_elapsed_time
+
+        # Exponent is clamped where max_delay is reached, so delay of late attempts doesn't overflow float
+        self.max_exponent = 0
+        if 0 < base_delay < max_delay:
+            self.max_exponent = math.ceil(math.log2(max_delay / base_delay))
+
+    def get_delay(self, attempt: int, elapsed_time: float, retry_after: float | None = None) -> float | None:
+        if self.max_attempts is not None and attempt >= self.max_attempts:
+            return None
+
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** min(attempt - 1, self.max_exponent)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        if self.max_elapsed_time is not None and elapsed_time + delay > self.max_elapsed_time:
+            return None
+        return delay
+
+
+def get_retry_policy() -> RetryPolicy:
+    settings = get_settings().retry
+    return ExponentialBackoff(
+        base_delay=settings.base_delay,
+        max_delay=settings.max_delay,
+        max_attempts=settings.max_attempts,
+        max_elapsed_time=settings.max_elapsed_time,
+    )
@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Path, status, HTTPException, Depends
+from typing import AsyncIterator
+
+from fastapi import APIRouter, Path, Query, status, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.config import get_settings
 from src.mailings import service
 from src.mailings.endpoints import Endpoint
+from src.mailings.limiting import get_guarded_endpoint
 from src.mailings.schema import MailingOut, MailingIn, Mailing, MailingInWithID, \
-    DetailMailingStats, DetailMailingStatsOut, MailingStats, MailingStatsOut
+    DetailMailingStats, DetailMailingStatsOut, MailingStats, MailingStatsOut, GatewayStats, Message, MessageStatus
 from src.exceptions import ValidationErrorSchema
 from src.dependencies import get_db_stub, log_parsed_request
 
@@ -19,10 +24,8 @@ router = APIRouter(dependencies=[Depends(log_parsed_request)])
              response_model=MailingOut,
              responses={422: {"model": ValidationErrorSchema}}
              )
-async def create_mailing(mailing: MailingIn,
-                         db: AsyncSession = Depends(get_db_stub),
-                         endpoint: Endpoint = Depends(get_endpoint_stub)) -> Mailing:
-    return await service.create_mailing(db, mailing, endpoint)
+async def create_mailing(mailing: MailingIn, db: AsyncSession = Depends(get_db_stub)) -> Mailing:
+    return await service.create_mailing(db, mailing)
 
 
 @router.delete("/mailing/{mailing_id}",
@@ -42,13 +45,11 @@ async def delete_mailing(mailing_id: int = Path(), db: AsyncSession = Depends(ge
             response_model=MailingOut,
             responses={422: {"model": ValidationErrorSchema}, 404: {}}
             )
-async def update_mailing(mailing: MailingInWithID,
-                         db: AsyncSession = Depends(get_db_stub),
-                         endpoint: Endpoint = Depends(get_endpoint_stub)) -> Mailing | None:
+async def update_mailing(mailing: MailingInWithID, db: AsyncSession = Depends(get_db_stub)) -> Mailing | None:
     mailing_in_db = await service.get_mailing_by_id(db, mailing.id)
     if not mailing_in_db:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    return await service.update_mailing(db, mailing, endpoint)
+    return await service.update_mailing(db, mailing)
 
 
 @router.get("/mailing/{mailing_id}",
@@ -71,14 +72,60 @@ async def get_stats(db: AsyncSession = Depends(get_db_stub)) -> list[MailingStat
     return await service.get_stats(db)
 
 
+@router.get("/stats/gateway",
+            tags=["stats"],
+            response_model=GatewayStats,
+            responses={404: {}}
+            )
+async def get_gateway_stats(endpoint: Endpoint = Depends(get_endpoint_stub)) -> GatewayStats:
+    guarded_endpoint = get_guarded_endpoint(endpoint)
+    if not guarded_endpoint:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    return guarded_endpoint.get_stats()
+
+
 @router.get("/stats/{mailing_id}",
             tags=["stats"],
             response_model=DetailMailingStatsOut,
             responses={422: {"model": ValidationErrorSchema}, 404: {}}
             )
 async def get_mailing_stats(mailing_id: int = Path(),
+                            message_status: MessageStatus | None = Query(default=None, alias="status"),
+                            after_id: int | None = Query(default=None),
+                            limit: int = Query(default=1000, ge=1, le=10000),
                             db: AsyncSession = Depends(get_db_stub)) -> DetailMailingStats | None:
     mailing = await service.get_mailing_by_id(db, mailing_id)
     if not mailing:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
-    return await service.get_mailing_stats(db, mailing)
+    return await service.get_mailing_stats(db, mailing, message_status, after_id, limit)
+
+
+async def messages_to_ndjson(messages_chunks: AsyncIterator[list[Message]]) -> AsyncIterator[str]:
+    async for messages in messages_chunks:
+        yield "".join(f"{message.json()}\n" for message in messages)
+
+
+@router.get("/stats/{mailing_id}/messages",
+            tags=["stats"],
+            response_class=StreamingResponse,
+            responses={
+                200: {"content": {"application/x-ndjson": {}}},
+                422: {"model": ValidationErrorSchema},
+                404: {},
+            }
+            )
+async def stream_mailing_messages(mailing_id: int = Path(),
+                                  message_status: MessageStatus | None = Query(default=None, alias="status"),
+                                  after_id: int | None = Query(default=None),
+                                  db: AsyncSession = Depends(get_db_stub)) -> StreamingResponse:
+    mailing = await service.get_mailing_by_id(db, mailing_id)
+    if not mailing:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND)
+    messages_chunks = service.stream_mailing_messages(
+        db,
+        mailing.id,
+        message_status,
+        after_id,
+        get_settings().stream_chunk_size,
+    )
+    return StreamingResponse(messages_to_ndjson(messages_chunks), media_type="application/x-ndjson")
@@ -1,43 +1,190 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
 import asyncio
+import contextlib
+import time
 
-from sqlalchemy.ext.asyncio import AsyncSession
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncEngine
 
-from .schema import Mailing
+from src.config import get_settings
+
+from .schema import Mailing, MailingState
 from .sending import Sending
 from .endpoints import Endpoint
+from .timers import DeadlineHeap
+from . import service as mailings_service
 
 
 class Schedule:
-    tasks: dict[Mailing, asyncio.Task[None]] = {}
-    expired_tasks_delition: dict[Mailing, asyncio.Task[None]] = {}
+    worker_id = uuid4().hex
+    engine: AsyncEngine | None = None
+    endpoint: Endpoint | None = None
+    polling_task: asyncio.Task[None] | None = None
+    heartbeat_task: asyncio.Task[None] | None = None
+    sending_tasks: dict[int, asyncio.Task[None]] = {}
+    claimed_mailings: set[int] = set()
+    starts: DeadlineHeap[int] = DeadlineHeap()
+    wakeup = asyncio.Event()
 
-    @staticmethod
-    async def mailing_task(db: AsyncSession, mailing: Mailing, endpoint: Endpoint) -> None:
-        if mailing.end_time.timestamp() < datetime.now().timestamp():
-            return
-        if mailing.start_time.timestamp() > datetime.now().timestamp():
-            await asyncio.sleep(mailing.start_time.timestamp() - datetime.now().timestamp())
-        await Sending(mailing).start(db, endpoint)
+    @classmethod
+    async def start(cls, engine: AsyncEngine, endpoint: Endpoint) -> None:
+        cls.engine = engine
+        cls.endpoint = endpoint
+        cls.polling_task = asyncio.create_task(cls.poll())
+        cls.heartbeat_task = asyncio.create_task(cls.heartbeat())
 
     @classmethod
-    async def delete_expired_task(cls, mailing: Mailing) -> None:
-        await asyncio.sleep(mailing.end_time.timestamp() - datetime.now().timestamp())
-        cls.tasks.pop(mailing).cancel()
-        cls.expired_tasks_delition.pop(mailing)
+    async def load_starts(cls, engine: AsyncEngine) -> int:
+        settings = get_settings()
+        page_size = settings.stream_chunk_size
+        until = datetime.now(timezone.utc) + timedelta(seconds=settings.scheduler.load_horizon)
+        loaded_count = 0
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            after = None
+            while True:
+                starts = await mailings_service.get_next_mailings_starts(db, page_size, after, until)
+                for mailing_id, start_time in starts:
+                    cls.starts.push(mailing_id, start_time.timestamp())
+                loaded_count += len(starts)
+                if len(starts) < page_size:
+                    return loaded_count
+                mailing_id, start_time = starts[-1]
+                after = start_time, mailing_id
 
     @classmethod
-    async def add_mailing_to_schedule(cls, db: AsyncSession, mailing: Mailing, endpoint: Endpoint) -> None:
-        cls.tasks[mailing] = asyncio.create_task(cls.mailing_task(db, mailing, endpoint))
-        cls.expired_tasks_delition[mailing] = asyncio.create_task(cls.delete_expired_task(mailing))
+    async def stop(cls) -> None:
+        tasks = list(cls.sending_tasks.values())
+        for task in (cls.polling_task, cls.heartbeat_task):
+            if task:
+                tasks.append(task)
+        cls.polling_task = cls.heartbeat_task = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
     @classmethod
-    async def delete_mailing_from_schedule(cls, mailing: Mailing) -> None:
-        for tasks_dict in (cls.tasks, cls.expired_tasks_delition):
-            task = tasks_dict.pop(mailing, None)
-            if not task or task.done():
+    async def poll(cls) -> None:
+        settings = get_settings().scheduler
+        while True:
+            cls.wakeup.clear()
+            cls.starts.pop_due(time.time())
+            claimed_count = 0
+            try:
+                claimed_count = await cls.claim_mailings(settings.claim_limit, settings.lease_time)
+            except Exception:
+                logger.exception("Mailings claiming failed")
+            if claimed_count >= settings.claim_limit:
                 continue
-            task.cancel()
-            async with asyncio.timeout(10):
-                while not task.cancelled():
-                    await asyncio.sleep(0)
+
+            # Polling finds mailings of other workers, known mailings are claimed right at start time
+            delay = settings.poll_interval
+            if (next_start := cls.starts.next_deadline()) is not None:
+                delay = max(0.0, min(delay, next_start - time.time()))
+            with contextlib.suppress(TimeoutError):
+                async with asyncio.timeout(delay):
+                    await cls.wakeup.wait()
+
+    @classmethod
+    async def heartbeat(cls) -> None:
+        settings = get_settings().scheduler
+        while True:
+            await asyncio.sleep(settings.heartbeat_interval)
+            try:
+                await cls.extend_leases(settings.lease_time)
+            except Exception:
+                logger.exception("Leases extension failed")
+
+    @classmethod
+    async def claim_mailings(cls, limit: int, lease_time: float) -> int:
+        assert cls.engine
+        async with AsyncSession(cls.engine, expire_on_commit=False) as db:
+            await mailings_service.cancel_expired_mailings(db)
+            claimed_mailings = await mailings_service.claim_due_mailings(db, cls.worker_id, limit, lease_time)
+            for mailing in claimed_mailings:
+                await cls.delete_mailing_from_schedule(mailing)
+                cls.claimed_mailings.add(mailing.id)
+                cls.sending_tasks[mailing.id] = asyncio.create_task(cls.mailing_task(mailing))
+
+            # Mailings claimed by other workers are sent by all workers together
+            for mailing in await mailings_service.get_running_mailings(db):
+                if mailing.id not in cls.sending_tasks:
+                    cls.sending_tasks[mailing.id] = asyncio.create_task(cls.mailing_task(mailing))
+
+            until = datetime.now(timezone.utc) + timedelta(seconds=get_settings().scheduler.load_horizon)
+            for mailing_id, start_time in await mailings_service.get_next_mailings_starts(db, limit, until=until):
+                cls.starts.push(mailing_id, start_time.timestamp())
+
+        return len(claimed_mailings)
+
+    @classmethod
+    async def extend_leases(cls, lease_time: float) -> None:
+        assert cls.engine
+        async with AsyncSession(cls.engine, expire_on_commit=False) as db:
+            messages_ids = [
+                message_id for sending in Sending.sendings.values() for message_id in sending.leased_messages
+            ]
+            if messages_ids:
+                await mailings_service.extend_messages_lease(db, messages_ids, lease_time)
+
+            if not cls.claimed_mailings:
+                return
+            claimed_mailings = set(cls.claimed_mailings)
+            extended_mailings = await mailings_service.extend_mailings_lease(
+                db,
+                cls.worker_id,
+                claimed_mailings,
+                lease_time,
+            )
+
+        # Lease is lost if mailing was updated, deleted or claimed by another worker after lease expiration
+        for mailing_id in claimed_mailings.difference(extended_mailings):
+            cls.claimed_mailings.discard(mailing_id)
+            task = cls.sending_tasks.pop(mailing_id, None)
+            if task:
+                task.cancel()
+
+    @classmethod
+    async def mailing_task(cls, mailing: Mailing) -> None:
+        assert cls.engine and cls.endpoint
+        claimed = mailing.id in cls.claimed_mailings
+        try:
+            async with AsyncSession(cls.engine, expire_on_commit=False) as db:
+                state = MailingState.cancelled
+                sending = Sending(mailing, create_messages=claimed)
+                try:
+                    await sending.start(db, cls.endpoint)
+                    state = MailingState.finished
+                except TimeoutError:
+                    pass
+                except Exception:
+                    logger.exception("Mailing sending failed")
+                    await db.rollback()
+                    state = MailingState.scheduled
+                finally:
+                    await sending.stop()
+                if claimed:
+                    await mailings_service.release_mailing(db, cls.worker_id, mailing, state)
+        finally:
+            if cls.sending_tasks.get(mailing.id) is asyncio.current_task():
+                del cls.sending_tasks[mailing.id]
+                cls.claimed_mailings.discard(mailing.id)
+
+    @classmethod
+    def add_mailing_to_schedule(cls, mailing: Mailing) -> None:
+        if mailing.end_time.timestamp() <= time.time():
+            return
+        start = mailing.start_time.timestamp()
+        cls.starts.push(mailing.id, start)
+        if cls.starts.next_deadline() == start:
+            cls.wakeup.set()
+
+    @classmethod
+    async def delete_mailing_from_schedule(cls, mailing: Mailing) -> None:
+        cls.starts.cancel(mailing.id)
+        cls.claimed_mailings.discard(mailing.id)
+        task = cls.sending_tasks.pop(mailing.id, None)
+        if not task or task.done():
+            return
+        task.cancel()
+        await asyncio.wait([task], timeout=10)
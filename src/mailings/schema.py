@@ -1,22 +1,42 @@
 from __future__ import annotations
-from datetime import datetime, timezone
+from datetime import datetime, time, timezone
+from typing import Any
 
 from enum import Enum
-from pydantic import Field
+from pydantic import Field, root_validator
 
 from src.schema import HashableBase, Base
 
 
+class MailingState(Enum):
+    scheduled = "scheduled"
+    running = "running"
+    finished = "finished"
+    cancelled = "cancelled"
+
+
 class MailingBase(HashableBase):
     text: str = Field(example="Mailing text")
     start_time: datetime = Field(default=datetime.now(timezone.utc))
     end_time: datetime = Field(default=datetime.now(timezone.utc))
+    delivery_window_start: time | None = Field(default=None, example="09:00:00")
+    delivery_window_end: time | None = Field(default=None, example="21:00:00")
+
+    @root_validator(skip_on_failure=True)
+    def delivery_window_correct(cls, values: dict[str, Any]) -> dict[str, Any]:
+        start, end = values["delivery_window_start"], values["delivery_window_end"]
+        if (start is None) != (end is None):
+            raise ValueError("Delivery window needs both start and end")
+        if start is not None and start == end:
+            raise ValueError("Delivery window start and end are equal")
+        return values
 
 
 class Mailing(MailingBase):
     id: int
     clients_tags: list[MailingTag] = []
     clients_mobile_operator_codes: list[int] = []
+    state: MailingState = MailingState.scheduled
 
     class Config:
         orm_mode = True
@@ -59,6 +79,8 @@ class MailingTagIn(MailingTagBase):
 class MessageStatus(Enum):
     delivered = "delivered"
     not_delivered = "not delivered"
+    failed = "failed"
+    expired = "expired"
 
 
 class Message(Base):
@@ -72,6 +94,18 @@ class Message(Base):
         orm_mode = True
 
 
+class CircuitState(Enum):
+    closed = "closed"
+    open = "open"
+    half_open = "half open"
+
+
+class GatewayStats(Base):
+    concurrency_limit: int = Field(example=20)
+    requests_in_flight: int = Field(example=5)
+    circuit_state: CircuitState
+
+
 class MailingStatsBase(Base):
     messages: dict[MessageStatus, int] = Field(
         example={status: 0 for status in MessageStatus}
@@ -88,6 +122,7 @@ class MailingStatsOut(MailingStatsBase):
 
 class DetailMailingStatsBase(Base):
     messages: list[Message]
+    next_after_id: int | None = Field(default=None, example=None)
 
 
 class DetailMailingStats(DetailMailingStatsBase):
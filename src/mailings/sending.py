@@ -1,6 +1,12 @@
 from __future__ import annotations
 import asyncio
+import contextlib
+import math
+import time
+from datetime import datetime, timezone
+from http import HTTPStatus
 
+import aiohttp
 from sqlalchemy.ext.asyncio import AsyncSession
 # from loguru import logger
 
@@ -8,30 +14,60 @@ from src.clients import service as clients_service
 from src.config import get_settings
 from src.clients.schema import Client
 
-from .endpoints import Endpoint
+from .endpoints import Endpoint, RetryAfter
+from .retry import RetryPolicy, get_retry_policy
 from .schema import Mailing, Message, MessageStatus
+from .status_buffer import StatusBuffer
+from .windows import DeliveryWindow
 from . import service as mailings_service
 
 
+SendingQueue = asyncio.Queue[tuple[Message, Client] | None]
+
+
 class Sending:
-    sendings: dict[Mailing, Sending] = {}
-    request_tasks_semaphore = asyncio.Semaphore(get_settings().max_requests_at_time)
+    sendings: dict[int, Sending] = {}
 
-    def __init__(self, mailing: Mailing):
+    def __init__(self, mailing: Mailing, retry_policy: RetryPolicy | None = None, create_messages: bool = True):
         self.mailing = mailing
-        self.sendings[mailing] = self
+        self.retry_policy = retry_policy or get_retry_policy()
+        self.create_messages = create_messages
+        self.sendings[mailing.id] = self
         self.request_tasks: list[asyncio.Task[None]] = []
+        self.leased_messages: set[int] = set()
+        self.deadline = math.inf
+        self.delivery_window = None
+        if mailing.delivery_window_start is not None and mailing.delivery_window_end is not None:
+            self.delivery_window = DeliveryWindow(
+                mailing.delivery_window_start,
+                mailing.delivery_window_end,
+                mailing.start_time,
+            )
+        self.utc_offsets: set[int] = set()
+        self.messages_created = asyncio.Event()
+        settings = get_settings().sending
+        self.statuses_buffer = StatusBuffer(settings.statuses_buffer_size, settings.statuses_flush_interval)
 
-    async def _send(self, db: AsyncSession, endpoint: Endpoint, message: Message, client: Client) -> None:
-        sleep_time = 0
-        status_code = 0
-        while status_code not in get_settings().successful_status_codes:
-            await asyncio.sleep(sleep_time)
-            async with self.request_tasks_semaphore:
-                try:
-                    status_code = await endpoint.send(message, client, self.mailing)
-                except asyncio.TimeoutError:
-                    pass
+    async def _set_status(self, message_id: int, status: MessageStatus) -> None:
+        self.leased_messages.discard(message_id)
+        await self.statuses_buffer.add(message_id, status)
+
+    def _is_retry_in_time(self, delay: float) -> bool:
+        return asyncio.get_running_loop().time() + delay < self.deadline
+
+    async def _send(self, endpoint: Endpoint, message: Message, client: Client) -> None:
+        started_at = asyncio.get_running_loop().time()
+        attempt = 0
+        while True:
+            attempt += 1
+            status_code: int = 0
+            retry_after = None
+            try:
+                status_code = await endpoint.send(message, client, self.mailing)
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                pass
+            except RetryAfter as e:
+                status_code, retry_after = e.status, e.delay
 
             # logger.bind(
             #     message_sent=True,
@@ -39,24 +75,214 @@ class Sending:
             #     status_code=status_code,
             # ).info("Message sent")
 
-            sleep_time += 20
-        await mailings_service.change_message_status(db, message, MessageStatus.delivered)
+            if status_code in get_settings().successful_status_codes:
+                await self._set_status(message.id, MessageStatus.delivered)
+                return
+
+            elapsed_time = asyncio.get_running_loop().time() - started_at
+            delay = self.retry_policy.get_delay(attempt, elapsed_time, retry_after)
+            if delay is None:
+                await self._set_status(message.id, MessageStatus.failed)
+                return
+            if not self._is_retry_in_time(delay):
+                return
+            await asyncio.sleep(delay)
+
+    async def _send_batch(self, endpoint: Endpoint, batch: list[tuple[Message, Client]]) -> None:
+        started_at = asyncio.get_running_loop().time()
+        attempt = 0
+        while True:
+            attempt += 1
+            retry_after = None
+            try:
+                statuses = await endpoint.send_many(batch, self.mailing)
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                statuses = [HTTPStatus.REQUEST_TIMEOUT] * len(batch)
+            except RetryAfter as e:
+                statuses, retry_after = [e.status] * len(batch), e.delay
+
+            not_sent_messages = []
+            for (message, client), status_code in zip(batch, statuses):
+                if status_code in get_settings().successful_status_codes:
+                    await self._set_status(message.id, MessageStatus.delivered)
+                else:
+                    not_sent_messages.append((message, client))
+
+            batch = not_sent_messages
+            if not batch:
+                return
+
+            elapsed_time = asyncio.get_running_loop().time() - started_at
+            delay = self.retry_policy.get_delay(attempt, elapsed_time, retry_after)
+            if delay is None:
+                for message, _ in batch:
+                    await self._set_status(message.id, MessageStatus.failed)
+                return
+            if not self._is_retry_in_time(delay):
+                return
+            await asyncio.sleep(delay)
+
+    async def _worker(self, endpoint: Endpoint, queue: SendingQueue) -> None:
+        while item := await queue.get():
+            message, client = item
+            await self._send(endpoint, message, client)
+
+    async def _batch_worker(self, endpoint: Endpoint, queue: SendingQueue) -> None:
+        settings = get_settings().sending
+        queue_closed = False
+        while not queue_closed:
+            item = await queue.get()
+            if not item:
+                return
+
+            batch = [item]
+            linger_deadline = asyncio.get_running_loop().time() + settings.batch_linger
+            while len(batch) < settings.batch_size:
+                try:
+                    async with asyncio.timeout_at(linger_deadline):
+                        item = await queue.get()
+                except TimeoutError:
+                    break
+                if not item:
+                    queue_closed = True
+                    break
+                batch.append(item)
+
+            await self._send_batch(endpoint, batch)
+
+    async def _create_messages(self, db: AsyncSession) -> None:
+        chunk_size = get_settings().sending.messages_chunk_size
+        async with AsyncSession(db.bind, expire_on_commit=False) as clients_db, \
+                AsyncSession(db.bind, expire_on_commit=False) as messages_db:
+
+            clients_chunks = clients_service.stream_clients_by_tags_or_phone_codes(
+                clients_db,
+                self.mailing.clients_tags,
+                self.mailing.clients_mobile_operator_codes,
+                chunk_size,
+            )
+            async for clients_chunk in clients_chunks:
+                await mailings_service.create_messages(messages_db, self.mailing, clients_chunk, self.delivery_window)
+                if self.delivery_window:
+                    self.utc_offsets.update(self.delivery_window.utc_offsets.values())
+                self.messages_created.set()
+
+    async def _claim_messages(self, db: AsyncSession, queue: SendingQueue) -> int:
+        settings = get_settings()
+        utc_offsets = None
+        if self.delivery_window:
+            utc_offsets = self.delivery_window.get_open_offsets(self.utc_offsets, datetime.now(timezone.utc))
+            if not utc_offsets:
+                return 0
+
+        messages = await mailings_service.claim_pending_messages(
+            db,
+            self.mailing,
+            settings.sending.messages_chunk_size,
+            settings.scheduler.lease_time,
+            utc_offsets,
+        )
+        if not messages:
+            return 0
+
+        self.leased_messages.update(message.id for message in messages)
+        clients_ids = (message.client_id for message in messages)
+        clients = {client.id: client for client in await clients_service.get_clients_by_ids(db, clients_ids)}
+        for message in messages:
+            if message.client_id in clients:
+                await queue.put((message, clients[message.client_id]))
+            else:
+                await self._set_status(message.id, MessageStatus.failed)
+        return len(messages)
+
+    async def _has_pending_messages(self, db: AsyncSession) -> bool:
+        if not self.delivery_window:
+            return await mailings_service.has_pending_messages(db, self.mailing)
+        self.utc_offsets = set(await mailings_service.get_pending_messages_utc_offsets(db, self.mailing))
+        return bool(self.utc_offsets)
+
+    def _get_idle_delay(self, poll_interval: float) -> float:
+        if not self.delivery_window:
+            return poll_interval
+
+        # Recipients of every UTC offset are released as soon as delivery window opens in their timezone
+        now = datetime.now(timezone.utc)
+        next_opening = self.delivery_window.get_next_opening(self.utc_offsets, now)
+        if not next_opening:
+            return poll_interval
+        return min(poll_interval, (next_opening - now).total_seconds())
+
+    async def _produce(self, db: AsyncSession, queue: SendingQueue, workers_count: int) -> None:
+        poll_interval = get_settings().scheduler.poll_interval
+        messages_creation = None
+        if self.create_messages:
+            messages_creation = asyncio.create_task(self._create_messages(db))
+            messages_creation.add_done_callback(lambda _: self.messages_created.set())
+        try:
+            if self.delivery_window:
+                await self._has_pending_messages(db)
+            while True:
+                self.messages_created.clear()
+                if await self._claim_messages(db, queue):
+                    continue
+                if not messages_creation and not self.delivery_window:
+                    break
+
+                # Messages of every chunk are claimed as soon as the chunk is created
+                if messages_creation and not messages_creation.done():
+                    with contextlib.suppress(TimeoutError):
+                        async with asyncio.timeout(self._get_idle_delay(poll_interval)):
+                            await self.messages_created.wait()
+                    continue
+
+                # Messages leased by other workers are claimed again if their lease expires
+                if messages_creation:
+                    messages_creation.result()
+                if not await self._has_pending_messages(db):
+                    break
+                await asyncio.sleep(self._get_idle_delay(poll_interval))
+        finally:
+            if messages_creation:
+                messages_creation.cancel()
+
+        for _ in range(workers_count):
+            await queue.put(None)
 
     async def stop(self) -> None:
         for task in self.request_tasks:
             task.cancel()
         self.request_tasks.clear()
+        await self.statuses_buffer.close()
+        if self.sendings.get(self.mailing.id) is self:
+            del self.sendings[self.mailing.id]
 
     async def start(self, db: AsyncSession, endpoint: Endpoint) -> None:
-        clients_set = {
-            *await clients_service.get_clients_by_tags(db, self.mailing.clients_tags),
-            *await clients_service.get_clients_by_phone_codes(db, self.mailing.clients_mobile_operator_codes),
-        }
-        for client in clients_set:
-            message = await mailings_service.create_message(db, self.mailing, client)
-            self.request_tasks.append(asyncio.create_task(self._send(db, endpoint, message, client)))
+        settings = get_settings()
+        self.deadline = asyncio.get_running_loop().time() + self.mailing.end_time.timestamp() - time.time()
+        self.statuses_buffer.start(db)
+
+        queue: SendingQueue = asyncio.Queue(maxsize=settings.sending.queue_size)
+        worker = self._batch_worker if settings.sending.batch_size > 1 else self._worker
+        workers_count = settings.max_requests_at_time
+        for _ in range(workers_count):
+            self.request_tasks.append(asyncio.create_task(worker(endpoint, queue)))
+
+        producer = asyncio.create_task(self._produce(db, queue, workers_count))
+        self.request_tasks.append(producer)
+        try:
+            async with asyncio.timeout_at(self.deadline):
+                await asyncio.gather(*self.request_tasks)
+        except TimeoutError:
+            # Queued messages are dropped with cancelled workers, not sent ones are expired by one statement
+            await asyncio.gather(*self.request_tasks, return_exceptions=True)
+            await self.statuses_buffer.flush()
+            if self.create_messages:
+                await db.rollback()
+                await mailings_service.expire_messages(db, self.mailing)
+            raise
+        await self.statuses_buffer.flush()
 
     @classmethod
     async def get_sending(cls, mailing: Mailing) -> Sending | None:
-        return cls.sendings.get(mailing, None)
+        return cls.sendings.get(mailing.id, None)
 
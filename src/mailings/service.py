@@ -1,12 +1,11 @@
-import asyncio
-from collections import Counter
+from datetime import datetime
+from typing import Iterable, AsyncIterator
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .schedule import Schedule
 from .sending import Sending
-
-from .endpoints import Endpoint
+from .windows import DeliveryWindow
 
 from . import schema
 from . import crud
@@ -30,10 +29,10 @@ async def delete_mailing(db: AsyncSession, mailing: schema.Mailing) -> schema.Ma
     return mailing
 
 
-async def create_mailing(db: AsyncSession, mailing: schema.MailingIn, endpoint: Endpoint) -> schema.Mailing:
+async def create_mailing(db: AsyncSession, mailing: schema.MailingIn) -> schema.Mailing:
     mailing_in_db = await crud.create_mailing(db, mailing)
     mailing_schema = schema.Mailing.from_orm(mailing_in_db)
-    task = asyncio.create_task(Schedule.add_mailing_to_schedule(db, mailing_schema, endpoint))
+    Schedule.add_mailing_to_schedule(mailing_schema)
     return mailing_schema
 
 
@@ -41,13 +40,27 @@ async def get_all_mailings(db: AsyncSession) -> list[schema.Mailing]:
     return list(map(schema.Mailing.from_orm, await crud.get_all_mailings(db)))
 
 
-async def get_mailing_messages(db: AsyncSession, mailing_id: int) -> list[schema.Message]:
-    return list(map(schema.Message.from_orm, await crud.get_mailing_messages(db, mailing_id)))
+async def get_mailing_messages(db: AsyncSession,
+                               mailing_id: int,
+                               status: schema.MessageStatus | None = None,
+                               after_id: int | None = None,
+                               limit: int | None = None) -> list[schema.Message]:
+
+    db_messages = await crud.get_mailing_messages(db, mailing_id, status, after_id, limit)
+    return list(map(schema.Message.from_orm, db_messages))
+
+
+async def stream_mailing_messages(db: AsyncSession,
+                                  mailing_id: int,
+                                  status: schema.MessageStatus | None,
+                                  after_id: int | None,
+                                  chunk_size: int) -> AsyncIterator[list[schema.Message]]:
+
+    async for db_messages in crud.stream_mailing_messages(db, mailing_id, status, after_id, chunk_size):
+        yield list(map(schema.Message.from_orm, db_messages))
 
 
-async def update_mailing(db: AsyncSession,
-                         mailing: schema.MailingInWithID,
-                         endpoint: Endpoint) -> schema.Mailing | None:
+async def update_mailing(db: AsyncSession, mailing: schema.MailingInWithID) -> schema.Mailing | None:
     db_mailing = await crud.get_mailing_by_id(db, mailing.id)
     if not db_mailing:
         return None
@@ -64,10 +77,46 @@ async def update_mailing(db: AsyncSession,
         return None
 
     updated_mailing_schema = schema.Mailing.from_orm(updated_db_mailing)
-    await Schedule.add_mailing_to_schedule(db, updated_mailing_schema, endpoint)
+    Schedule.add_mailing_to_schedule(updated_mailing_schema)
     return updated_mailing_schema
 
 
+async def claim_due_mailings(db: AsyncSession, worker_id: str, limit: int, lease_time: float) -> list[schema.Mailing]:
+    return list(map(schema.Mailing.from_orm, await crud.claim_due_mailings(db, worker_id, limit, lease_time)))
+
+
+async def get_next_mailings_starts(db: AsyncSession,
+                                   limit: int,
+                                   after: tuple[datetime, int] | None = None,
+                                   until: datetime | None = None) -> list[tuple[int, datetime]]:
+
+    return await crud.get_next_mailings_starts(db, limit, after, until)
+
+
+async def get_running_mailings(db: AsyncSession) -> list[schema.Mailing]:
+    return list(map(schema.Mailing.from_orm, await crud.get_running_mailings(db)))
+
+
+async def extend_mailings_lease(db: AsyncSession,
+                                worker_id: str,
+                                mailings_ids: Iterable[int],
+                                lease_time: float) -> list[int]:
+
+    return await crud.extend_mailings_lease(db, worker_id, mailings_ids, lease_time)
+
+
+async def cancel_expired_mailings(db: AsyncSession) -> None:
+    await crud.cancel_expired_mailings(db)
+
+
+async def release_mailing(db: AsyncSession,
+                          worker_id: str,
+                          mailing: schema.Mailing,
+                          state: schema.MailingState) -> None:
+
+    await crud.release_mailing(db, worker_id, mailing.id, state)
+
+
 async def get_mailing_by_id(db: AsyncSession, mailing_id: int) -> schema.Mailing | None:
     db_mailing = await crud.get_mailing_by_id(db, mailing_id)
     if not db_mailing:
@@ -76,26 +125,81 @@ async def get_mailing_by_id(db: AsyncSession, mailing_id: int) -> schema.Mailing
 
 
 async def get_stats(db: AsyncSession) -> list[schema.MailingStats]:
-    stats = []
-    for mailing in await get_all_mailings(db):
-        messages = await get_mailing_messages(db, mailing.id)
-        messages_dict = dict(Counter((message.status for message in messages)))
-        for sts in schema.MessageStatus:
-            if sts not in messages_dict:
-                messages_dict[sts] = 0
-        stats.append(schema.MailingStats(mailing=mailing, messages=messages_dict))
-    return stats
+    stats: dict[int, schema.MailingStats] = {}
+    for db_mailing, status, count in await crud.get_mailings_messages_count(db):
+        if db_mailing.id not in stats:
+            stats[db_mailing.id] = schema.MailingStats(
+                mailing=schema.Mailing.from_orm(db_mailing),
+                messages={sts: 0 for sts in schema.MessageStatus},
+            )
+        if status:
+            stats[db_mailing.id].messages[status] = count
+    return list(stats.values())
 
 
-async def get_mailing_stats(db: AsyncSession, mailing: schema.Mailing) -> schema.DetailMailingStats | None:
-    messages = await get_mailing_messages(db, mailing.id)
-    return schema.DetailMailingStats(mailing=mailing, messages=messages)
+async def rebuild_mailings_stats(db: AsyncSession) -> None:
+    await crud.rebuild_mailings_stats(db)
+
+
+async def get_mailing_stats(db: AsyncSession,
+                            mailing: schema.Mailing,
+                            status: schema.MessageStatus | None = None,
+                            after_id: int | None = None,
+                            limit: int | None = None) -> schema.DetailMailingStats | None:
+
+    messages = await get_mailing_messages(db, mailing.id, status, after_id, limit + 1 if limit else None)
+    next_after_id = None
+    if limit and len(messages) > limit:
+        messages = messages[:limit]
+        next_after_id = messages[-1].id
+    return schema.DetailMailingStats(mailing=mailing, messages=messages, next_after_id=next_after_id)
 
 
 async def create_message(db: AsyncSession, mailing: schema.Mailing, client: Client) -> schema.Message:
     return schema.Message.from_orm(await crud.create_message(db, mailing, client))
 
 
+async def create_messages(db: AsyncSession,
+                          mailing: schema.Mailing,
+                          clients: Iterable[Client],
+                          delivery_window: DeliveryWindow | None = None) -> list[schema.Message]:
+
+    clients = list(clients)
+    utc_offsets = None
+    if delivery_window:
+        timezones = {client.timezone for client in clients}
+        utc_offsets = {timezone: delivery_window.get_utc_offset(timezone) for timezone in timezones}
+    return list(map(schema.Message.from_orm, await crud.create_messages(db, mailing, clients, utc_offsets)))
+
+
+async def claim_pending_messages(db: AsyncSession,
+                                 mailing: schema.Mailing,
+                                 limit: int,
+                                 lease_time: float,
+                                 utc_offsets: Iterable[int] | None = None) -> list[schema.Message]:
+
+    return list(map(
+        schema.Message.from_orm,
+        await crud.claim_pending_messages(db, mailing.id, limit, lease_time, utc_offsets),
+    ))
+
+
+async def extend_messages_lease(db: AsyncSession, messages_ids: Iterable[int], lease_time: float) -> None:
+    await crud.extend_messages_lease(db, messages_ids, lease_time)
+
+
+async def get_pending_messages_utc_offsets(db: AsyncSession, mailing: schema.Mailing) -> list[int]:
+    return await crud.get_pending_messages_utc_offsets(db, mailing.id)
+
+
+async def has_pending_messages(db: AsyncSession, mailing: schema.Mailing) -> bool:
+    return await crud.has_pending_messages(db, mailing.id)
+
+
+async def expire_messages(db: AsyncSession, mailing: schema.Mailing) -> None:
+    await crud.expire_messages(db, [mailing.id])
+
+
 async def change_message_status(db: AsyncSession,
                                 message: schema.Message,
                                 status: schema.MessageStatus) -> schema.Message:
@@ -103,3 +207,7 @@ async def change_message_status(db: AsyncSession,
     await crud.change_message_status(db, message.id, status)
     message.status = status
     return message
+
+
+async def change_messages_status(db: AsyncSession, messages_ids: Iterable[int], status: schema.MessageStatus) -> None:
+    await crud.change_messages_status(db, messages_ids, status)
@@ -0,0 +1,73 @@
+import asyncio
+from collections import defaultdict
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .schema import MessageStatus
+from . import service as mailings_service
+
+
+class StatusBuffer:
+    def __init__(self, max_size: int, flush_interval: float):
+        self.max_size = max_size
+        self.flush_interval = flush_interval
+        self.statuses: defaultdict[MessageStatus, list[int]] = defaultdict(list)
+        self.size = 0
+        self.db: AsyncSession | None = None
+        self.flushing_task: asyncio.Task[None] | None = None
+        self.flush_lock = asyncio.Lock()
+
+    def start(self, db: AsyncSession) -> None:
+        if not self.db:
+            self.db = AsyncSession(db.bind, expire_on_commit=False)
+        if not self.flushing_task:
+            self.flushing_task = asyncio.create_task(self._flush_periodically())
+
+    async def add(self, message_id: int, status: MessageStatus) -> None:
+        self.statuses[status].append(message_id)
+        self.size += 1
+        if self.size >= self.max_size:
+            await self.flush()
+
+    async def flush(self) -> None:
+        async with self.flush_lock:
+            if not self.db or not self.size:
+                return
+
+            statuses = self.statuses
+            self.statuses = defaultdict(list)
+            self.size = 0
+
+            not_flushed_statuses = list(statuses.items())
+            try:
+                while not_flushed_statuses:
+                    status, messages_ids = not_flushed_statuses[0]
+                    await mailings_service.change_messages_status(self.db, messages_ids, status)
+                    not_flushed_statuses.pop(0)
+            except BaseException:
+                # Statuses are kept for the next flush even if it was cancelled,
+                # otherwise delivered messages would be sent again after lease or expired
+                for status, messages_ids in not_flushed_statuses:
+                    self.statuses[status].extend(messages_ids)
+                    self.size += len(messages_ids)
+                await self.db.rollback()
+                raise
+
+    async def close(self) -> None:
+        if self.flushing_task:
+            self.flushing_task.cancel()
+            await asyncio.gather(self.flushing_task, return_exceptions=True)
+            self.flushing_task = None
+        await self.flush()
+        if self.db:
+            await self.db.close()
+            self.db = None
+
+    async def _flush_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Messages statuses flush failed")
@@ -0,0 +1,53 @@
+import heapq
+from typing import Generic, Hashable, TypeVar
+
+
+Key = TypeVar("Key", bound=Hashable)
+
+
+class DeadlineHeap(Generic[Key]):
+    def __init__(self) -> None:
+        self.heap: list[tuple[float, int, Key]] = []
+        self.entries: dict[Key, int] = {}
+        self.counter = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, key: Key) -> bool:
+        return key in self.entries
+
+    def push(self, key: Key, deadline: float) -> None:
+        # Previous entry of key stays in heap and is skipped when it reaches the top
+        self.counter += 1
+        self.entries[key] = self.counter
+        heapq.heappush(self.heap, (deadline, self.counter, key))
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self._compact()
+
+    def cancel(self, key: Key) -> None:
+        self.entries.pop(key, None)
+
+    def next_deadline(self) -> float | None:
+        self._drop_cancelled()
+        return self.heap[0][0] if self.heap else None
+
+    def pop_due(self, now: float) -> list[Key]:
+        due = []
+        while (deadline := self.next_deadline()) is not None and deadline <= now:
+            _, _, key = heapq.heappop(self.heap)
+            del self.entries[key]
+            due.append(key)
+        return due
+
+    def _is_actual(self, entry: tuple[float, int, Key]) -> bool:
+        _, counter, key = entry
+        return self.entries.get(key) == counter
+
+    def _drop_cancelled(self) -> None:
+        while self.heap and not self._is_actual(self.heap[0]):
+            heapq.heappop(self.heap)
+
+    def _compact(self) -> None:
+        self.heap = [entry for entry in self.heap if self._is_actual(entry)]
+        heapq.heapify(self.heap)
@@ -0,0 +1,46 @@
+from datetime import datetime, time, timedelta, timezone
+from typing import Iterable
+
+import pytz
+
+
+MINUTES_IN_DAY = 24 * 60
+
+
+def _get_minute_of_day(value: time) -> int:
+    return value.hour * 60 + value.minute
+
+
+class DeliveryWindow:
+    def __init__(self, start: time, end: time, reference_time: datetime):
+        self.start = _get_minute_of_day(start)
+        self.length = (_get_minute_of_day(end) - self.start) % MINUTES_IN_DAY
+        self.reference_time = reference_time
+        self.utc_offsets: dict[str, int] = {}
+
+    def get_utc_offset(self, timezone_name: str) -> int:
+        # Offset is taken at mailing start, so clients of one timezone are in one bucket for whole mailing
+        if timezone_name not in self.utc_offsets:
+            utc_offset = self.reference_time.astimezone(pytz.timezone(timezone_name)).utcoffset()
+            self.utc_offsets[timezone_name] = int(utc_offset.total_seconds() // 60) if utc_offset else 0
+        return self.utc_offsets[timezone_name]
+
+    def _get_minutes_since_opening(self, utc_offset: int, now: datetime) -> float:
+        utc_now = now.astimezone(timezone.utc)
+        local_minute = utc_now.hour * 60 + utc_now.minute + utc_now.second / 60 + utc_offset
+        return (local_minute - self.start) % MINUTES_IN_DAY
+
+    def is_open(self, utc_offset: int, now: datetime) -> bool:
+        return self._get_minutes_since_opening(utc_offset, now) < self.length
+
+    def get_open_offsets(self, utc_offsets: Iterable[int], now: datetime) -> list[int]:
+        return [utc_offset for utc_offset in utc_offsets if self.is_open(utc_offset, now)]
+
+    def get_next_opening(self, utc_offsets: Iterable[int], now: datetime) -> datetime | None:
+        minutes_to_openings = [
+            MINUTES_IN_DAY - self._get_minutes_since_opening(utc_offset, now)
+            for utc_offset in utc_offsets if not self.is_open(utc_offset, now)
+        ]
+        if not minutes_to_openings:
+            return None
+        return now + timedelta(minutes=min(minutes_to_openings))
@@ -1,40 +1,58 @@
-from typing import Awaitable, Callable
+import time
 from uuid import uuid4
 
-from fastapi import Request, Response
 from loguru import logger
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from . import context
 
 
-async def add_request_uuid(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
-    uuid = uuid4()
-    context.request_uuid.set(uuid)
-    return await call_next(request)
-
-
-async def log_raw_request(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
-    request_uuid = context.request_uuid.get()
-    logger.bind(
-        api_received_request=True,
-        request_uuid=request_uuid.hex if request_uuid else None,
-        request_method=request.method,
-        request_method_version=request["http_version"],
-        request_type=request["type"].upper(),
-        client_host=request.client.host if request.client else None,
-        client_port=request.client.port if request.client else None,
-    ).info("API Request received")
-
-    return await call_next(request)
-
-
-async def log_response(request: Request, call_next: Callable[[Request], Awaitable[Response]]) -> Response:
-    response: Response = await call_next(request)
-    request_uuid = context.request_uuid.get()
-    logger.bind(
-        api_sent_response=True,
-        request_uuid=request_uuid.hex if request_uuid else None,
-        status_code=response.status_code,
-        content_type=response.headers.get("content-type"),
-    ).info("API Response sent")
-    return response
+class RequestLoggingMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.perf_counter_ns()
+        request_uuid = uuid4()
+        token = context.request_uuid.set(request_uuid)
+        client = scope.get("client")
+        logger.bind(
+            api_received_request=True,
+            request_uuid=request_uuid.hex,
+            request_method=scope["method"],
+            request_method_version=scope["http_version"],
+            request_type=scope["type"].upper(),
+            client_host=client[0] if client else None,
+            client_port=client[1] if client else None,
+        ).info("API Request received")
+
+        status_code = None
+        content_type = None
+
+        async def send_with_logging(message: Message) -> None:
+            nonlocal status_code, content_type
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                content_type = Headers(raw=message["headers"]).get("content-type")
+
+            await send(message)
+
+            # Response is logged after its last body chunk, so streamed responses are timed entirely
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                logger.bind(
+                    api_sent_response=True,
+                    request_uuid=request_uuid.hex,
+                    status_code=status_code,
+                    content_type=content_type,
+                    duration_us=(time.perf_counter_ns() - started_at) // 1000,
+                ).info("API Response sent")
+
+        try:
+            await self.app(scope, receive, send_with_logging)
+        finally:
+            context.request_uuid.reset(token)
@@ -0,0 +1,150 @@
+import json
+
+from src.clients import bulk, schema
+from src.mailings.schema import MailingTag
+
+
+async def iterate(items):
+    for item in items:
+        yield item
+
+
+async def collect(iterator):
+    return [item async for item in iterator]
+
+
+async def test_iter_lines():
+    chunks = [b'first\r\nsec', b'ond\n\xd1', b'\x82\xd1\x8d\xd0\xb3\nlast']
+
+    result = await collect(bulk.iter_lines(iterate(chunks)))
+
+    assert result == ["first", "second", "тэг", "last"]
+
+
+async def test_parse_ndjson():
+    lines = [
+        '{"phone_number": "+79009999999"}',
+        '',
+        '{"phone_number": ',
+        '[1, 2]',
+    ]
+
+    result = await collect(bulk.parse_ndjson(iterate(lines)))
+
+    assert result[0] == (1, {"phone_number": "+79009999999"})
+    assert result[1].row == 3
+    assert result[1].detail[0]["msg"].startswith("Invalid JSON")
+    assert result[2].row == 4
+    assert len(result) == 3
+
+
+async def test_parse_csv():
+    lines = [
+        "phone_number,phone_operator_code,timezone,tag",
+        '+79009999999,900,Europe/Amsterdam,"Any, text"',
+        "+79009999999,900",
+    ]
+
+    result = await collect(bulk.parse_csv(iterate(lines)))
+
+    assert result[0] == (2, {
+        "phone_number": "+79009999999",
+        "phone_operator_code": "900",
+        "timezone": "Europe/Amsterdam",
+        "tag": {"text": "Any, text"},
+    })
+    assert result[1].row == 3
+    assert len(result) == 2
+
+
+async def test_parse_csv_multiline_quoted_value():
+    lines = [
+        "phone_number,phone_operator_code,timezone,tag",
+        '+79009999999,900,Europe/Amsterdam,"Any',
+        '""quoted"" text"',
+        "+79009999999,900,Europe/Amsterdam,tag",
+        '+79009999999,900,Europe/Amsterdam,"not closed',
+        "",
+    ]
+
+    result = await collect(bulk.parse_csv(iterate(lines)))
+
+    assert result[0] == (2, {
+        "phone_number": "+79009999999",
+        "phone_operator_code": "900",
+        "timezone": "Europe/Amsterdam",
+        "tag": {"text": 'Any\n"quoted" text'},
+    })
+    assert result[1][0] == 4
+    assert result[2].row == 5
+    assert result[2].detail[0]["msg"] == "Quoted value isn't closed"
+    assert len(result) == 3
+
+
+async def test_parse_csv_stray_quote():
+    lines = [
+        "phone_number,phone_operator_code,timezone,tag",
+        '+79009999999,900,Europe/Amsterdam,5" tag',
+        '+79009999999,900,Europe/Amsterdam,"Any ""quoted"", text"',
+    ]
+
+    result = await collect(bulk.parse_csv(iterate(lines)))
+
+    assert result[0] == (2, {
+        "phone_number": "+79009999999",
+        "phone_operator_code": "900",
+        "timezone": "Europe/Amsterdam",
+        "tag": {"text": '5" tag'},
+    })
+    assert result[1][0] == 3
+    assert result[1][1]["tag"] == {"text": 'Any "quoted", text'}
+    assert len(result) == 2
+
+
+async def test_parse_clients():
+    chunks = [b'{"timezone": "Europe/Amsterdam"}\n']
+
+    result = await collect(bulk.parse_clients(iterate(chunks), bulk.NDJSON_CONTENT_TYPE))
+
+    assert result == [(1, {"timezone": "Europe/Amsterdam"})]
+
+
+def create_client(client_id):
+    return schema.Client(
+        id=client_id,
+        phone_number="+79009999999",
+        phone_operator_code=900,
+        timezone="Europe/Amsterdam",
+        tag=MailingTag(id=0, text="Any, text"),
+    )
+
+
+async def test_format_clients_ndjson():
+    chunks = [[create_client(1), create_client(2)], [create_client(3)]]
+
+    result = await collect(bulk.format_clients(iterate(chunks), schema.ClientsFormat.ndjson))
+
+    assert len(result) == 2
+    assert json.loads(result[0].splitlines()[1]) == {
+        "id": 2,
+        "phone_number": "+79009999999",
+        "phone_operator_code": 900,
+        "timezone": "Europe/Amsterdam",
+        "tag": {"text": "Any, text"},
+    }
+
+
+async def test_format_clients_csv():
+    chunks = [[create_client(1)]]
+
+    result = await collect(bulk.format_clients(iterate(chunks), schema.ClientsFormat.csv))
+    rows = await collect(bulk.parse_csv(iterate("".join(result).splitlines())))
+
+    assert result[0] == "id,phone_number,phone_operator_code,timezone,tag\n"
+    assert rows == [(2, {
+        "id": "1",
+        "phone_number": "+79009999999",
+        "phone_operator_code": "900",
+        "timezone": "Europe/Amsterdam",
+        "tag": {"text": "Any, text"},
+    })]
@@ -110,3 +110,112 @@ async def test_get_clients_by_phone_codes(testing_database):
     result = await clients_crud.get_clients_by_phone_codes(testing_database, phone_codes)
 
     assert result == expected_result
+
+
+async def test_get_clients_by_ids(clear_testing_database):
+    clients = [
+        clients_schema.ClientIn(
+            phone_number=f"+7{phone_code}9999999",
+            phone_operator_code=phone_code,
+            tag=mailings_schema.MailingTagIn(text="Tag"),
+            timezone="Europe/Amsterdam",
+        ) for phone_code in (900, 910, 920)
+    ]
+    db_clients = await clients_crud.create_clients(clear_testing_database, clients)
+
+    result = await clients_crud.get_clients_by_ids(clear_testing_database, [db_clients[0].id, db_clients[2].id, -1])
+
+    assert sorted(client.id for client in result) == [db_clients[0].id, db_clients[2].id]
+    assert all(client.tag.text == "Tag" for client in result)
+
+
+async def test_stream_clients_by_tags_or_phone_codes(clear_testing_database):
+    clients = [
+        clients_schema.ClientIn(
+            phone_number=f"+7{phone_code}9999999",
+            phone_operator_code=phone_code,
+            tag=mailings_schema.MailingTagIn(text=tag_text),
+            timezone="Europe/Amsterdam",
+        ) for phone_code, tag_text in ((900, "First"), (910, "First"), (900, "Second"), (920, "Third"))
+    ]
+    db_clients = await clients_crud.create_clients(clear_testing_database, clients)
+    first_tag = mailings_schema.MailingTag.from_orm(db_clients[0].tag)
+
+    chunks = [
+        chunk async for chunk in clients_crud.stream_clients_by_tags_or_phone_codes(
+            clear_testing_database, [first_tag], [900], chunk_size=2
+        )
+    ]
+
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert [client.id for chunk in chunks for client in chunk] == [client.id for client in db_clients[:3]]
+    assert all(client.tag.text for chunk in chunks for client in chunk)
+
+
+async def test_copy_clients(clear_testing_database):
+    clear_testing_database.add(mailings_models.MailingTag(text="First"))
+    await clear_testing_database.commit()
+
+    clients = [
+        clients_schema.ClientIn(
+            phone_number=f"+7{phone_code}9999999",
+            phone_operator_code=phone_code,
+            tag=mailings_schema.MailingTagIn(text=tag_text),
+            timezone="Europe/Amsterdam",
+        ) for phone_code, tag_text in ((900, "First"), (910, "Second"), (920, "First"))
+    ]
+
+    result = await clients_crud.copy_clients(clear_testing_database, clients)
+
+    db_clients = (await clear_testing_database.scalars(
+        select(clients_models.Client).order_by(clients_models.Client.id)
+    )).all()
+
+    assert result == 3
+    assert [client.phone_operator_code for client in db_clients] == [900, 910, 920]
+    assert [client.tag.text for client in db_clients] == ["First", "Second", "First"]
+    assert db_clients[0].phone_number.e164 == "+79009999999"
+
+
+async def test_get_clients_after_id_and_stream_clients(clear_testing_database):
+    clients = [
+        clients_schema.ClientIn(
+            phone_number=f"+7{phone_code}9999999",
+            phone_operator_code=phone_code,
+            tag=mailings_schema.MailingTagIn(text=tag_text),
+            timezone="Europe/Amsterdam",
+        ) for phone_code, tag_text in ((900, "First"), (910, "First"), (900, "Second"), (900, "First"))
+    ]
+    db_clients = await clients_crud.create_clients(clear_testing_database, clients)
+
+    result = await clients_crud.get_clients(clear_testing_database, limit=2, after_id=db_clients[0].id)
+
+    assert [client.id for client in result] == [client.id for client in db_clients[1:3]]
+
+    chunks = [
+        chunk async for chunk in clients_crud.stream_clients(clear_testing_database, "First", 900, chunk_size=1)
+    ]
+
+    assert [[client.id for client in chunk] for chunk in chunks] == [[db_clients[0].id], [db_clients[3].id]]
+
+
+async def test_get_clients_filters(clear_testing_database):
+    clients = [
+        clients_schema.ClientIn(
+            phone_number="+79009999999",
+            phone_operator_code=phone_code,
+            tag=mailings_schema.MailingTagIn(text=tag_text),
+            timezone=timezone,
+        ) for phone_code, tag_text, timezone in (
+            (900, "First", "Europe/Amsterdam"),
+            (900, "First", "Europe/Moscow"),
+            (910, "First", "Europe/Moscow"),
+            (900, "Second", "Europe/Moscow"),
+        )
+    ]
+    db_clients = await clients_crud.create_clients(clear_testing_database, clients)
+
+    result = await clients_crud.get_clients(clear_testing_database, tag="First", phone_operator_code=900,
+                                            timezone="Europe/Moscow")
+
+    assert [client.id for client in result] == [db_clients[1].id]
@@ -1,5 +1,7 @@
 from unittest.mock import AsyncMock, MagicMock
 
+import pytest
+
 from src.clients import service
 from src.clients import schema
 from src.clients import crud
@@ -102,3 +104,74 @@ async def test_get_clients_by_phone_codes(monkeypatch):
     crud_mock.assert_awaited_once_with(db_mock, tags_mock)
     for i in crud_mock.return_value:
         from_orm_mock.assert_any_call(i)
+
+
+async def test_stream_clients_by_tags_or_phone_codes(monkeypatch):
+    async def stream_clients(*args, **kwargs):
+        yield ["client1", "client2"]
+        yield ["client3"]
+
+    monkeypatch.setattr(crud, "stream_clients_by_tags_or_phone_codes", MagicMock(side_effect=stream_clients))
+    monkeypatch.setattr(schema.Client, "from_orm", MagicMock(side_effect=lambda x: f"{x} schema"))
+
+    chunks = [chunk async for chunk in service.stream_clients_by_tags_or_phone_codes(AsyncMock(), [], [900], 2)]
+
+    assert chunks == [["client1 schema", "client2 schema"], ["client3 schema"]]
+
+
+async def test_import_clients(monkeypatch):
+    monkeypatch.setattr(crud, "copy_clients", crud_mock := AsyncMock(side_effect=lambda db, clients: len(clients)))
+    client_data = {
+        "phone_number": "+79009999999",
+        "phone_operator_code": 900,
+        "timezone": "Europe/Amsterdam",
+        "tag": {"text": "Any text"},
+    }
+
+    async def rows():
+        yield 1, client_data
+        yield schema.ClientImportError(row=2, detail=[])
+        yield 3, {**client_data, "timezone": "Unknown"}
+        yield 4, client_data
+        yield 5, client_data
+
+    result = await service.import_clients(db_mock := AsyncMock(), rows(), batch_size=2)
+
+    assert result.created == 3
+    assert [error.row for error in result.errors] == [2, 3]
+    assert crud_mock.await_count == 2
+    assert crud_mock.await_args_list[0].args[0] is db_mock
+    assert len(crud_mock.await_args_list[0].args[1]) == 2
+
+
+async def test_stream_clients(monkeypatch):
+    async def stream_clients(*args):
+        yield ["client1", "client2"]
+        yield ["client3"]
+
+    monkeypatch.setattr(crud, "stream_clients", stream_clients)
+    monkeypatch.setattr(schema.Client, "from_orm", MagicMock(side_effect=lambda x: f"{x} schema"))
+
+    result = [chunk async for chunk in service.stream_clients(AsyncMock(), "tag", 900, 2)]
+
+    assert result == [["client1 schema", "client2 schema"], ["client3 schema"]]
+
+
+async def test_get_clients(monkeypatch):
+    monkeypatch.setattr(crud, "get_clients", crud_mock := AsyncMock(return_value=["client1"]))
+    monkeypatch.setattr(schema.Client, "from_orm", MagicMock(side_effect=lambda x: f"{x} schema"))
+
+    result = await service.get_clients(db_mock := AsyncMock(), 0, 10, 5, "tag", 900, "Europe/Amsterdam")
+
+    assert result == ["client1 schema"]
+    crud_mock.assert_awaited_once_with(db_mock, 0, 10, 5, "tag", 900, "Europe/Amsterdam")
+
+
+def test_clients_cursor():
+    cursor = service.encode_clients_cursor(123)
+
+    assert service.decode_clients_cursor(cursor) == 123
+
+    for invalid_cursor in ("not a cursor", service.encode_clients_cursor(1)[:-2], "W10"):
+        with pytest.raises(ValueError):
+            service.decode_clients_cursor(invalid_cursor)
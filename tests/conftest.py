@@ -1,5 +1,5 @@
 import asyncio
-from datetime import datetime
+from datetime import datetime, timedelta
 
 import pytest
 from httpx import AsyncClient
@@ -21,7 +21,7 @@ async def mailing():
         clients_mobile_operator_codes=[],
         text="",
         start_time=datetime.now(),
-        end_time=datetime.now(),
+        end_time=datetime.now() + timedelta(hours=1),
     )
     return mailing
 
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from sqlalchemy import select
 
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -24,18 +24,53 @@ async def test_create_mailing(testing_database: AsyncSession):
     assert db_mailing_clone.clients_mobile_operator_codes == db_mailing.clients_mobile_operator_codes
 
 
-async def test_get_tags_by_texts(clear_testing_database):
-    tags = [mailings_models.MailingTag(text=text) for text in ("First", "Second", "Third")]
-    for tag in tags:
-        clear_testing_database.add(tag)
+async def test_get_or_create_mailing_tags(clear_testing_database):
+    existed_tag = mailings_models.MailingTag(text="Second")
+    clear_testing_database.add(existed_tag)
     await clear_testing_database.commit()
 
-    tags_texts = ("First", "Third")
-    expected_result = [tags[0], tags[2]]
+    result = await mailings_crud.get_or_create_mailing_tags(clear_testing_database, ["First", "Second", "First"])
+    await clear_testing_database.commit()
 
-    result = await mailings_crud.get_tags_by_texts(clear_testing_database, tags_texts)
+    assert [tag.text for tag in result] == ["First", "Second"]
+    assert result[1] is existed_tag
+    assert len((await clear_testing_database.scalars(select(mailings_models.MailingTag))).all()) == 2
 
-    assert result == expected_result
+    assert await mailings_crud.get_or_create_mailing_tags(clear_testing_database, []) == []
+
+
+async def test_get_or_create_operator_codes(clear_testing_database):
+    clear_testing_database.add(mailings_models.MailingMobileOperatorCode(code=900))
+    await clear_testing_database.commit()
+
+    result = await mailings_crud.get_or_create_operator_codes(clear_testing_database, [910, 900])
+
+    assert [code.code for code in result] == [910, 900]
+
+
+async def test_update_mailing(clear_testing_database):
+    mailing = mailings_schema.MailingIn(
+        clients_tags=[mailings_schema.MailingTagIn(text="tag1")],
+        clients_mobile_operator_codes=[900],
+        text="mailing text",
+        start_time=datetime.now(),
+        end_time=datetime.now(),
+    )
+    db_mailing = await mailings_crud.create_mailing(clear_testing_database, mailing)
+
+    updated_mailing = mailings_schema.MailingInWithID(
+        id=db_mailing.id,
+        clients_tags=[mailings_schema.MailingTagIn(text=text) for text in ("tag1", "tag2")],
+        clients_mobile_operator_codes=[900, 910],
+        text="new text",
+        start_time=datetime.now(),
+        end_time=datetime.now(),
+    )
+    result = await mailings_crud.update_mailing(clear_testing_database, updated_mailing)
+
+    assert result.text == "new text"
+    assert [tag.text for tag in result.clients_tags] == ["tag1", "tag2"]
+    assert result.clients_mobile_operator_codes == [900, 910]
 
 
 async def test_delete_mailing_none(testing_database):
@@ -119,6 +154,69 @@ async def test_create_message(testing_database):
     assert isinstance(result.created_at, datetime)
 
 
+async def test_create_messages(clear_testing_database):
+    now = datetime.now()
+
+    mailing = mailings_schema.Mailing(
+        id=0,
+        text="text",
+        start_time=now,
+        end_time=now,
+    )
+    clients = [
+        clients_schema.Client(
+            id=client_id,
+            tag=mailings_schema.MailingTag(id=0, text="text"),
+            phone_number="+79009999999",
+            phone_operator_code=900,
+            timezone="Europe/Amsterdam",
+        ) for client_id in range(3)
+    ]
+
+    result = await mailings_crud.create_messages(clear_testing_database, mailing, clients)
+    messages_in_db = (await clear_testing_database.scalars(select(mailings_models.Message))).all()
+
+    assert len(result) == len(clients) == len(messages_in_db)
+    assert {message.client_id for message in result} == {client.id for client in clients}
+    assert all(message.mailing_id == mailing.id for message in result)
+    assert all(message.status == mailings_models.MessageStatus.not_delivered for message in result)
+
+    assert await mailings_crud.create_messages(clear_testing_database, mailing, []) == []
+
+
+async def test_create_messages_resume(clear_testing_database):
+    now = datetime.now()
+
+    mailing = mailings_schema.Mailing(id=0, text="text", start_time=now, end_time=now)
+    clients = [
+        clients_schema.Client(
+            id=client_id,
+            tag=mailings_schema.MailingTag(id=0, text="text"),
+            phone_number="+79009999999",
+            phone_operator_code=900,
+            timezone="Europe/Amsterdam",
+        ) for client_id in range(3)
+    ]
+
+    messages = await mailings_crud.create_messages(clear_testing_database, mailing, clients[:2])
+    await mailings_crud.change_messages_status(
+        clear_testing_database,
+        [messages[0].id],
+        mailings_schema.MessageStatus.delivered,
+    )
+
+    result = await mailings_crud.create_messages(clear_testing_database, mailing, clients)
+    messages_in_db = (await clear_testing_database.scalars(select(mailings_models.Message))).all()
+
+    assert len(messages_in_db) == len(clients)
+    assert [message.client_id for message in result] == [clients[2].id]
+
+    counts = {status: count for _, status, count in await mailings_crud.get_mailings_messages_count(
+        clear_testing_database
+    )}
+    assert counts[mailings_schema.MessageStatus.not_delivered] == 2
+
+
 async def test_change_message_status(clear_testing_database):
     default_status = mailings_schema.MessageStatus.not_delivered
     expected_status = mailings_schema.MessageStatus.delivered
@@ -146,3 +244,244 @@ async def test_change_message_status(clear_testing_database):
     message = await mailings_crud.change_message_status(clear_testing_database, 999, expected_status)
 
     assert message is None
+
+
+async def test_change_messages_status(clear_testing_database):
+    messages = [
+        mailings_models.Message(
+            created_at=datetime.now(),
+            status=mailings_schema.MessageStatus.not_delivered,
+            mailing_id=0,
+            client_id=client_id,
+        ) for client_id in range(3)
+    ]
+    clear_testing_database.add_all(messages)
+    await clear_testing_database.commit()
+
+    await mailings_crud.change_messages_status(
+        clear_testing_database,
+        [messages[0].id, messages[2].id],
+        mailings_schema.MessageStatus.delivered,
+    )
+
+    statuses = dict((await clear_testing_database.execute(
+        select(mailings_models.Message.id, mailings_models.Message.status)
+    )).all())
+
+    assert statuses == {
+        messages[0].id: mailings_schema.MessageStatus.delivered,
+        messages[1].id: mailings_schema.MessageStatus.not_delivered,
+        messages[2].id: mailings_schema.MessageStatus.delivered,
+    }
+
+
+async def test_claim_due_mailings(clear_testing_database):
+    now = datetime.now(timezone.utc)
+    mailings = [
+        mailings_models.Mailing(text="Due", start_time=now - timedelta(minutes=1), end_time=now + timedelta(hours=1)),
+        mailings_models.Mailing(text="Future", start_time=now + timedelta(hours=1), end_time=now + timedelta(hours=2)),
+        mailings_models.Mailing(text="Expired", start_time=now - timedelta(hours=2), end_time=now - timedelta(hours=1)),
+    ]
+    clear_testing_database.add_all(mailings)
+    await clear_testing_database.commit()
+
+    claimed = await mailings_crud.claim_due_mailings(clear_testing_database, "worker", 10, 30)
+
+    assert [mailing.id for mailing in claimed] == [mailings[0].id]
+    assert claimed[0].clients_tags == []
+    assert claimed[0].state == mailings_schema.MailingState.running
+    assert await mailings_crud.claim_due_mailings(clear_testing_database, "another worker", 10, 30) == []
+    assert await mailings_crud.get_running_mailings(clear_testing_database) == claimed
+    assert await mailings_crud.get_next_mailings_starts(clear_testing_database, 10) == \
+           [(mailings[1].id, mailings[1].start_time)]
+    assert await mailings_crud.get_next_mailings_starts(
+        clear_testing_database, 10, after=(mailings[1].start_time, mailings[1].id)
+    ) == []
+    assert await mailings_crud.get_next_mailings_starts(clear_testing_database, 10, until=now) == []
+
+    await mailings_crud.cancel_expired_mailings(clear_testing_database)
+
+    states = dict((await clear_testing_database.execute(
+        select(mailings_models.Mailing.id, mailings_models.Mailing.state)
+    )).all())
+    assert states == {
+        mailings[0].id: mailings_schema.MailingState.running,
+        mailings[1].id: mailings_schema.MailingState.scheduled,
+        mailings[2].id: mailings_schema.MailingState.cancelled,
+    }
+
+
+async def test_mailings_lease(clear_testing_database):
+    now = datetime.now(timezone.utc)
+    mailing = mailings_models.Mailing(text="Due", start_time=now, end_time=now + timedelta(hours=1))
+    clear_testing_database.add(mailing)
+    await clear_testing_database.commit()
+
+    await mailings_crud.claim_due_mailings(clear_testing_database, "worker", 10, -1)
+    assert await mailings_crud.extend_mailings_lease(clear_testing_database, "another worker", [mailing.id], 30) == []
+
+    claimed = await mailings_crud.claim_due_mailings(clear_testing_database, "another worker", 10, 30)
+    assert [mailing.id for mailing in claimed] == [mailing.id]
+    assert await mailings_crud.extend_mailings_lease(clear_testing_database, "worker", [mailing.id], 30) == []
+    assert await mailings_crud.extend_mailings_lease(clear_testing_database, "another worker", [mailing.id], 30) == \
+           [mailing.id]
+
+    await mailings_crud.release_mailing(clear_testing_database, "worker", mailing.id, mailings_schema.MailingState.finished)
+    await mailings_crud.release_mailing(clear_testing_database, "another worker", mailing.id,
+                                        mailings_schema.MailingState.finished)
+
+    state = await clear_testing_database.scalar(
+        select(mailings_models.Mailing.state).where(mailings_models.Mailing.id == mailing.id)
+    )
+    assert state == mailings_schema.MailingState.finished
+
+
+async def test_claim_pending_messages(clear_testing_database):
+    now = datetime.now(timezone.utc)
+    mailing = mailings_models.Mailing(text="Due", start_time=now, end_time=now + timedelta(hours=1))
+    clear_testing_database.add(mailing)
+    await clear_testing_database.commit()
+    clear_testing_database.add_all([
+        mailings_models.Message(created_at=now, status=status, mailing_id=mailing.id, client_id=client_id)
+        for client_id, status in enumerate((mailings_schema.MessageStatus.not_delivered,) * 3
+                                           + (mailings_schema.MessageStatus.delivered,))
+    ])
+    await clear_testing_database.commit()
+
+    assert await mailings_crud.claim_pending_messages(clear_testing_database, mailing.id, 2, 30) == []
+
+    await mailings_crud.claim_due_mailings(clear_testing_database, "worker", 10, 30)
+    first_chunk = await mailings_crud.claim_pending_messages(clear_testing_database, mailing.id, 2, 30)
+    second_chunk = await mailings_crud.claim_pending_messages(clear_testing_database, mailing.id, 2, -1)
+
+    assert [message.client_id for message in first_chunk] == [0, 1]
+    assert [message.client_id for message in second_chunk] == [2]
+    assert await mailings_crud.has_pending_messages(clear_testing_database, mailing.id)
+
+    expired_chunk = await mailings_crud.claim_pending_messages(clear_testing_database, mailing.id, 2, 30)
+    assert [message.client_id for message in expired_chunk] == [2]
+    assert await mailings_crud.claim_pending_messages(clear_testing_database, mailing.id, 2, 30) == []
+
+
+async def test_claim_pending_messages_by_utc_offsets(clear_testing_database):
+    now = datetime.now(timezone.utc)
+    mailing = mailings_models.Mailing(text="Due", start_time=now, end_time=now + timedelta(hours=1))
+    clear_testing_database.add(mailing)
+    await clear_testing_database.commit()
+    await mailings_crud.claim_due_mailings(clear_testing_database, "worker", 10, 30)
+    mailing_schema = mailings_schema.Mailing(id=mailing.id, text="Due", start_time=now, end_time=now)
+    clients = [
+        clients_schema.Client(
+            id=client_id,
+            tag=mailings_schema.MailingTag(id=0, text="text"),
+            phone_number="+79009999999",
+            phone_operator_code=900,
+            timezone=client_timezone,
+        ) for client_id, client_timezone in enumerate(("Europe/Moscow", "Asia/Tokyo", "Europe/Moscow"))
+    ]
+    utc_offsets = {"Europe/Moscow": 180, "Asia/Tokyo": 540}
+
+    await mailings_crud.create_messages(clear_testing_database, mailing_schema, clients, utc_offsets)
+
+    assert sorted(await mailings_crud.get_pending_messages_utc_offsets(clear_testing_database, mailing.id)) \
+        == [180, 540]
+    claimed = await mailings_crud.claim_pending_messages(clear_testing_database, mailing.id, 10, 30, [180])
+    assert [message.client_id for message in claimed] == [0, 2]
+    assert await mailings_crud.claim_pending_messages(clear_testing_database, mailing.id, 10, 30, []) == []
+
+
+async def test_get_mailings_messages_count(clear_testing_database):
+    mailings = [
+        mailings_models.Mailing(text="Mailing text", start_time=datetime.now(), end_time=datetime.now())
+        for _ in range(2)
+    ]
+    clear_testing_database.add_all(mailings)
+    await clear_testing_database.commit()
+
+    mailing_schema = mailings_schema.Mailing.from_orm(mailings[0])
+    clients = [
+        clients_schema.Client(
+            id=client_id,
+            tag=mailings_schema.MailingTag(id=0, text="text"),
+            phone_number="+79009999999",
+            phone_operator_code=900,
+            timezone="Europe/Amsterdam",
+        ) for client_id in range(3)
+    ]
+    messages = await mailings_crud.create_messages(clear_testing_database, mailing_schema, clients)
+    await mailings_crud.change_messages_status(
+        clear_testing_database,
+        [message.id for message in messages[:2]],
+        mailings_schema.MessageStatus.delivered,
+    )
+    await mailings_crud.change_message_status(clear_testing_database, messages[0].id,
+                                              mailings_schema.MessageStatus.failed)
+
+    result = await mailings_crud.get_mailings_messages_count(clear_testing_database)
+
+    counts = {(mailing.id, status): count for mailing, status, count in result}
+
+    assert counts == {
+        (mailings[0].id, mailings_schema.MessageStatus.delivered): 1,
+        (mailings[0].id, mailings_schema.MessageStatus.failed): 1,
+        (mailings[0].id, mailings_schema.MessageStatus.not_delivered): 1,
+        (mailings[1].id, None): 0,
+    }
+
+
+async def test_rebuild_mailings_stats(clear_testing_database):
+    clear_testing_database.add_all([
+        mailings_models.Message(created_at=datetime.now(), status=status, mailing_id=0, client_id=client_id)
+        for client_id, status in enumerate(
+            (mailings_schema.MessageStatus.delivered,) * 2 + (mailings_schema.MessageStatus.failed,)
+        )
+    ])
+    clear_testing_database.add(mailings_models.MailingStatusCounter(
+        mailing_id=0,
+        status=mailings_schema.MessageStatus.not_delivered,
+        count=5,
+    ))
+    await clear_testing_database.commit()
+
+    await mailings_crud.rebuild_mailings_stats(clear_testing_database)
+
+    counts = dict((await clear_testing_database.execute(
+        select(mailings_models.MailingStatusCounter.status, mailings_models.MailingStatusCounter.count)
+    )).all())
+
+    assert counts == {
+        mailings_schema.MessageStatus.delivered: 2,
+        mailings_schema.MessageStatus.failed: 1,
+    }
+
+
+async def test_get_mailing_messages(clear_testing_database):
+    statuses = [
+        mailings_schema.MessageStatus.delivered,
+        mailings_schema.MessageStatus.failed,
+        mailings_schema.MessageStatus.delivered,
+        mailings_schema.MessageStatus.delivered,
+    ]
+    messages = [
+        mailings_models.Message(created_at=datetime.now(), status=status, mailing_id=0, client_id=client_id)
+        for client_id, status in enumerate(statuses)
+    ]
+    clear_testing_database.add_all(messages)
+    await clear_testing_database.commit()
+
+    result = await mailings_crud.get_mailing_messages(
+        clear_testing_database,
+        0,
+        mailings_schema.MessageStatus.delivered,
+        after_id=messages[0].id,
+        limit=1,
+    )
+
+    assert [message.id for message in result] == [messages[2].id]
+
+    chunks = [
+        [message.id for message in chunk]
+        async for chunk in mailings_crud.stream_mailing_messages(clear_testing_database, 0, None, None, 3)
+    ]
+
+    assert chunks == [[message.id for message in messages[:3]], [messages[3].id]]
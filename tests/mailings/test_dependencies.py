@@ -1,8 +1,12 @@
 import pytest
 
-from src.mailings.dependencies import get_endpoint_stub
+from src.mailings.dependencies import get_endpoint_stub, get_endpoint
 
 
 async def test_get_endpoint_stub():
     with pytest.raises(NotImplementedError):
         await get_endpoint_stub()
+
+
+async def test_get_endpoint():
+    assert await get_endpoint() is await get_endpoint()
@@ -1,4 +1,8 @@
+import asyncio
 import builtins
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from http import HTTPStatus
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
@@ -49,6 +53,168 @@ async def test_apiendpoint(monkeypatch):
 
     assert status_code == response_mock.status
 
+    session = endpoint.session
+    await endpoint.send(message_mock, client_mock, mailing_mock)
+    assert endpoint.session is session
+
+    await endpoint.close()
+    assert session.closed
+
+
+async def test_apiendpoint_session_settings(monkeypatch):
+    settings_mock = MagicMock()
+    settings_mock.endpoint.connections_limit = 10
+    settings_mock.endpoint.connections_limit_per_host = 5
+    settings_mock.endpoint.keepalive_timeout = 15
+    settings_mock.endpoint.dns_cache_ttl = 60
+    settings_mock.endpoint.total_timeout = 30
+    settings_mock.endpoint.connect_timeout = 3
+    settings_mock.endpoint.read_timeout = 7
+    monkeypatch.setattr(endpoints, "get_settings", lambda: settings_mock)
+
+    endpoint = endpoints.APIEndpoint("url/send")
+    session = endpoint.session
+
+    assert session.connector.limit == 10
+    assert session.connector.limit_per_host == 5
+    assert session.timeout.total == 30
+    assert session.timeout.connect == 3
+    assert session.timeout.sock_read == 7
+
+    await endpoint.close()
+    assert session.closed
+    assert endpoint.session is not session
+    await endpoint.close()
+
+
+async def test_send_many_fallback(monkeypatch):
+    monkeypatch.setattr(endpoints.Endpoint, "__abstractmethods__", set())
+    endpoint = endpoints.Endpoint()
+    monkeypatch.setattr(endpoint, "send", send_mock := AsyncMock(side_effect=[
+        HTTPStatus(200),
+        asyncio.TimeoutError(),
+        HTTPStatus(500),
+    ]))
+
+    messages = [(MagicMock(), MagicMock()) for _ in range(3)]
+    statuses = await endpoint.send_many(messages, mailing_mock := MagicMock())
+
+    assert statuses == [HTTPStatus(200), HTTPStatus.REQUEST_TIMEOUT, HTTPStatus(500)]
+    assert send_mock.await_count == 3
+    send_mock.assert_any_await(messages[0][0], messages[0][1], mailing_mock)
+
+
+async def test_send_many_fallback_errors(monkeypatch):
+    monkeypatch.setattr(endpoints.Endpoint, "__abstractmethods__", set())
+    endpoint = endpoints.Endpoint()
+    monkeypatch.setattr(endpoint, "send", AsyncMock(side_effect=[
+        HTTPStatus(200),
+        endpoints.aiohttp.ClientConnectionError(),
+        endpoints.RetryAfter(HTTPStatus.TOO_MANY_REQUESTS, 5),
+    ]))
+
+    statuses = await endpoint.send_many([(MagicMock(), MagicMock()) for _ in range(3)], MagicMock())
+
+    assert statuses == [HTTPStatus(200), HTTPStatus.REQUEST_TIMEOUT, HTTPStatus.TOO_MANY_REQUESTS]
+
+
+async def test_apiendpoint_send_many(monkeypatch):
+    endpoint = endpoints.APIEndpoint("url/send", "url/batch")
+
+    response_mock = MagicMock()
+    response_mock.status = 200
+    response_mock.headers = {}
+    response_mock.json = AsyncMock(return_value=[{"id": 1, "status": 200}, {"id": 2, "status": 500}])
+
+    async def get_response(*args, **kwargs):
+        return response_mock
+
+    coro_mock = AsyncMock()
+    coro_mock.__aenter__ = get_response
+    post_mock = MagicMock(return_value=coro_mock)
+    monkeypatch.setattr(endpoints.aiohttp.ClientSession, "post", post_mock)
+
+    messages = []
+    for message_id in (1, 2, 3):
+        message_mock = MagicMock()
+        message_mock.id = message_id
+        client_mock = MagicMock()
+        client_mock.phone_number = "+71111111111"
+        messages.append((message_mock, client_mock))
+    mailing_mock = MagicMock()
+    mailing_mock.text = "mailing text"
+
+    statuses = await endpoint.send_many(messages, mailing_mock)
+
+    post_mock.assert_called_once_with("url/batch", json=[
+        {"id": message_id, "phone": 71111111111, "text": "mailing text"} for message_id in (1, 2, 3)
+    ])
+    assert statuses == [HTTPStatus(200), HTTPStatus(500), HTTPStatus(200)]
+
+    response_mock.status = 503
+    response_mock.json = AsyncMock(return_value={"detail": "Unavailable"})
+
+    statuses = await endpoint.send_many(messages, mailing_mock)
+
+    assert statuses == [HTTPStatus(503)] * 3
+    await endpoint.close()
+
+
+async def test_apiendpoint_send_many_without_batch_url(monkeypatch):
+    endpoint = endpoints.APIEndpoint("url/send")
+    monkeypatch.setattr(endpoint, "send", send_mock := AsyncMock(return_value=HTTPStatus(200)))
+
+    statuses = await endpoint.send_many([(MagicMock(), MagicMock())] * 2, MagicMock())
+
+    assert statuses == [HTTPStatus(200)] * 2
+    assert send_mock.await_count == 2
+
+
+async def test_testendpoint_send_many(monkeypatch):
+    endpoint = endpoints.TestEndpoint()
+    monkeypatch.setattr(builtins, "print", print_mock := MagicMock())
+
+    statuses = await endpoint.send_many([(MagicMock(), MagicMock())] * 3, MagicMock())
+
+    assert statuses == [HTTPStatus(200)] * 3
+    print_mock.assert_called()
+
+
+async def test_apiendpoint_retry_after(monkeypatch):
+    endpoint = endpoints.APIEndpoint("url/send")
+
+    response_mock = MagicMock()
+    response_mock.status = 429
+    response_mock.headers = {"Retry-After": "120"}
+
+    async def get_response(*args, **kwargs):
+        return response_mock
+
+    coro_mock = AsyncMock()
+    coro_mock.__aenter__ = get_response
+    monkeypatch.setattr(endpoints.aiohttp.ClientSession, "post", MagicMock(return_value=coro_mock))
+
+    with pytest.raises(endpoints.RetryAfter) as exc_info:
+        await endpoint.send(MagicMock(), MagicMock(phone_number="+71111111111"), MagicMock())
+
+    assert exc_info.value.status == HTTPStatus.TOO_MANY_REQUESTS
+    assert exc_info.value.delay == 120
+
+    response_mock.status = 500
+    assert await endpoint.send(MagicMock(), MagicMock(phone_number="+71111111111"), MagicMock()) == 500
+    await endpoint.close()
+
+
+def test_parse_retry_after():
+    assert endpoints.parse_retry_after(None) is None
+    assert endpoints.parse_retry_after("15") == 15
+    assert endpoints.parse_retry_after("-5") == 0
+    assert endpoints.parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert endpoints.parse_retry_after("Not a date") is None
+
+    retry_time = datetime.now(timezone.utc) + timedelta(seconds=100)
+    assert 90 < endpoints.parse_retry_after(format_datetime(retry_time, usegmt=True)) <= 100
+
 
 async def test_testendpoint(monkeypatch):
     endpoint = endpoints.TestEndpoint()
@@ -0,0 +1,333 @@
+import asyncio
+from http import HTTPStatus
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from src.mailings import limiting, endpoints
+from src.mailings.schema import CircuitState
+
+
+def create_limiter(**kwargs):
+    params = dict(initial_limit=4, min_limit=1, max_limit=5, latency_threshold=1, backoff_ratio=0.5)
+    params.update(kwargs)
+    return limiting.AdaptiveLimiter(**params)
+
+
+async def test_limiter_aimd():
+    limiter = create_limiter()
+
+    await limiter.acquire()
+    limiter.release(latency=0.1, success=True)
+    assert limiter.limit == 4.25
+
+    await limiter.acquire()
+    limiter.release(latency=5, success=True)
+    assert limiter.current_limit == 2
+
+    await limiter.acquire()
+    limiter.release(latency=0.1, success=False)
+    assert limiter.current_limit == 1
+
+    await limiter.acquire()
+    limiter.release(latency=0.1, success=False)
+    assert limiter.current_limit == 1
+
+    await limiter.acquire()
+    limiter.release(latency=0.1, success=None)
+    assert limiter.current_limit == 1
+    assert limiter.in_flight == 0
+
+
+async def test_limiter_max_limit():
+    limiter = create_limiter(initial_limit=5)
+
+    await limiter.acquire()
+    limiter.release(latency=0.1, success=True)
+
+    assert limiter.limit == 5
+
+
+async def test_limiter_waits_for_free_slot():
+    limiter = create_limiter(initial_limit=1)
+    await limiter.acquire()
+
+    waiting_task = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiting_task.done()
+
+    limiter.release(latency=0.1, success=True)
+    await asyncio.wait_for(waiting_task, 1)
+    assert limiter.in_flight == 1
+
+
+async def test_limiter_woken_waiter_cancelled():
+    limiter = create_limiter(initial_limit=1)
+    await limiter.acquire()
+
+    cancelled_task = asyncio.create_task(limiter.acquire())
+    waiting_task = asyncio.create_task(limiter.acquire())
+    await asyncio.sleep(0.01)
+
+    limiter.release(latency=0.1, success=None)
+    cancelled_task.cancel()
+    await asyncio.gather(cancelled_task, return_exceptions=True)
+
+    await asyncio.wait_for(waiting_task, 1)
+    assert cancelled_task.cancelled()
+    assert limiter.in_flight == 1
+
+
+async def test_circuit_breaker(monkeypatch):
+    now = 100
+    monkeypatch.setattr(limiting.time, "monotonic", lambda: now)
+    breaker = limiting.CircuitBreaker(failure_threshold=2, recovery_time=10, half_open_requests=1)
+
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.closed
+    breaker.record_failure()
+    assert breaker.state == CircuitState.open
+    assert not breaker.allow_request()
+    assert breaker.retry_after == 10
+
+    assert breaker.rejects_requests
+
+    now = 110
+    assert breaker.state == CircuitState.half_open
+    assert not breaker.rejects_requests
+    assert breaker.allow_request()
+    assert breaker.rejects_requests
+    assert not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.open
+
+    now = 120
+    assert breaker.allow_request()
+    breaker.record_cancel()
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitState.closed
+    assert breaker.failures == 0
+
+
+def create_guarded_endpoint(endpoint):
+    return limiting.GuardedEndpoint(
+        endpoint,
+        create_limiter(),
+        limiting.CircuitBreaker(failure_threshold=1, recovery_time=30, half_open_requests=1),
+    )
+
+
+async def test_guarded_endpoint_send():
+    endpoint_mock = MagicMock()
+    endpoint_mock.send = AsyncMock(return_value=HTTPStatus(200))
+    endpoint = create_guarded_endpoint(endpoint_mock)
+
+    status = await endpoint.send(message := MagicMock(), client := MagicMock(), mailing := MagicMock())
+
+    assert status == HTTPStatus(200)
+    endpoint_mock.send.assert_awaited_once_with(message, client, mailing)
+    assert endpoint.limiter.in_flight == 0
+    assert endpoint.limiter.limit > 4
+
+
+async def test_guarded_endpoint_opens_circuit():
+    endpoint_mock = MagicMock()
+    endpoint_mock.send = AsyncMock(side_effect=asyncio.TimeoutError())
+    endpoint = create_guarded_endpoint(endpoint_mock)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await endpoint.send(MagicMock(), MagicMock(), MagicMock())
+
+    assert endpoint.breaker.state == CircuitState.open
+    assert endpoint.limiter.current_limit == 2
+
+    with pytest.raises(endpoints.RetryAfter) as exc_info:
+        await endpoint.send(MagicMock(), MagicMock(), MagicMock())
+
+    assert exc_info.value.status == HTTPStatus.SERVICE_UNAVAILABLE
+    assert 0 < exc_info.value.delay <= 30
+    endpoint_mock.send.assert_awaited_once()
+
+
+async def test_guarded_endpoint_cancelled_while_waiting_limiter():
+    endpoint_mock = MagicMock()
+    endpoint_mock.send = AsyncMock(return_value=HTTPStatus(200))
+    endpoint = create_guarded_endpoint(endpoint_mock)
+    endpoint.breaker._state = CircuitState.half_open
+    endpoint.limiter.in_flight = endpoint.limiter.current_limit
+
+    sending_task = asyncio.create_task(endpoint.send(MagicMock(), MagicMock(), MagicMock()))
+    await asyncio.sleep(0.01)
+    sending_task.cancel()
+    await asyncio.gather(sending_task, return_exceptions=True)
+
+    assert endpoint.breaker.half_open_in_flight == 0
+    endpoint.limiter.in_flight = 0
+    assert await endpoint.send(MagicMock(), MagicMock(), MagicMock()) == HTTPStatus(200)
+    assert endpoint.breaker.state == CircuitState.closed
+
+
+async def test_guarded_endpoint_send_many():
+    endpoint_mock = MagicMock()
+    endpoint_mock.send_many = AsyncMock(return_value=[HTTPStatus(200), HTTPStatus(502)])
+    endpoint = create_guarded_endpoint(endpoint_mock)
+
+    statuses = await endpoint.send_many(messages := [MagicMock(), MagicMock()], mailing := MagicMock())
+
+    assert statuses == [HTTPStatus(200), HTTPStatus(502)]
+    endpoint_mock.send_many.assert_awaited_once_with(messages, mailing)
+    assert endpoint.breaker.state == CircuitState.open
+
+
+async def test_guarded_endpoint_stats_and_close():
+    endpoint_mock = AsyncMock()
+    endpoint = create_guarded_endpoint(endpoint_mock)
+
+    stats = endpoint.get_stats()
+    await endpoint.close()
+
+    assert stats.concurrency_limit == 4
+    assert stats.requests_in_flight == 0
+    assert stats.circuit_state == CircuitState.closed
+    endpoint_mock.close.assert_awaited_once()
+
+
+def test_guard_endpoint(monkeypatch):
+    settings_mock = MagicMock()
+    settings_mock.max_requests_at_time = 10
+    settings_mock.gateway.min_concurrency = 2
+    settings_mock.gateway.max_concurrency = 50
+    settings_mock.gateway.failure_threshold = 5
+    monkeypatch.setattr(limiting, "get_settings", lambda: settings_mock)
+
+    endpoint = limiting.guard_endpoint(endpoint_mock := MagicMock())
+
+    assert endpoint.endpoint is endpoint_mock
+    assert endpoint.limiter.current_limit == 10
+    assert endpoint.limiter.max_limit == 50
+    assert endpoint.breaker.failure_threshold == 5
+
+
+async def test_token_bucket(monkeypatch):
+    now = 0.0
+    monkeypatch.setattr(limiting.time, "monotonic", lambda: now)
+    bucket = limiting.TokenBucket(rate=2, capacity=2)
+
+    await bucket.acquire(2)
+    assert bucket.tokens == 0
+
+    async def sleep(delay):
+        nonlocal now
+        now += delay
+
+    monkeypatch.setattr(limiting.asyncio, "sleep", sleep)
+    await bucket.acquire()
+
+    assert now == 0.5
+    assert bucket.tokens == 0
+
+
+async def test_token_bucket_bigger_than_capacity(monkeypatch):
+    monkeypatch.setattr(limiting.time, "monotonic", lambda: 0.0)
+    bucket = limiting.TokenBucket(rate=1, capacity=2)
+
+    await bucket.acquire(5)
+
+    assert bucket.tokens == -3
+
+
+async def test_rate_limited_endpoint():
+    endpoint_mock = AsyncMock()
+    endpoint_mock.send = AsyncMock(return_value=HTTPStatus(200))
+    bucket = AsyncMock()
+    endpoint = limiting.RateLimitedEndpoint(endpoint_mock, bucket, 10, {900: 5}, burst_time=2)
+    client = MagicMock()
+    client.phone_operator_code = 900
+
+    status = await endpoint.send(message := MagicMock(), client, mailing := MagicMock())
+
+    assert status == HTTPStatus(200)
+    endpoint_mock.send.assert_awaited_once_with(message, client, mailing)
+    bucket.acquire.assert_awaited_once_with(1)
+    assert endpoint.operator_codes_buckets[900].rate == 5
+    assert endpoint.operator_codes_buckets[900].capacity == 10
+
+
+async def test_rate_limited_endpoint_circuit_open():
+    endpoint_mock = MagicMock()
+    endpoint_mock.send = AsyncMock(return_value=HTTPStatus(200))
+    guarded_endpoint = create_guarded_endpoint(endpoint_mock)
+    guarded_endpoint.breaker.record_failure()
+    bucket = AsyncMock()
+    endpoint = limiting.RateLimitedEndpoint(guarded_endpoint, bucket, None, {}, burst_time=1)
+
+    with pytest.raises(endpoints.RetryAfter) as exc_info:
+        await endpoint.send(MagicMock(), MagicMock(), MagicMock())
+
+    assert exc_info.value.status == HTTPStatus.SERVICE_UNAVAILABLE
+    assert 0 < exc_info.value.delay <= 30
+    bucket.acquire.assert_not_awaited()
+    endpoint_mock.send.assert_not_awaited()
+
+
+async def test_rate_limited_endpoint_send_many():
+    endpoint_mock = AsyncMock()
+    endpoint_mock.send_many = AsyncMock(return_value=[HTTPStatus(200), HTTPStatus(200)])
+    endpoint = limiting.RateLimitedEndpoint(endpoint_mock, None, None, {900: 5}, burst_time=1)
+    first_client, second_client = MagicMock(), MagicMock()
+    first_client.phone_operator_code = 900
+    second_client.phone_operator_code = 901
+    messages = [(MagicMock(), first_client), (MagicMock(), second_client)]
+
+    statuses = await endpoint.send_many(messages, mailing := MagicMock())
+    await endpoint.close()
+
+    assert statuses == [HTTPStatus(200), HTTPStatus(200)]
+    endpoint_mock.send_many.assert_awaited_once_with(messages, mailing)
+    endpoint_mock.close.assert_awaited_once()
+    assert endpoint.operator_codes_buckets[900].tokens == 4
+    assert endpoint.operator_codes_buckets[901] is None
+
+
+def test_rate_limit_endpoint(monkeypatch):
+    settings_mock = MagicMock()
+    settings_mock.rate_limit.messages_per_second = None
+    settings_mock.rate_limit.operator_code_messages_per_second = None
+    settings_mock.rate_limit.operator_codes_messages_per_second = {}
+    settings_mock.workers = 1
+    monkeypatch.setattr(limiting, "get_settings", lambda: settings_mock)
+
+    assert limiting.rate_limit_endpoint(endpoint_mock := MagicMock()) is endpoint_mock
+
+    settings_mock.rate_limit.messages_per_second = 100
+    settings_mock.rate_limit.burst_time = 0.5
+    endpoint = limiting.rate_limit_endpoint(endpoint_mock)
+
+    assert endpoint.endpoint is endpoint_mock
+    assert endpoint.bucket.capacity == 50
+
+
+def test_rate_limit_endpoint_workers(monkeypatch):
+    settings_mock = MagicMock()
+    settings_mock.rate_limit.messages_per_second = 100
+    settings_mock.rate_limit.operator_code_messages_per_second = 10
+    settings_mock.rate_limit.operator_codes_messages_per_second = {900: 50}
+    settings_mock.rate_limit.burst_time = 1
+    settings_mock.workers = 4
+    monkeypatch.setattr(limiting, "get_settings", lambda: settings_mock)
+
+    endpoint = limiting.rate_limit_endpoint(MagicMock())
+
+    assert endpoint.bucket.rate == 25
+    assert endpoint.operator_code_rate == 2.5
+    assert endpoint.operator_codes_rates == {900: 12.5}
+
+
+def test_get_guarded_endpoint():
+    guarded_endpoint = create_guarded_endpoint(MagicMock())
+    endpoint = limiting.RateLimitedEndpoint(guarded_endpoint, None, None, {}, burst_time=1)
+
+    assert limiting.get_guarded_endpoint(endpoint) is guarded_endpoint
+    assert limiting.get_guarded_endpoint(MagicMock()) is None
@@ -5,7 +5,7 @@ from http import HTTPStatus
 
 import pytz
 
-from src.mailings import sending, endpoints
+from src.mailings import sending, endpoints, schedule
 from src.clients import schema as clients_schema
 from src.mailings import schema as mailings_schema
 from src.mailings import service as mailings_service
@@ -57,7 +57,8 @@ async def test_mailing_process(testing_database):
         clients_mobile_operator_codes=[900, 910, 999],
     )
     endpoint = SemiworkingEndpoint()
-    mailing = await mailings_service.create_mailing(testing_database, mailing, endpoint)
+    await schedule.Schedule.start(testing_database.bind, endpoint)
+    mailing = await mailings_service.create_mailing(testing_database, mailing)
 
     await endpoint.event.wait()
     sending_ = await sending.Sending.get_sending(mailing)
@@ -68,3 +69,4 @@ async def test_mailing_process(testing_database):
     await asyncio.sleep(0.5)
     assert endpoint.sended_messages_count == sended_count
     assert len(sending_.request_tasks) == 0
+    await schedule.Schedule.stop()
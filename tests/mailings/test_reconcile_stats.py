@@ -0,0 +1,12 @@
+from unittest.mock import AsyncMock, MagicMock
+
+from src.mailings import reconcile_stats
+
+
+async def test_reconcile_mailings_stats(monkeypatch):
+    monkeypatch.setattr(reconcile_stats, "get_async_engine", MagicMock())
+    monkeypatch.setattr(reconcile_stats.service, "rebuild_mailings_stats", rebuild_mock := AsyncMock())
+
+    await reconcile_stats.reconcile_mailings_stats()
+
+    rebuild_mock.assert_awaited_once()
@@ -0,0 +1,57 @@
+from unittest.mock import MagicMock
+
+from src.mailings import retry
+
+
+def test_exponential_backoff_delay(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    policy = retry.ExponentialBackoff(base_delay=1, max_delay=10)
+
+    assert [policy.get_delay(attempt, 0) for attempt in range(1, 7)] == [1, 2, 4, 8, 10, 10]
+
+
+def test_exponential_backoff_late_attempt(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    policy = retry.ExponentialBackoff(base_delay=0.5, max_delay=300)
+
+    assert policy.get_delay(2000, 0) == 300
+
+
+def test_exponential_backoff_full_jitter(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", uniform_mock := MagicMock(return_value=0.5))
+    policy = retry.ExponentialBackoff(base_delay=2, max_delay=100)
+
+    assert policy.get_delay(3, 0) == 0.5
+    uniform_mock.assert_called_once_with(0, 8)
+
+
+def test_exponential_backoff_retry_after(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    policy = retry.ExponentialBackoff(base_delay=1, max_delay=10)
+
+    assert policy.get_delay(1, 0, retry_after=30) == 30
+    assert policy.get_delay(4, 0, retry_after=3) == 8
+
+
+def test_exponential_backoff_limits(monkeypatch):
+    monkeypatch.setattr(retry.random, "uniform", lambda low, high: high)
+    policy = retry.ExponentialBackoff(base_delay=1, max_delay=10, max_attempts=3, max_elapsed_time=60)
+
+    assert policy.get_delay(2, 0) == 2
+    assert policy.get_delay(3, 0) is None
+    assert policy.get_delay(2, 59) is None
+    assert policy.get_delay(1, 0, retry_after=100) is None
+
+
+def test_get_retry_policy(monkeypatch):
+    settings_mock = MagicMock()
+    settings_mock.retry.base_delay = 3
+    settings_mock.retry.max_delay = 60
+    settings_mock.retry.max_attempts = 5
+    settings_mock.retry.max_elapsed_time = None
+    monkeypatch.setattr(retry, "get_settings", lambda: settings_mock)
+
+    policy = retry.get_retry_policy()
+
+    assert isinstance(policy, retry.ExponentialBackoff)
+    assert (policy.base_delay, policy.max_delay, policy.max_attempts, policy.max_elapsed_time) == (3, 60, 5, None)
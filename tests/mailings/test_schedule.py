@@ -1,33 +1,181 @@
+import asyncio
 import datetime
 from unittest.mock import MagicMock, AsyncMock
 
+import pytest
+
+from src import config
 from src.mailings import schedule
+from src.mailings import service as mailings_service
+from src.mailings.schema import MailingState
+from src.mailings.timers import DeadlineHeap
+
 
+async def endless_start(*args, **kwargs):
+    await asyncio.Event().wait()
 
-async def test_mailing_task(mailing, monkeypatch):
-    seconds_before_sending = 20
-    mailing.start_time += datetime.timedelta(seconds=seconds_before_sending)
-    mailing.end_time += datetime.timedelta(seconds=seconds_before_sending + 10)
 
+@pytest.fixture
+def sending_mock(monkeypatch):
     sending_mock = MagicMock()
     sending_mock.start = AsyncMock()
+    sending_mock.stop = AsyncMock()
     monkeypatch.setattr(schedule, "Sending", lambda *args, **kwargs: sending_mock)
-    monkeypatch.setattr(schedule.asyncio, "sleep", sleep_mock := AsyncMock())
+    monkeypatch.setattr(schedule, "AsyncSession", MagicMock())
+    monkeypatch.setattr(schedule.Schedule, "engine", MagicMock())
+    monkeypatch.setattr(schedule.Schedule, "endpoint", MagicMock())
+    monkeypatch.setattr(schedule.Schedule, "sending_tasks", {})
+    monkeypatch.setattr(schedule.Schedule, "claimed_mailings", set())
+    monkeypatch.setattr(schedule.Schedule, "starts", DeadlineHeap())
+    return sending_mock
+
 
-    await schedule.Schedule.mailing_task(AsyncMock(), mailing, AsyncMock())
+async def test_mailing_task(mailing, sending_mock, monkeypatch):
+    mailing.end_time = datetime.datetime.now() + datetime.timedelta(seconds=10)
+    monkeypatch.setattr(mailings_service, "release_mailing", release_mock := AsyncMock())
+
+    schedule.Schedule.claimed_mailings.add(mailing.id)
+    await schedule.Schedule.mailing_task(mailing)
 
-    sleep_mock.assert_awaited_once()
-    assert int(sleep_mock.await_args.args[0]) == seconds_before_sending - 1
     sending_mock.start.assert_awaited_once()
+    sending_mock.stop.assert_awaited_once()
+    release_mock.assert_awaited_once()
+    assert release_mock.await_args.args[1:] == (schedule.Schedule.worker_id, mailing, MailingState.finished)
+
+
+async def test_mailing_task_expired(mailing, sending_mock, monkeypatch):
+    sending_mock.start.side_effect = TimeoutError
+    monkeypatch.setattr(mailings_service, "release_mailing", release_mock := AsyncMock())
+
+    schedule.Schedule.claimed_mailings.add(mailing.id)
+    await schedule.Schedule.mailing_task(mailing)
+
+    sending_mock.stop.assert_awaited_once()
+    assert release_mock.await_args.args[1:] == (schedule.Schedule.worker_id, mailing, MailingState.cancelled)
+
+
+async def test_mailing_task_failed(mailing, sending_mock, monkeypatch):
+    mailing.end_time = datetime.datetime.now() + datetime.timedelta(seconds=10)
+    sending_mock.start.side_effect = RuntimeError
+    monkeypatch.setattr(mailings_service, "release_mailing", release_mock := AsyncMock())
+
+    schedule.Schedule.claimed_mailings.add(mailing.id)
+    await schedule.Schedule.mailing_task(mailing)
 
-    seconds_before_sending = 0
-    mailing.start_time = datetime.datetime.now() + datetime.timedelta(seconds=seconds_before_sending)
-    mailing.end_time = datetime.datetime.now() + datetime.timedelta(seconds=seconds_before_sending + 10)
+    sending_mock.stop.assert_awaited_once()
+    assert release_mock.await_args.args[1:] == (schedule.Schedule.worker_id, mailing, MailingState.scheduled)
 
-    sleep_mock.reset_mock()
-    sending_mock.start.reset_mock()
 
-    await schedule.Schedule.mailing_task(AsyncMock(), mailing, AsyncMock())
+async def test_delete_mailing_from_schedule(mailing, sending_mock, monkeypatch):
+    mailing.end_time = datetime.datetime.now() + datetime.timedelta(seconds=10)
+    sending_mock.start.side_effect = endless_start
+    monkeypatch.setattr(mailings_service, "release_mailing", release_mock := AsyncMock())
 
-    sleep_mock.assert_not_awaited()
+    task = asyncio.create_task(schedule.Schedule.mailing_task(mailing))
+    schedule.Schedule.sending_tasks[mailing.id] = task
+    await asyncio.sleep(0)
+
+    await schedule.Schedule.delete_mailing_from_schedule(mailing)
+
+    assert task.cancelled()
+    assert schedule.Schedule.sending_tasks == {}
+    sending_mock.stop.assert_awaited_once()
+    release_mock.assert_not_awaited()
+
+
+async def test_mailing_task_joined(mailing, sending_mock, monkeypatch):
+    mailing.end_time = datetime.datetime.now() + datetime.timedelta(seconds=10)
+    monkeypatch.setattr(mailings_service, "release_mailing", release_mock := AsyncMock())
+    monkeypatch.setattr(schedule, "Sending", sending_class_mock := MagicMock(return_value=sending_mock))
+
+    await schedule.Schedule.mailing_task(mailing)
+
+    sending_class_mock.assert_called_once_with(mailing, create_messages=False)
     sending_mock.start.assert_awaited_once()
+    release_mock.assert_not_awaited()
+
+
+async def test_claim_mailings(mailing, sending_mock, monkeypatch):
+    running_mailing = mailing.copy(update={"id": 1})
+    monkeypatch.setattr(mailings_service, "cancel_expired_mailings", cancel_mock := AsyncMock())
+    monkeypatch.setattr(mailings_service, "claim_due_mailings", AsyncMock(return_value=[mailing]))
+    monkeypatch.setattr(mailings_service, "get_running_mailings", AsyncMock(return_value=[mailing, running_mailing]))
+    next_start = datetime.datetime.now() + datetime.timedelta(minutes=1)
+    monkeypatch.setattr(mailings_service, "get_next_mailings_starts", AsyncMock(return_value=[(2, next_start)]))
+    monkeypatch.setattr(schedule.Schedule, "mailing_task", mailing_task_mock := AsyncMock())
+
+    assert await schedule.Schedule.claim_mailings(10, 30) == 1
+    await asyncio.gather(*schedule.Schedule.sending_tasks.values())
+
+    cancel_mock.assert_awaited_once()
+    assert mailing_task_mock.await_count == 2
+    assert list(schedule.Schedule.sending_tasks) == [mailing.id, running_mailing.id]
+    assert schedule.Schedule.claimed_mailings == {mailing.id}
+    assert schedule.Schedule.starts.next_deadline() == next_start.timestamp()
+
+
+async def test_load_starts(sending_mock, monkeypatch):
+    start_time = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=1)
+    pages = [[(1, start_time), (2, start_time)], [(3, start_time + datetime.timedelta(seconds=1))]]
+    settings = config.get_settings().copy(deep=True)
+    settings.stream_chunk_size = 2
+    monkeypatch.setattr(schedule, "get_settings", lambda: settings)
+    monkeypatch.setattr(mailings_service, "get_next_mailings_starts", starts_mock := AsyncMock(side_effect=pages))
+
+    assert await schedule.Schedule.load_starts(MagicMock()) == 3
+
+    assert starts_mock.await_count == 2
+    assert starts_mock.await_args.args[2] == (start_time, 2)
+    assert len(schedule.Schedule.starts) == 3
+    assert schedule.Schedule.starts.next_deadline() == start_time.timestamp()
+
+
+async def test_extend_leases(mailing, sending_mock, monkeypatch):
+    lost_task = asyncio.create_task(asyncio.Event().wait())
+    schedule.Schedule.sending_tasks.update({1: MagicMock(), 2: lost_task})
+    schedule.Schedule.claimed_mailings.update({1, 2})
+    sending_ = MagicMock(leased_messages={10, 11})
+    monkeypatch.setattr(schedule, "Sending", MagicMock(sendings={1: sending_}))
+    monkeypatch.setattr(mailings_service, "extend_messages_lease", extend_messages_mock := AsyncMock())
+    monkeypatch.setattr(mailings_service, "extend_mailings_lease", AsyncMock(return_value=[1]))
+
+    await schedule.Schedule.extend_leases(30)
+    await asyncio.gather(lost_task, return_exceptions=True)
+
+    assert sorted(extend_messages_mock.await_args.args[1]) == [10, 11]
+    assert lost_task.cancelled()
+    assert list(schedule.Schedule.sending_tasks) == [1]
+    assert schedule.Schedule.claimed_mailings == {1}
+
+
+async def test_add_mailing_to_schedule(mailing, sending_mock):
+    mailing.start_time = datetime.datetime.now() + datetime.timedelta(minutes=1)
+    mailing.end_time = datetime.datetime.now() + datetime.timedelta(minutes=2)
+    later_mailing = mailing.copy(update={"id": 1, "start_time": mailing.start_time + datetime.timedelta(seconds=1)})
+    schedule.Schedule.wakeup.clear()
+
+    schedule.Schedule.add_mailing_to_schedule(later_mailing)
+    schedule.Schedule.wakeup.clear()
+    schedule.Schedule.add_mailing_to_schedule(mailing)
+
+    assert schedule.Schedule.wakeup.is_set()
+    assert schedule.Schedule.starts.next_deadline() == mailing.start_time.timestamp()
+
+    schedule.Schedule.wakeup.clear()
+    schedule.Schedule.add_mailing_to_schedule(later_mailing)
+
+    assert not schedule.Schedule.wakeup.is_set()
+
+    await schedule.Schedule.delete_mailing_from_schedule(mailing)
+
+    assert schedule.Schedule.starts.next_deadline() == later_mailing.start_time.timestamp()
+
+
+async def test_add_expired_mailing_to_schedule(mailing, sending_mock):
+    mailing.end_time = datetime.datetime.now() - datetime.timedelta(minutes=1)
+    schedule.Schedule.wakeup.clear()
+
+    schedule.Schedule.add_mailing_to_schedule(mailing)
+
+    assert not schedule.Schedule.wakeup.is_set()
+    assert mailing.id not in schedule.Schedule.starts
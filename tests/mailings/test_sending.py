@@ -1,28 +1,201 @@
+import asyncio
+import datetime
+from http import HTTPStatus
 from unittest.mock import AsyncMock, MagicMock
 
+import aiohttp
+import pytest
+
 from src import config
-from src.mailings import sending
+from src.mailings import sending, schema, endpoints, retry
 from src.mailings import service as mailings_service
 from src.clients import service as clients_service
 
 
+def stream_clients(chunks):
+    async def stream(*args, **kwargs):
+        for chunk in chunks:
+            yield chunk
+    return stream
+
+
 async def test_get_sending(mailing):
     sending_ = sending.Sending(mailing)
     assert await sending.Sending.get_sending(mailing) == sending_
 
 
+def claim_messages(chunks):
+    chunks = list(chunks)
+
+    async def claim(*args, **kwargs):
+        return chunks.pop(0) if chunks else []
+    return claim
+
+
+async def get_clients_by_ids(db, clients_ids):
+    return [MagicMock(id=client_id) for client_id in clients_ids]
+
+
 async def test_start(mailing, monkeypatch):
+    sending_ = sending.Sending(mailing, create_messages=False)
+
+    clients = [MagicMock(id=i) for i in range(6)]
+    messages = [MagicMock(id=client.id, client_id=client.id) for client in clients]
+
+    monkeypatch.setattr(mailings_service, "claim_pending_messages",
+                        claim_mock := AsyncMock(side_effect=claim_messages([messages])))
+    monkeypatch.setattr(clients_service, "get_clients_by_ids", AsyncMock(return_value=clients))
+    monkeypatch.setattr(sending_, "_send", send_mock := AsyncMock())
+
+    await sending_.start(AsyncMock(), endpoint_mock := MagicMock())
+
+    assert claim_mock.await_count == 2
+    assert len(sending_.request_tasks) == config.get_settings().max_requests_at_time + 1
+    assert send_mock.await_count == len(clients)
+    for message, client in zip(messages, clients):
+        send_mock.assert_any_await(endpoint_mock, message, client)
+    assert sending_.leased_messages == {message.id for message in messages}
+    await sending_.stop()
+
+
+async def test_start_delivery_window(mailing, monkeypatch):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    mailing.delivery_window_start = (now - datetime.timedelta(hours=1)).time()
+    mailing.delivery_window_end = (now + datetime.timedelta(hours=1)).time()
+    sending_ = sending.Sending(mailing, create_messages=False)
+    clients = [MagicMock(id=i) for i in range(2)]
+    messages = [MagicMock(id=client.id, client_id=client.id) for client in clients]
+
+    monkeypatch.setattr(mailings_service, "get_pending_messages_utc_offsets", AsyncMock(side_effect=[[0, 720], []]))
+    monkeypatch.setattr(mailings_service, "claim_pending_messages",
+                        claim_mock := AsyncMock(side_effect=claim_messages([messages])))
+    monkeypatch.setattr(clients_service, "get_clients_by_ids", AsyncMock(return_value=clients))
+    monkeypatch.setattr(sending_, "_send", send_mock := AsyncMock())
+
+    await sending_.start(AsyncMock(), MagicMock())
+
+    assert claim_mock.await_count == 2
+    assert claim_mock.await_args.args[4] == [0]
+    assert send_mock.await_count == len(clients)
+    await sending_.stop()
+
+
+async def test_get_idle_delay(mailing):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    mailing.delivery_window_start = (now + datetime.timedelta(minutes=30)).time()
+    mailing.delivery_window_end = (now + datetime.timedelta(hours=2)).time()
+    sending_ = sending.Sending(mailing)
+    sending_.utc_offsets = {0}
+
+    assert sending_._get_idle_delay(5) == 5
+    assert 29 * 60 < sending_._get_idle_delay(3600) <= 30 * 60
+
+    sending_.utc_offsets = {60}
+    assert sending_._get_idle_delay(3600) == 3600
+    await sending_.stop()
+
+
+async def test_start_chunks(mailing, monkeypatch):
+    sending_ = sending.Sending(mailing)
+    clients = [MagicMock(id=i) for i in range(5)]
+    messages = [MagicMock(id=client.id, client_id=client.id) for client in clients]
+
+    settings = config.get_settings().copy(deep=True)
+    settings.sending.queue_size = 1
+    settings.max_requests_at_time = 2
+    settings.scheduler.poll_interval = 0
+    monkeypatch.setattr(sending, "get_settings", lambda: settings)
+    monkeypatch.setattr(clients_service, "stream_clients_by_tags_or_phone_codes",
+                        MagicMock(side_effect=stream_clients([clients[:2], clients[2:4], clients[4:]])))
+    monkeypatch.setattr(mailings_service, "create_messages", create_messages_mock := AsyncMock())
+    monkeypatch.setattr(mailings_service, "claim_pending_messages",
+                        AsyncMock(side_effect=claim_messages([messages[:2], [], messages[2:]])))
+    monkeypatch.setattr(mailings_service, "has_pending_messages", has_pending_mock := AsyncMock(return_value=False))
+    monkeypatch.setattr(clients_service, "get_clients_by_ids", get_clients_by_ids)
+    monkeypatch.setattr(sending_, "_send", send_mock := AsyncMock())
+
+    await sending_.start(AsyncMock(), MagicMock())
+
+    assert create_messages_mock.await_count == 3
+    has_pending_mock.assert_awaited()
+    assert len(sending_.request_tasks) == settings.max_requests_at_time + 1
+    assert send_mock.await_count == len(clients)
+    await sending_.stop()
+
+
+async def test_start_claims_created_chunks(mailing, monkeypatch):
     sending_ = sending.Sending(mailing)
+    clients = [MagicMock(id=i) for i in range(4)]
+    pending_messages = []
+
+    async def stream(*args, **kwargs):
+        for chunk in (clients[:2], clients[2:]):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def create_messages(db, mailing_, clients_chunk, delivery_window):
+        pending_messages.extend(MagicMock(id=client.id, client_id=client.id) for client in clients_chunk)
+
+    async def claim_pending_messages(*args):
+        claimed_messages = list(pending_messages)
+        pending_messages.clear()
+        return claimed_messages
+
+    settings = config.get_settings().copy(deep=True)
+    settings.scheduler.poll_interval = 60
+    monkeypatch.setattr(sending, "get_settings", lambda: settings)
+    monkeypatch.setattr(clients_service, "stream_clients_by_tags_or_phone_codes", stream)
+    monkeypatch.setattr(mailings_service, "create_messages", create_messages)
+    monkeypatch.setattr(mailings_service, "claim_pending_messages", claim_pending_messages)
+    monkeypatch.setattr(mailings_service, "has_pending_messages", AsyncMock(return_value=False))
+    monkeypatch.setattr(clients_service, "get_clients_by_ids", get_clients_by_ids)
+    monkeypatch.setattr(sending_, "_send", send_mock := AsyncMock())
+
+    await asyncio.wait_for(sending_.start(AsyncMock(), MagicMock()), 1)
+
+    assert send_mock.await_count == len(clients)
+    await sending_.stop()
+
 
-    monkeypatch.setattr(clients_service, "get_clients_by_tags", get_client_by_tags_mock := AsyncMock(return_value=[1, 2, 3]))
-    monkeypatch.setattr(clients_service, "get_clients_by_phone_codes", get_client_by_phone_mock := AsyncMock(return_value=[4, 5, 6]))
-    monkeypatch.setattr(mailings_service, "create_message", create_message_mock := AsyncMock())
+async def test_start_deleted_client(mailing, monkeypatch):
+    sending_ = sending.Sending(mailing, create_messages=False)
+    message = MagicMock(id=1, client_id=1)
+
+    monkeypatch.setattr(mailings_service, "claim_pending_messages", AsyncMock(side_effect=claim_messages([[message]])))
+    monkeypatch.setattr(clients_service, "get_clients_by_ids", AsyncMock(return_value=[]))
+    monkeypatch.setattr(sending_, "_send", send_mock := AsyncMock())
+    sending_.statuses_buffer = AsyncMock()
 
     await sending_.start(AsyncMock(), MagicMock())
 
-    get_client_by_tags_mock.assert_called()
-    get_client_by_phone_mock.assert_called()
-    create_message_mock.assert_called()
+    send_mock.assert_not_awaited()
+    sending_.statuses_buffer.add.assert_awaited_once_with(message.id, schema.MessageStatus.failed)
+    assert sending_.leased_messages == set()
+
+
+async def test_stop_cancels_workers(mailing, monkeypatch):
+    sending_ = sending.Sending(mailing, create_messages=False)
+    clients = [MagicMock(id=i) for i in range(3)]
+    messages = [MagicMock(client_id=client.id) for client in clients]
+
+    async def endless_send(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(mailings_service, "claim_pending_messages", AsyncMock(side_effect=claim_messages([messages])))
+    monkeypatch.setattr(clients_service, "get_clients_by_ids", AsyncMock(return_value=clients))
+    monkeypatch.setattr(sending_, "_send", endless_send)
+
+    start_task = asyncio.create_task(sending_.start(AsyncMock(), MagicMock()))
+    while len(sending_.request_tasks) <= config.get_settings().max_requests_at_time:
+        await asyncio.sleep(0)
+    tasks = list(sending_.request_tasks)
+    await sending_.stop()
+    await asyncio.gather(start_task, *tasks, return_exceptions=True)
+
+    assert all(task.cancelled() or task.done() for task in tasks)
+    assert start_task.done()
+    assert sending_.request_tasks == []
+    assert await sending.Sending.get_sending(mailing) is None
 
 
 async def test_stop(mailing):
@@ -30,11 +203,13 @@ async def test_stop(mailing):
 
     request_tasks = [MagicMock() for _ in range(3)]
     sending_.request_tasks = request_tasks
+    sending_.statuses_buffer = AsyncMock()
 
     await sending_.stop()
 
     for task in request_tasks:
         task.cancel.assert_called()
+    sending_.statuses_buffer.close.assert_awaited_once()
 
 
 async def test_send_timeout(mailing, monkeypatch):
@@ -42,14 +217,209 @@ async def test_send_timeout(mailing, monkeypatch):
     settings_mock.successful_status_codes = [200]
 
     endpoint_mock = MagicMock()
-    endpoint_mock.send = AsyncMock(return_value=200)
+    endpoint_mock.send = AsyncMock(side_effect=[asyncio.TimeoutError(), 500, 200])
+
+    monkeypatch.setattr(sending, "get_settings", lambda: settings_mock)
+    monkeypatch.setattr(sending.asyncio, "sleep", sleep_mock := AsyncMock())
+
+    sending_ = sending.Sending(mailing, retry_policy := MagicMock())
+    retry_policy.get_delay = MagicMock(return_value=5)
+    sending_.statuses_buffer = AsyncMock()
+    await sending_._send(endpoint_mock, message_mock := MagicMock(), MagicMock())
 
-    monkeypatch.setattr(config, "get_settings", lambda: settings_mock)
+    assert sleep_mock.await_count == 2
+    sleep_mock.assert_awaited_with(5)
+    assert [call.args[0] for call in retry_policy.get_delay.call_args_list] == [1, 2]
+    assert endpoint_mock.send.await_count == 3
+    sending_.statuses_buffer.add.assert_awaited_once_with(message_mock.id, schema.MessageStatus.delivered)
+
+
+async def test_send_retry_after_deadline(mailing, monkeypatch):
+    endpoint_mock = MagicMock()
+    endpoint_mock.send = AsyncMock(return_value=HTTPStatus.INTERNAL_SERVER_ERROR)
     monkeypatch.setattr(sending.asyncio, "sleep", sleep_mock := AsyncMock())
 
+    sending_ = sending.Sending(mailing, MagicMock(get_delay=MagicMock(return_value=10)))
+    sending_.deadline = asyncio.get_running_loop().time() + 5
+    sending_.statuses_buffer = AsyncMock()
+    await sending_._send(endpoint_mock, MagicMock(), MagicMock())
+
+    endpoint_mock.send.assert_awaited_once()
+    sleep_mock.assert_not_awaited()
+    sending_.statuses_buffer.add.assert_not_awaited()
+
+
+async def test_start_deadline(mailing, monkeypatch):
+    mailing.end_time = datetime.datetime.now() + datetime.timedelta(seconds=0.05)
     sending_ = sending.Sending(mailing)
-    await sending_._send(db_mock := AsyncMock(), endpoint_mock, MagicMock(), MagicMock())
+    clients = [MagicMock(id=i) for i in range(3)]
+    messages = [MagicMock(id=client.id, client_id=client.id) for client in clients]
+
+    async def endless_send(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(clients_service, "stream_clients_by_tags_or_phone_codes",
+                        MagicMock(side_effect=stream_clients([clients])))
+    monkeypatch.setattr(mailings_service, "create_messages", AsyncMock())
+    monkeypatch.setattr(mailings_service, "claim_pending_messages", AsyncMock(side_effect=claim_messages([messages])))
+    monkeypatch.setattr(clients_service, "get_clients_by_ids", AsyncMock(return_value=clients))
+    monkeypatch.setattr(mailings_service, "expire_messages", expire_mock := AsyncMock())
+    monkeypatch.setattr(sending_, "_send", endless_send)
+    sending_.statuses_buffer = AsyncMock()
+
+    with pytest.raises(TimeoutError):
+        await sending_.start(db_mock := AsyncMock(), MagicMock())
+
+    assert all(task.done() for task in sending_.request_tasks)
+    sending_.statuses_buffer.flush.assert_awaited()
+    expire_mock.assert_awaited_once_with(db_mock, mailing)
+    await sending_.stop()
+
+
+async def test_send_retry_after(mailing, monkeypatch):
+    endpoint_mock = MagicMock()
+    endpoint_mock.send = AsyncMock(side_effect=[
+        endpoints.RetryAfter(HTTPStatus.TOO_MANY_REQUESTS, 30),
+        HTTPStatus(200),
+    ])
+    monkeypatch.setattr(sending.asyncio, "sleep", sleep_mock := AsyncMock())
+
+    sending_ = sending.Sending(mailing, retry.ExponentialBackoff(base_delay=1, max_delay=1))
+    sending_.statuses_buffer = AsyncMock()
+    await sending_._send(endpoint_mock, message_mock := MagicMock(), MagicMock())
+
+    sleep_mock.assert_awaited_once_with(30)
+    sending_.statuses_buffer.add.assert_awaited_once_with(message_mock.id, schema.MessageStatus.delivered)
+
+
+async def test_send_failed(mailing, monkeypatch):
+    endpoint_mock = MagicMock()
+    endpoint_mock.send = AsyncMock(return_value=HTTPStatus(500))
+    monkeypatch.setattr(sending.asyncio, "sleep", sleep_mock := AsyncMock())
+
+    sending_ = sending.Sending(mailing, retry.ExponentialBackoff(base_delay=1, max_delay=10, max_attempts=3))
+    sending_.statuses_buffer = AsyncMock()
+    await sending_._send(endpoint_mock, message_mock := MagicMock(), MagicMock())
+
+    assert endpoint_mock.send.await_count == 3
+    assert sleep_mock.await_count == 2
+    sending_.statuses_buffer.add.assert_awaited_once_with(message_mock.id, schema.MessageStatus.failed)
+
+
+async def test_start_batch_mode(mailing, monkeypatch):
+    sending_ = sending.Sending(mailing, create_messages=False)
+    clients = [MagicMock(id=i) for i in range(5)]
+    messages = [MagicMock(client_id=client.id) for client in clients]
+
+    settings = config.get_settings().copy(deep=True)
+    settings.sending.batch_size = 2
+    settings.sending.batch_linger = 10
+    settings.max_requests_at_time = 1
+    monkeypatch.setattr(sending, "get_settings", lambda: settings)
+    monkeypatch.setattr(mailings_service, "claim_pending_messages", AsyncMock(side_effect=claim_messages([messages])))
+    monkeypatch.setattr(clients_service, "get_clients_by_ids", AsyncMock(return_value=clients))
+    monkeypatch.setattr(sending_, "_send", send_mock := AsyncMock())
+    monkeypatch.setattr(sending_, "_send_batch", send_batch_mock := AsyncMock())
+
+    await sending_.start(AsyncMock(), MagicMock())
+
+    send_mock.assert_not_awaited()
+    batches = [call.args[1] for call in send_batch_mock.await_args_list]
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert [message for batch in batches for message, _ in batch] == messages
+    await sending_.stop()
+
+
+async def test_batch_worker_linger(mailing, monkeypatch):
+    sending_ = sending.Sending(mailing)
+
+    settings = config.get_settings().copy(deep=True)
+    settings.sending.batch_size = 10
+    settings.sending.batch_linger = 0.01
+    monkeypatch.setattr(sending, "get_settings", lambda: settings)
+    monkeypatch.setattr(sending_, "_send_batch", send_batch_mock := AsyncMock())
+
+    queue = asyncio.Queue()
+    worker_task = asyncio.create_task(sending_._batch_worker(MagicMock(), queue))
+    queue.put_nowait(first_item := (MagicMock(), MagicMock()))
+    await asyncio.sleep(0.05)
+    queue.put_nowait(second_item := (MagicMock(), MagicMock()))
+    queue.put_nowait(None)
+    await worker_task
+
+    assert [call.args[1] for call in send_batch_mock.await_args_list] == [[first_item], [second_item]]
+
+
+async def test_send_batch(mailing, monkeypatch):
+    settings_mock = MagicMock()
+    settings_mock.successful_status_codes = [200]
+    monkeypatch.setattr(sending, "get_settings", lambda: settings_mock)
+    monkeypatch.setattr(sending.asyncio, "sleep", AsyncMock())
+
+    batch = [(MagicMock(), MagicMock()) for _ in range(3)]
+    endpoint_mock = MagicMock()
+    endpoint_mock.send_many = AsyncMock(side_effect=[
+        [HTTPStatus(200), HTTPStatus(500), HTTPStatus(200)],
+        asyncio.TimeoutError(),
+        [HTTPStatus(200)],
+    ])
+
+    sending_ = sending.Sending(mailing, retry.ExponentialBackoff(base_delay=1, max_delay=1))
+    sending_.statuses_buffer = AsyncMock()
+    await sending_._send_batch(endpoint_mock, batch)
+
+    assert endpoint_mock.send_many.await_args_list[1].args[0] == [batch[1]]
+    assert endpoint_mock.send_many.await_args_list[2].args[0] == [batch[1]]
+    assert [call.args[0] for call in sending_.statuses_buffer.add.await_args_list] == \
+           [batch[0][0].id, batch[2][0].id, batch[1][0].id]
+
+
+async def test_send_batch_fallback_error(mailing, monkeypatch):
+    settings_mock = MagicMock()
+    settings_mock.successful_status_codes = [200]
+    monkeypatch.setattr(sending, "get_settings", lambda: settings_mock)
+    monkeypatch.setattr(sending.asyncio, "sleep", AsyncMock())
+    monkeypatch.setattr(endpoints.Endpoint, "__abstractmethods__", set())
+
+    batch = [(MagicMock(id=i), MagicMock()) for i in range(3)]
+    failures = [aiohttp.ClientConnectionError()]
+
+    async def send(message, client, mailing_):
+        if message is batch[1][0] and failures:
+            raise failures.pop()
+        return HTTPStatus(200)
+
+    endpoint = endpoints.Endpoint()
+    monkeypatch.setattr(endpoint, "send", send_mock := AsyncMock(side_effect=send))
+
+    sending_ = sending.Sending(mailing, retry.ExponentialBackoff(base_delay=1, max_delay=1))
+    sending_.statuses_buffer = AsyncMock()
+    await sending_._send_batch(endpoint, batch)
+
+    assert [call.args[0] for call in send_mock.await_args_list] == \
+           [batch[0][0], batch[1][0], batch[2][0], batch[1][0]]
+    assert [call.args[0] for call in sending_.statuses_buffer.add.await_args_list] == [0, 2, 1]
+
+
+async def test_send_batch_failed(mailing, monkeypatch):
+    settings_mock = MagicMock()
+    settings_mock.successful_status_codes = [200]
+    monkeypatch.setattr(sending, "get_settings", lambda: settings_mock)
+    monkeypatch.setattr(sending.asyncio, "sleep", AsyncMock())
+
+    batch = [(MagicMock(), MagicMock()) for _ in range(2)]
+    endpoint_mock = MagicMock()
+    endpoint_mock.send_many = AsyncMock(side_effect=[
+        [HTTPStatus(200), HTTPStatus(500)],
+        endpoints.RetryAfter(HTTPStatus.SERVICE_UNAVAILABLE, 1),
+    ])
+
+    sending_ = sending.Sending(mailing, retry.ExponentialBackoff(base_delay=1, max_delay=1, max_attempts=2))
+    sending_.statuses_buffer = AsyncMock()
+    await sending_._send_batch(endpoint_mock, batch)
 
-    sleep_mock.assert_awaited()
-    endpoint_mock.send.assert_awaited()
-    db_mock.commit.assert_awaited()
+    assert endpoint_mock.send_many.await_count == 2
+    assert [call.args for call in sending_.statuses_buffer.add.await_args_list] == [
+        (batch[0][0].id, schema.MessageStatus.delivered),
+        (batch[1][0].id, schema.MessageStatus.failed),
+    ]
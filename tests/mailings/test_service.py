@@ -1,7 +1,9 @@
+import datetime
 from unittest.mock import AsyncMock, MagicMock
 
 from src.mailings import service, schema
 from src.mailings import crud
+from src.mailings.windows import DeliveryWindow
 from src.mailings.sending import Sending
 from src.mailings.schedule import Schedule
 
@@ -31,9 +33,7 @@ async def test_update_mailing_none(monkeypatch):
     expected_result = None
     monkeypatch.setattr(crud, "get_mailing_by_id", crud_mock := AsyncMock(return_value=None))
 
-    result = await service.update_mailing(db_mock := AsyncMock(),
-                                          mailing_mock := MagicMock(),
-                                          AsyncMock())
+    result = await service.update_mailing(db_mock := AsyncMock(), mailing_mock := MagicMock())
 
     assert result == expected_result
     crud_mock.assert_awaited_once_with(db_mock, mailing_mock.id)
@@ -47,9 +47,9 @@ async def test_update_mailing_stop_sending(monkeypatch):
     monkeypatch.setattr(Sending, "get_sending", AsyncMock(return_value=sending_mock))
     monkeypatch.setattr(crud, "update_mailing", AsyncMock(return_value=None))
     monkeypatch.setattr(schema.Mailing, "from_orm", MagicMock())
-    monkeypatch.setattr(Schedule, "add_mailing_to_schedule", AsyncMock())
+    monkeypatch.setattr(Schedule, "add_mailing_to_schedule", MagicMock())
 
-    await service.update_mailing(AsyncMock(), AsyncMock(), AsyncMock())
+    await service.update_mailing(AsyncMock(), AsyncMock())
     sending_mock.stop.assert_awaited_once_with()
 
 
@@ -63,3 +63,67 @@ async def test_create_message(monkeypatch):
     assert result == expected_result
     crud_mock.assert_awaited_once()
     schema_mock.assert_called_once()
+
+
+async def test_create_messages(monkeypatch):
+    db_messages = ["message1", "message2"]
+    monkeypatch.setattr(crud, "create_messages", crud_mock := AsyncMock(return_value=db_messages))
+    monkeypatch.setattr(schema.Message, "from_orm", schema_mock := MagicMock(side_effect=lambda x: f"{x} schema"))
+
+    result = await service.create_messages(db_mock := AsyncMock(), mailing_mock := MagicMock(), clients := [MagicMock()])
+
+    assert result == ["message1 schema", "message2 schema"]
+    crud_mock.assert_awaited_once_with(db_mock, mailing_mock, clients, None)
+    assert schema_mock.call_count == len(db_messages)
+
+
+async def test_create_messages_delivery_window(monkeypatch):
+    monkeypatch.setattr(crud, "create_messages", crud_mock := AsyncMock(return_value=[]))
+    window = DeliveryWindow(datetime.time(9), datetime.time(21), datetime.datetime(2023, 1, 27))
+    monkeypatch.setattr(window, "get_utc_offset", offset_mock := MagicMock(return_value=180))
+    clients = [MagicMock(timezone="Europe/Moscow") for _ in range(3)]
+
+    await service.create_messages(AsyncMock(), MagicMock(), clients, window)
+
+    assert crud_mock.await_args.args[3] == {"Europe/Moscow": 180}
+    offset_mock.assert_called_once_with("Europe/Moscow")
+
+
+async def test_change_messages_status(monkeypatch):
+    monkeypatch.setattr(crud, "change_messages_status", crud_mock := AsyncMock())
+
+    await service.change_messages_status(db_mock := AsyncMock(), ids := [1, 2], schema.MessageStatus.delivered)
+
+    crud_mock.assert_awaited_once_with(db_mock, ids, schema.MessageStatus.delivered)
+
+
+async def test_get_mailing_stats(monkeypatch):
+    messages = [MagicMock(id=i) for i in range(3)]
+    monkeypatch.setattr(service, "get_mailing_messages", get_messages_mock := AsyncMock(return_value=messages))
+    monkeypatch.setattr(schema, "DetailMailingStats", schema_mock := MagicMock())
+
+    await service.get_mailing_stats(db_mock := AsyncMock(), mailing_mock := MagicMock(),
+                                    schema.MessageStatus.failed, after_id=5, limit=2)
+
+    get_messages_mock.assert_awaited_once_with(db_mock, mailing_mock.id, schema.MessageStatus.failed, 5, 3)
+    schema_mock.assert_called_once_with(mailing=mailing_mock, messages=messages[:2], next_after_id=1)
+
+    get_messages_mock.return_value = messages[:2]
+    schema_mock.reset_mock()
+
+    await service.get_mailing_stats(db_mock, mailing_mock, limit=2)
+
+    schema_mock.assert_called_once_with(mailing=mailing_mock, messages=messages[:2], next_after_id=None)
+
+
+async def test_stream_mailing_messages(monkeypatch):
+    async def stream_messages(*args):
+        yield ["message1", "message2"]
+        yield ["message3"]
+
+    monkeypatch.setattr(crud, "stream_mailing_messages", stream_messages)
+    monkeypatch.setattr(schema.Message, "from_orm", MagicMock(side_effect=lambda x: f"{x} schema"))
+
+    result = [chunk async for chunk in service.stream_mailing_messages(AsyncMock(), 1, None, None, 2)]
+
+    assert result == [["message1 schema", "message2 schema"], ["message3 schema"]]
@@ -1,27 +1,29 @@
 import datetime
 from unittest.mock import AsyncMock
 
-from src.mailings import schema, service as mailings_service
+from src.mailings import schema, service as mailings_service, models
 
 
 async def test_get_stats(clear_testing_database, monkeypatch):
-    mailings_list = [schema.Mailing(id=i, text="Mailing text", start_time=datetime.datetime.now(),
-                               end_time=datetime.datetime.now()) for i in range(3)]
-    messages = [
-        schema.Message(id=0, created_at=datetime.datetime.now(), status=schema.MessageStatus.delivered, mailing_id=0,
-                       client_id=0),  # messages should contain NOT all MessageStatus'es
+    mailings_list = [models.Mailing(id=i, text="Mailing text", start_time=datetime.datetime.now(),
+                                    end_time=datetime.datetime.now(), clients_tags=[],
+                                    clients_mobile_operator_codes=[]) for i in range(3)]
+    messages_count = [
+        (mailings_list[0], schema.MessageStatus.delivered, 1),
+        (mailings_list[0], schema.MessageStatus.failed, 2),
+        (mailings_list[1], schema.MessageStatus.delivered, 1),
+        (mailings_list[2], None, 0),  # mailing without messages
     ]
 
-    monkeypatch.setattr(mailings_service, "get_all_mailings", AsyncMock(return_value=mailings_list))
-    monkeypatch.setattr(mailings_service, "get_mailing_messages", AsyncMock(return_value=messages))
-
-    messages_stats = {
-        schema.MessageStatus.delivered: 1,
-        schema.MessageStatus.not_delivered: 0
-    }
-
-    expected_result = [schema.MailingStats(mailing=mailing, messages=messages_stats) for mailing in mailings_list]
+    monkeypatch.setattr(mailings_service.crud, "get_mailings_messages_count", AsyncMock(return_value=messages_count))
 
     result = await mailings_service.get_stats(AsyncMock())
 
-    assert result == expected_result
+    assert [stats.mailing.id for stats in result] == [0, 1, 2]
+    assert result[0].messages == {
+        schema.MessageStatus.delivered: 1,
+        schema.MessageStatus.not_delivered: 0,
+        schema.MessageStatus.failed: 2,
+    }
+    assert result[1].messages[schema.MessageStatus.delivered] == 1
+    assert result[2].messages == {status: 0 for status in schema.MessageStatus}
@@ -0,0 +1,144 @@
+import asyncio
+from unittest.mock import AsyncMock, call
+
+import pytest
+
+from src.mailings import status_buffer, schema
+from src.mailings import service as mailings_service
+
+
+async def test_flush(monkeypatch):
+    monkeypatch.setattr(mailings_service, "change_messages_status", change_status_mock := AsyncMock())
+
+    buffer = status_buffer.StatusBuffer(max_size=10, flush_interval=60)
+    await buffer.add(1, schema.MessageStatus.delivered)
+    await buffer.flush()
+
+    change_status_mock.assert_not_awaited()
+
+    buffer.db = db_mock = AsyncMock()
+    await buffer.add(2, schema.MessageStatus.not_delivered)
+    await buffer.add(3, schema.MessageStatus.delivered)
+    await buffer.flush()
+
+    change_status_mock.assert_has_awaits([
+        call(db_mock, [1, 3], schema.MessageStatus.delivered),
+        call(db_mock, [2], schema.MessageStatus.not_delivered),
+    ], any_order=True)
+    assert buffer.size == 0
+
+    change_status_mock.reset_mock()
+    await buffer.flush()
+
+    change_status_mock.assert_not_awaited()
+
+
+async def test_add_flushes_full_buffer(monkeypatch):
+    monkeypatch.setattr(mailings_service, "change_messages_status", change_status_mock := AsyncMock())
+
+    buffer = status_buffer.StatusBuffer(max_size=3, flush_interval=60)
+    buffer.db = db_mock = AsyncMock()
+    for message_id in range(2):
+        await buffer.add(message_id, schema.MessageStatus.delivered)
+
+    change_status_mock.assert_not_awaited()
+
+    await buffer.add(2, schema.MessageStatus.delivered)
+
+    change_status_mock.assert_awaited_once_with(db_mock, [0, 1, 2], schema.MessageStatus.delivered)
+
+
+async def test_periodic_flush_and_close(monkeypatch):
+    monkeypatch.setattr(mailings_service, "change_messages_status", change_status_mock := AsyncMock())
+
+    buffer = status_buffer.StatusBuffer(max_size=100, flush_interval=0.01)
+    buffer.start(AsyncMock())
+    buffer_db = buffer.db
+    await buffer.add(1, schema.MessageStatus.delivered)
+    await asyncio.sleep(0.05)
+
+    change_status_mock.assert_awaited_once_with(buffer_db, [1], schema.MessageStatus.delivered)
+
+    await buffer.add(2, schema.MessageStatus.delivered)
+    await buffer.close()
+
+    change_status_mock.assert_awaited_with(buffer_db, [2], schema.MessageStatus.delivered)
+    assert buffer.flushing_task is None
+    assert buffer.db is None
+
+
+async def test_flush_failed(monkeypatch):
+    monkeypatch.setattr(mailings_service, "change_messages_status",
+                        change_status_mock := AsyncMock(side_effect=[None, RuntimeError, None, None]))
+
+    buffer = status_buffer.StatusBuffer(max_size=10, flush_interval=60)
+    buffer.db = db_mock = AsyncMock()
+    await buffer.add(1, schema.MessageStatus.delivered)
+    await buffer.add(2, schema.MessageStatus.failed)
+    with pytest.raises(RuntimeError):
+        await buffer.flush()
+
+    db_mock.rollback.assert_awaited_once()
+    assert buffer.size == 1
+
+    await buffer.add(3, schema.MessageStatus.delivered)
+    await buffer.flush()
+
+    change_status_mock.assert_has_awaits([
+        call(db_mock, [2], schema.MessageStatus.failed),
+        call(db_mock, [3], schema.MessageStatus.delivered),
+    ], any_order=True)
+    assert buffer.size == 0
+
+
+async def test_periodic_flush_failed(monkeypatch):
+    monkeypatch.setattr(mailings_service, "change_messages_status",
+                        change_status_mock := AsyncMock(side_effect=[RuntimeError, None]))
+
+    buffer = status_buffer.StatusBuffer(max_size=100, flush_interval=0.01)
+    buffer.start(AsyncMock())
+    buffer_db = buffer.db
+    await buffer.add(1, schema.MessageStatus.delivered)
+    await asyncio.sleep(0.05)
+
+    assert change_status_mock.await_count == 2
+    change_status_mock.assert_awaited_with(buffer_db, [1], schema.MessageStatus.delivered)
+    assert not buffer.flushing_task.done()
+    await buffer.close()
+
+
+async def test_flush_cancelled(monkeypatch):
+    flush_started = asyncio.Event()
+
+    async def change_messages_status(*args):
+        flush_started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(mailings_service, "change_messages_status", AsyncMock(side_effect=change_messages_status))
+
+    buffer = status_buffer.StatusBuffer(max_size=2, flush_interval=60)
+    buffer.db = db_mock = AsyncMock()
+    await buffer.add(1, schema.MessageStatus.delivered)
+    adding_task = asyncio.create_task(buffer.add(2, schema.MessageStatus.delivered))
+    await flush_started.wait()
+    adding_task.cancel()
+    await asyncio.gather(adding_task, return_exceptions=True)
+
+    assert adding_task.cancelled()
+    db_mock.rollback.assert_awaited_once()
+    assert buffer.size == 2
+    assert buffer.statuses[schema.MessageStatus.delivered] == [1, 2]
+
+
+async def test_close_waits_flushing_task(monkeypatch):
+    monkeypatch.setattr(mailings_service, "change_messages_status", change_status_mock := AsyncMock())
+
+    buffer = status_buffer.StatusBuffer(max_size=100, flush_interval=60)
+    buffer.start(AsyncMock())
+    flushing_task = buffer.flushing_task
+    await buffer.add(1, schema.MessageStatus.delivered)
+    buffer_db = buffer.db
+    await buffer.close()
+
+    assert flushing_task.done()
+    change_status_mock.assert_awaited_once_with(buffer_db, [1], schema.MessageStatus.delivered)
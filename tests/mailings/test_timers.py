@@ -0,0 +1,38 @@
+from src.mailings.timers import DeadlineHeap
+
+
+def test_pop_due():
+    deadlines = DeadlineHeap()
+    for key, deadline in (("third", 30), ("first", 10), ("second", 20)):
+        deadlines.push(key, deadline)
+
+    assert deadlines.next_deadline() == 10
+    assert deadlines.pop_due(20) == ["first", "second"]
+    assert deadlines.pop_due(25) == []
+    assert len(deadlines) == 1
+    assert deadlines.next_deadline() == 30
+
+
+def test_reschedule_and_cancel():
+    deadlines = DeadlineHeap()
+    deadlines.push("first", 10)
+    deadlines.push("second", 20)
+
+    deadlines.push("first", 30)
+    assert deadlines.next_deadline() == 20
+
+    deadlines.cancel("second")
+    deadlines.cancel("unknown")
+    assert "second" not in deadlines
+    assert deadlines.next_deadline() == 30
+    assert deadlines.pop_due(100) == ["first"]
+    assert deadlines.next_deadline() is None
+
+
+def test_compact():
+    deadlines = DeadlineHeap()
+    for deadline in range(1000):
+        deadlines.push("key", deadline)
+
+    assert len(deadlines.heap) < 100
+    assert deadlines.pop_due(1000) == ["key"]
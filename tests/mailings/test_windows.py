@@ -0,0 +1,49 @@
+from datetime import datetime, time, timedelta, timezone
+
+from src.mailings.windows import DeliveryWindow
+
+
+def test_get_utc_offset():
+    window = DeliveryWindow(time(9), time(21), datetime(2023, 1, 27, 12, tzinfo=timezone.utc))
+
+    assert window.get_utc_offset("Europe/Moscow") == 180
+    assert window.get_utc_offset("Asia/Kolkata") == 330
+    assert window.get_utc_offset("America/New_York") == -300
+    assert window.utc_offsets == {"Europe/Moscow": 180, "Asia/Kolkata": 330, "America/New_York": -300}
+
+
+def test_get_utc_offset_daylight_saving_time():
+    window = DeliveryWindow(time(9), time(21), datetime(2023, 7, 1, 12, tzinfo=timezone.utc))
+
+    assert window.get_utc_offset("Europe/Amsterdam") == 120
+
+
+def test_is_open():
+    window = DeliveryWindow(time(9), time(21), datetime(2023, 1, 27, tzinfo=timezone.utc))
+    now = datetime(2023, 1, 27, 8, 30, tzinfo=timezone.utc)
+
+    assert not window.is_open(0, now)
+    assert window.is_open(60, now)
+    assert window.is_open(720, now)
+    assert not window.is_open(780, now)
+    assert window.get_open_offsets([0, 60, 180, 780], now) == [60, 180]
+
+
+def test_is_open_over_midnight():
+    window = DeliveryWindow(time(22), time(2), datetime(2023, 1, 27, tzinfo=timezone.utc))
+    now = datetime(2023, 1, 27, 23, 30, tzinfo=timezone.utc)
+
+    assert window.is_open(0, now)
+    assert window.is_open(120, now)
+    assert not window.is_open(180, now)
+    assert not window.is_open(-120, now)
+
+
+def test_get_next_opening():
+    window = DeliveryWindow(time(9), time(21), datetime(2023, 1, 27, tzinfo=timezone.utc))
+    now = datetime(2023, 1, 27, 8, 30, tzinfo=timezone.utc)
+
+    assert window.get_next_opening([0, -60, 60], now) == now + timedelta(minutes=30)
+    assert window.get_next_opening([780], now) == now + timedelta(hours=11, minutes=30)
+    assert window.get_next_opening([60], now) is None
+    assert window.get_next_opening([], now) is None
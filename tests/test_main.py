@@ -3,13 +3,11 @@ from unittest.mock import AsyncMock, MagicMock
 
 import pytest
 from asgi_lifespan import LifespanManager
-from sqlalchemy.ext.asyncio import AsyncSession
 
 from src import main, database
 from src import dependencies
 from src.mailings import schedule
 from src.clients import schema as clients_schema
-from src.mailings import events as mailings_events
 
 
 @pytest.fixture(autouse=True)
@@ -28,22 +26,16 @@ async def test_get_db(monkeypatch):
 
 
 async def test_startup_shutdown(monkeypatch):
-    mock_db = AsyncMock(spec=AsyncSession)
-    mock_close = AsyncMock(spec=AsyncSession.close)
-    mock_db.close = mock_close
-
-    async def mock_get_db():
-        return mock_db
-
-    monkeypatch.setattr(mailings_events, "get_db", mock_get_db)
-    monkeypatch.setattr(mailings_events, "get_all_mailings", mock_get_mailings := AsyncMock(return_value=(1, 2, 3)))
-    monkeypatch.setattr(schedule.Schedule, "add_mailing_to_schedule", mock_mailing_to_schedule := AsyncMock())
+    monkeypatch.setattr(schedule.Schedule, "load_starts", mock_load_starts := AsyncMock(return_value=0))
+    monkeypatch.setattr(schedule.Schedule, "start", mock_start := AsyncMock())
+    monkeypatch.setattr(schedule.Schedule, "stop", mock_stop := AsyncMock())
 
     async with LifespanManager(main.app):
         pass
 
-    mock_get_mailings.assert_awaited()
-    mock_mailing_to_schedule.assert_awaited()
+    mock_load_starts.assert_awaited_once()
+    mock_start.assert_awaited_once()
+    mock_stop.assert_awaited_once()
 
 
 async def test_create_client_200(client):
@@ -200,6 +192,68 @@ async def test_get_clients_422(client):
     assert response.status_code == 422
 
 
+async def test_get_clients_after_id_200(client):
+    response = await client.get("clients/", params={"after_id": 1})
+    result = response.json()
+
+    assert response.status_code == 200
+    assert all(client["id"] > 1 for client in result)
+
+
+async def test_get_clients_pages_200(client):
+    all_clients = (await client.get("clients/", params={"limit": 1000})).json()
+
+    clients = []
+    params = {"limit": 1}
+    while True:
+        response = await client.get("clients/", params=params)
+        assert response.status_code == 200
+        clients += response.json()
+        if "x-next-cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["x-next-cursor"]
+
+    assert clients == all_clients
+
+
+async def test_get_clients_invalid_cursor_422(client):
+    response = await client.get("clients/", params={"cursor": "Invalid"})
+    assert response.status_code == 422
+
+
+async def test_export_clients_200(client):
+    response = await client.get("clients/export", params={"format": "csv", "phone_operator_code": 910})
+    lines = response.text.splitlines()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    assert lines[0] == "id,phone_number,phone_operator_code,timezone,tag"
+    assert all(line.split(",")[2] == "910" for line in lines[1:])
+
+
+async def test_export_clients_422(client):
+    response = await client.get("clients/export", params={"format": "xml"})
+    assert response.status_code == 422
+
+
+async def test_import_clients_200(client):
+    content = "phone_number,phone_operator_code,timezone,tag\n" \
+              "+79001111111,900,Europe/Amsterdam,Imported tag\n" \
+              "+79001111111,900,Unknown,Imported tag\n"
+
+    response = await client.post("clients/bulk", content=content, headers={"content-type": "text/csv"})
+    result = response.json()
+
+    assert response.status_code == 200
+    assert result["created"] == 1
+    assert [error["row"] for error in result["errors"]] == [3]
+
+
+async def test_import_clients_415(client):
+    response = await client.post("clients/bulk", content="{}", headers={"content-type": "application/xml"})
+    assert response.status_code == 415
+
+
 async def test_delete_client_200(client):
     expected_result = {
         "id": 1,
@@ -241,7 +295,7 @@ async def test_create_mailing_200(client):
             910
         ]
     }
-    expected_result = {**copy.deepcopy(data), "id": 1}
+    expected_result = {**copy.deepcopy(data), "id": 1, "delivery_window_start": None, "delivery_window_end": None}
 
     response = await client.post("mailing/", json=data)
     result = response.json()
@@ -301,6 +355,55 @@ async def test_create_mailing_422(client):
     assert result == expected_result
 
 
+async def test_create_mailing_422_delivery_window(client):
+    data = {
+        "text": "Mailing text",
+        "start_time": "2023-01-27T01:37:40.164000+00:00",
+        "end_time": "2023-01-27T01:37:40.164000+00:00",
+        "delivery_window_start": "09:00:00",
+        "clients_tags": [
+            {
+                "text": "Any text"
+            }
+        ],
+        "clients_mobile_operator_codes": [
+            900,
+            910
+        ]
+    }
+
+    response = await client.post("mailing/", json=data)
+
+    assert response.status_code == 422
+
+
+async def test_update_mailing_delivery_window_200(client):
+    data = {
+        "id": 1,
+        "text": "Another text",
+        "start_time": "2023-01-27T01:37:40.164000+00:00",
+        "end_time": "2023-01-27T01:37:40.164000+00:00",
+        "delivery_window_start": "09:00:00",
+        "delivery_window_end": "21:00:00",
+        "clients_tags": [
+            {
+                "text": "Any text"
+            }
+        ],
+        "clients_mobile_operator_codes": [
+            900,
+            910
+        ]
+    }
+    expected_result = copy.deepcopy(data)
+
+    response = await client.put("mailing/", json=data)
+    result = response.json()
+
+    assert response.status_code == 200
+    assert result == expected_result
+
+
 # @pytest.mark.order(1)
 async def test_update_mailing_200(client):
     data = {
@@ -318,7 +421,7 @@ async def test_update_mailing_200(client):
             910
         ]
     }
-    expected_result = copy.deepcopy(data)
+    expected_result = {**copy.deepcopy(data), "delivery_window_start": None, "delivery_window_end": None}
 
     response = await client.put("mailing/", json=data)
     result = response.json()
@@ -377,6 +480,8 @@ async def test_get_mailing_200(client):
         "text": "Another text",
         "start_time": "2023-01-27T01:37:40.164000+00:00",
         "end_time": "2023-01-27T01:37:40.164000+00:00",
+        "delivery_window_start": None,
+        "delivery_window_end": None,
         "clients_tags": [
             {
                 "text": "Any text"
@@ -409,12 +514,16 @@ async def test_get_stats_200_not_empty(client):
         {
             "messages": {
                 "delivered": 0,
-                "not delivered": 0
+                "not delivered": 0,
+                "failed": 0,
+                "expired": 0
             },
             "mailing": {
                 "text": "Another text",
                 "start_time": "2023-01-27T01:37:40.164000+00:00",
                 "end_time": "2023-01-27T01:37:40.164000+00:00",
+                "delivery_window_start": None,
+                "delivery_window_end": None,
                 "id": 1,
                 "clients_tags": [
                     {
@@ -436,13 +545,25 @@ async def test_get_stats_200_not_empty(client):
     assert result == expected_result
 
 
+async def test_get_gateway_stats_200(client):
+    response = await client.get("stats/gateway")
+    result = response.json()
+
+    assert response.status_code == 200
+    assert result["circuit_state"] == "closed"
+    assert result["requests_in_flight"] == 0
+
+
 async def test_get_mailing_stats_200(client):
     expected_result = {
         "messages": [],
+        "next_after_id": None,
         "mailing": {
             "text": "Another text",
             "start_time": "2023-01-27T01:37:40.164000+00:00",
             "end_time": "2023-01-27T01:37:40.164000+00:00",
+            "delivery_window_start": None,
+            "delivery_window_end": None,
             "id": 1,
             "clients_tags": [
                 {
@@ -462,6 +583,19 @@ async def test_get_mailing_stats_200(client):
     assert result == expected_result
 
 
+async def test_stream_mailing_messages_200(client):
+    response = await client.get("stats/1/messages", params={"status": "delivered"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.text == ""
+
+
+async def test_stream_mailing_messages_404(client):
+    response = await client.get("stats/999999/messages")
+    assert response.status_code == 404
+
+
 async def test_get_mailing_stats_422(client):
     response = await client.get("stats/AnyString")
     assert response.status_code == 422
@@ -478,6 +612,8 @@ async def test_delete_mailing_200(client):
         "text": "Another text",
         "start_time": "2023-01-27T01:37:40.164000+00:00",
         "end_time": "2023-01-27T01:37:40.164000+00:00",
+        "delivery_window_start": None,
+        "delivery_window_end": None,
         "clients_tags": [
             {
                 "text": "Any text"
@@ -0,0 +1,40 @@
+from unittest.mock import AsyncMock, MagicMock
+
+from src import context, middleware
+
+
+SCOPE = {"type": "http", "method": "GET", "http_version": "1.1", "client": ("127.0.0.1", 5000)}
+
+
+async def test_request_logging_middleware(monkeypatch):
+    monkeypatch.setattr(middleware, "logger", logger_mock := MagicMock())
+    request_uuids = []
+
+    async def app(scope, receive, send):
+        request_uuids.append(context.request_uuid.get())
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": b"first", "more_body": True})
+        await send({"type": "http.response.body", "body": b"second"})
+
+    await middleware.RequestLoggingMiddleware(app)(SCOPE, AsyncMock(), send_mock := AsyncMock())
+
+    assert send_mock.await_count == 3
+    assert context.request_uuid.get() is None
+    received_log, response_log = (call.kwargs for call in logger_mock.bind.call_args_list)
+    assert received_log["request_uuid"] == response_log["request_uuid"] == request_uuids[0].hex
+    assert received_log["request_method"] == "GET"
+    assert received_log["client_host"] == "127.0.0.1"
+    assert response_log["status_code"] == 200
+    assert response_log["content_type"] == "text/plain"
+    assert response_log["duration_us"] >= 0
+
+
+async def test_request_logging_middleware_not_http(monkeypatch):
+    monkeypatch.setattr(middleware, "logger", logger_mock := MagicMock())
+    app = AsyncMock()
+    scope, receive, send = {"type": "lifespan"}, AsyncMock(), AsyncMock()
+
+    await middleware.RequestLoggingMiddleware(app)(scope, receive, send)
+
+    app.assert_awaited_once_with(scope, receive, send)
+    logger_mock.bind.assert_not_called()